@@ -0,0 +1,50 @@
+'''
+Throughput of the PDB parsers in hw2skeleton.io: the line-by-line object
+parser, the vectorized parser one file at a time, and the vectorized parser
+over chunks of files (what read_active_sites uses)
+
+usage: python benchmarks/bench_io.py [pdb directory] [repetitions]
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hw2skeleton import io
+
+
+def time_parser(parse, files, repetitions):
+    '''
+    Input: parser taking a list of file paths, list of files, number of passes
+    Output: best wall-clock seconds for one pass over all files
+    '''
+    best = float('inf')
+    for r in range(repetitions):
+        start = time.perf_counter()
+        parse(files)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def one_at_a_time(parse):
+    return lambda files: [parse(f) for f in files]
+
+
+def chunked(files, chunksize=64):
+    return [io.read_active_site_batch(files[i:i + chunksize]) for i in range(0, len(files), chunksize)]
+
+
+def main(dir='data', repetitions=5):
+    files = io.pdb_files(dir)
+    n_atoms = len(io.parse_files(files).atom_codes)
+
+    print("%d files, %d atoms, best of %d passes" % (len(files), n_atoms, repetitions))
+    for label, parse in [('read_active_site', one_at_a_time(io.read_active_site)),
+                         ('read_active_site_arrays', one_at_a_time(io.read_active_site_arrays)),
+                         ('read_active_site_batch', chunked)]:
+        seconds = time_parser(parse, files, repetitions)
+        print("%-24s %8.1f files/s %10.0f atoms/s" % (label, len(files)/seconds, n_atoms/seconds))
+
+
+if __name__ == '__main__':
+    main(*(sys.argv[1:2]), *[int(a) for a in sys.argv[2:3]])
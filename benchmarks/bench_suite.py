@@ -0,0 +1,200 @@
+'''
+Wall-clock time, peak traced memory and scaling of the main entry points
+(ingestion, bulk similarity, partitioning, hierarchical clustering, quality
+index and the cluster number sweep) on synthetic corpora of growing size
+
+Every operation is timed (best of --repetitions) without tracing, then run
+once more under tracemalloc for its peak allocation. Operations whose cost
+or memory is quadratic are skipped above the size in LIMITS. The scaling
+exponent is the slope of log(time) against log(n) over the sizes run.
+
+Results can be saved as a baseline (JSON) and later runs checked against
+it: any time more than --tolerance times its baseline is reported as a
+regression and the exit status is 1. benchmarks/baseline.json was recorded
+at 1k and 10k sites on a single-core machine; save a new one on the
+hardware you compare on.
+
+usage: python benchmarks/bench_suite.py [--sizes 1000 10000 100000]
+       [--save benchmarks/baseline.json | --check benchmarks/baseline.json]
+'''
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hw2skeleton import cluster, io
+from hw2skeleton.similarity import SimilarityMatrix
+import synthetic
+
+K = 5
+
+# largest corpus each operation is run on (dense n x n work above this would
+# not fit in memory on a typical workstation)
+LIMITS = {
+    'read_active_sites': None,
+    'jaccard_pairs': None,
+    'similarity_matrix': 10000,
+    'cluster_by_partitioning': 10000,
+    'cluster_by_partitioning_clara': None,
+    'cluster_hierarchically': 10000,
+    'quality_index': 10000,
+    'test_cluster_number': 1000,
+}
+
+
+def operations(dir):
+    '''
+    Input: directory holding the synthetic corpus
+    Output: list of (name, setup) where setup() returns the callable to time;
+    state shared between operations (parsed sites, similarity matrix,
+    clustering) is built once, outside the timings
+    '''
+    state = {}
+
+    def sites():
+        if 'sites' not in state:
+            state['sites'] = io.read_active_sites(dir)
+        return state['sites']
+
+    def similarity():
+        if 'similarity' not in state:
+            state['similarity'] = SimilarityMatrix(sites())
+            state['similarity'].matrix
+        return state['similarity']
+
+    def pairs():
+        # a fixed 10000 random pairs, so this measures per-pair cost
+        rng = random.Random(0)
+        chosen = [(rng.choice(sites()), rng.choice(sites())) for i in range(10000)]
+        return lambda: [cluster.compute_jaccard_similarity(a, b) for a, b in chosen]
+
+    def clustering():
+        if 'clustering' not in state:
+            state['clustering'] = cluster.cluster_by_partitioning(sites(), K, similarity(), random_state=0)
+        return state['clustering']
+
+    return [
+        ('read_active_sites', lambda: lambda: io.read_active_sites(dir)),
+        ('jaccard_pairs', pairs),
+        ('similarity_matrix', lambda: lambda: SimilarityMatrix(sites()).matrix),
+        ('cluster_by_partitioning', lambda: (lambda s: lambda: cluster.cluster_by_partitioning(sites(), K, s, random_state=0))(similarity())),
+        ('cluster_by_partitioning_clara', lambda: (lambda s: lambda: cluster.cluster_by_partitioning(sites(), K, s, method='clara', random_state=0))(SimilarityMatrix(sites()))),
+        ('cluster_hierarchically', lambda: (lambda s: lambda: cluster.cluster_hierarchically(sites(), K, s))(similarity())),
+        ('quality_index', lambda: (lambda s, c: lambda: cluster.quality_index(c, s))(similarity(), clustering())),
+        ('test_cluster_number', lambda: (lambda s: lambda: cluster.test_cluster_number(cluster.cluster_by_partitioning, list(sites()), 1, s))(similarity())),
+    ]
+
+
+def measure(run, repetitions):
+    '''
+    Input: callable, number of timed runs
+    Output: (best wall-clock seconds, peak traced memory in MB)
+    '''
+    best = float('inf')
+    for r in range(repetitions):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak/2.0**20
+
+
+def scaling_exponent(sizes, seconds):
+    '''
+    Input: corpus sizes, times
+    Output: slope of log(time) against log(n), or None with fewer than two
+    sizes
+    '''
+    if len(sizes) < 2:
+        return None
+    return float(np.polyfit(np.log(sizes), np.log(seconds), 1)[0])
+
+
+def run_suite(sizes, repetitions=3, only=None, workdir=None):
+    '''
+    Input: corpus sizes, timed runs per measurement, optional list of
+    operation names to run, directory for the corpora (temporary by default)
+    Output: dict of operation -> {'sizes': {n: {'seconds', 'peak_mb'}},
+    'exponent'}
+    '''
+    results = {}
+    root = workdir or tempfile.mkdtemp(prefix='hw2bench')
+    try:
+        for n in sizes:
+            dir = os.path.join(root, str(n))
+            if not os.path.isdir(dir) or len(io.pdb_files(dir)) != n:
+                synthetic.write_corpus(dir, n)
+            for name, setup in operations(dir):
+                if (only and name not in only) or (LIMITS[name] is not None and n > LIMITS[name]):
+                    continue
+                seconds, peak = measure(setup(), repetitions)
+                results.setdefault(name, {'sizes': {}})['sizes'][str(n)] = {'seconds': seconds, 'peak_mb': peak}
+                print("%-30s n=%-7d %10.4f s %10.1f MB" % (name, n, seconds, peak))
+                sys.stdout.flush()
+    finally:
+        if workdir is None:
+            shutil.rmtree(root)
+
+    for name, result in results.items():
+        ns = sorted(int(n) for n in result['sizes'])
+        result['exponent'] = scaling_exponent(ns, [result['sizes'][str(n)]['seconds'] for n in ns])
+    return results
+
+
+def regressions(results, baseline, tolerance=1.5):
+    '''
+    Input: results of run_suite, a baseline in the same format, allowed
+    slowdown factor
+    Output: list of (operation, n, seconds, baseline seconds) slower than
+    tolerance x baseline
+    '''
+    slower = []
+    for name, result in results.items():
+        for n, measured in result['sizes'].items():
+            reference = baseline.get(name, {}).get('sizes', {}).get(n)
+            if reference and measured['seconds'] > tolerance*reference['seconds']:
+                slower.append((name, int(n), measured['seconds'], reference['seconds']))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--only', nargs='+', choices=sorted(LIMITS), help="operations to run")
+    parser.add_argument('--workdir', help="keep (and reuse) the synthetic corpora here")
+    parser.add_argument('--save', help="write the results to this baseline file")
+    parser.add_argument('--check', help="compare against this baseline file")
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.sizes, args.repetitions, args.only, args.workdir)
+    for name, result in results.items():
+        if result['exponent'] is not None:
+            print("%-30s scales as n^%.2f" % (name, result['exponent']))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if args.check:
+        slower = regressions(results, json.load(open(args.check)), args.tolerance)
+        for name, n, seconds, reference in slower:
+            print("REGRESSION %s n=%d: %.4f s (baseline %.4f s)" % (name, n, seconds, reference))
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+'''
+Synthetic active-site corpora for benchmarking, drawn from what is observed
+in data/: the number of residues per site follows the real distribution and
+each residue is a copy of a real residue (so residue types come out at their
+observed frequencies, with realistic atom counts), renumbered and jittered
+
+usage: python benchmarks/synthetic.py <output directory> <number of sites> [seed]
+'''
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from hw2skeleton import io
+
+
+def observed_residues(dir='data'):
+    '''
+    Input: directory of PDB files
+    Output: (residues, sizes) where residues is a list of residue templates
+    (each the list of its ATOM lines) and sizes the number of residues in
+    each site
+    '''
+    residues = []
+    sizes = []
+    for filepath in io.pdb_files(dir):
+        site = []
+        number = None
+        for line in open(filepath):
+            if line[0:3] == 'TER' or len(line) < 54:
+                continue
+            if line[23:26] != number:
+                number = line[23:26]
+                site.append([])
+            site[-1].append(line.rstrip('\r\n'))
+        residues.extend(site)
+        sizes.append(len(site))
+    return residues, np.array(sizes)
+
+
+def residue_frequencies(dir='data'):
+    '''
+    Input: directory of PDB files
+    Output: dict of residue type -> fraction of all residues
+    '''
+    residues, _ = observed_residues(dir)
+    types, counts = np.unique([r[0][17:20] for r in residues], return_counts=True)
+    return {t: c/float(counts.sum()) for t, c in zip(types, counts)}
+
+
+def write_corpus(outdir, n, random_state=0, dir='data'):
+    '''
+    Write n synthetic PDB files
+
+    Input: output directory (created if needed), number of sites, seed,
+    directory of real sites to draw from
+    Output: list of the written file paths
+    '''
+    rng = np.random.default_rng(random_state)
+    residues, sizes = observed_residues(dir)
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    paths = []
+    for i in range(n):
+        lines = []
+        serial = 1
+        for r, template in enumerate(rng.choice(len(residues), size=rng.choice(sizes))):
+            shift = rng.normal(0, 0.5, size=3)
+            for line in residues[template]:
+                x, y, z = (float(line[30 + 8*c:38 + 8*c]) + shift[c] for c in range(3))
+                lines.append("%s%5d%s%4d%s%8.3f%8.3f%8.3f%s" % (line[:6], serial, line[11:22], r + 1, line[26:30], x, y, z, line[54:]))
+                serial += 1
+            lines.append("TER")
+        path = os.path.join(outdir, "%d.pdb" % (i + 1))
+        with open(path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    write_corpus(sys.argv[1], int(sys.argv[2]), *[int(a) for a in sys.argv[3:4]])
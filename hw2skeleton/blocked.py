@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import tempfile
+import weakref
+import numpy as np
+from .parallel import share_arrays, attach_arrays, worker_count
+from . import instrument
+from .similarity import SimilarityMatrix, metric_kernel
+
+
+def tiles(n, tile_size):
+    '''
+    Input: number of sites, tile edge length
+    Output: list of (row start, row stop, col start, col stop) covering the
+    upper triangle (diagonal tiles included) of an n x n matrix
+    '''
+    edges = list(range(0, n, tile_size)) + [n]
+    return [(edges[i], edges[i + 1], edges[j], edges[j + 1])
+            for i in range(len(edges) - 1) for j in range(i, len(edges) - 1)]
+
+
+def _fill_tile(matrix, features, kernel, tile):
+    r0, r1, c0, c1 = tile
+    S = kernel(features[r0:r1], features[c0:c1], np.float32).astype(matrix.dtype)
+    matrix[r0:r1, c0:c1] = S
+    if r0 != c0:
+        matrix[c0:c1, r0:r1] = S.T
+
+
+# per worker process: the encoded sites and the output file
+_worker = {}
+
+
+def _init_worker(specs, path, metric, background):
+    arrays, blocks = attach_arrays(specs)
+    _worker['blocks'] = blocks
+    _worker['features'] = arrays['features']
+    _worker['matrix'] = np.load(path, mmap_mode='r+')
+    _worker['kernel'] = metric_kernel(metric, background)
+
+
+def _tile(tile):
+    _fill_tile(_worker['matrix'], _worker['features'], _worker['kernel'], tile)
+    _worker['matrix'].flush()
+
+
+def compute_tiles(path, features, metric='jaccard', dtype=np.float32, tile_size=2048, n_workers=1, background=None):
+    '''
+    Write the full similarity matrix of the encoded sites to an .npy file one
+    tile at a time, so neither the matrix nor more than a tile of it is ever
+    held in memory
+
+    Only tiles on or above the diagonal are computed; each is written along
+    with its transpose. With n_workers > 1 tiles are spread over a process
+    pool in which every worker maps the features from shared memory and
+    writes its own tiles straight into the file.
+
+    Input: output path, n x m feature array from the metric's featurization,
+    metric name, storage dtype (float32 or float16), tile edge length,
+    number of worker processes (None for one per core), the metric's
+    background (see similarity.fit_background)
+    Output: read-only memory map of the n x n matrix
+    '''
+    n = len(features)
+    matrix = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n, n))
+    jobs = tiles(n, tile_size)
+    instrument.count('similarity_evaluations', sum((r1 - r0)*(c1 - c0) for r0, r1, c0, c1 in jobs))
+    n_workers = min(worker_count(n_workers), max(len(jobs), 1))
+
+    if n_workers == 1:
+        kernel = metric_kernel(metric, background)
+        for tile in jobs:
+            _fill_tile(matrix, features, kernel, tile)
+        matrix.flush()
+    else:
+        matrix.flush()
+        with share_arrays({'features': features}) as specs:
+            with multiprocessing.Pool(n_workers, _init_worker, (specs, path, metric, background)) as pool:
+                for _ in pool.imap_unordered(_tile, jobs):
+                    pass
+    del matrix
+    return np.load(path, mmap_mode='r')
+
+
+class BlockedSimilarityMatrix(SimilarityMatrix):
+    """
+    SimilarityMatrix whose full matrix lives in a memory-mapped .npy file
+    instead of RAM, for corpora whose dense n x n matrix would not fit.
+
+    Entries are stored as float32 (or float16, at half the disk and page
+    cache footprint) and computed tile by tile, optionally in parallel.
+    block() and iter_row_blocks() only page in the rows they touch, and the
+    partitioning engines and scoring functions ask for at most a band of
+    rows (or cluster members) at a time, so none of them holds the whole
+    matrix in RAM.
+    Without a path the file is temporary and removed with the object.
+    """
+
+    def __init__(self, active_sites, path=None, dtype=np.float32, metric='jaccard', tile_size=2048, n_workers=1, cache=None):
+        SimilarityMatrix.__init__(self, active_sites, dtype, metric, cache)
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix='.npy')
+            os.close(handle)
+            weakref.finalize(self, os.remove, path)
+        self.path = path
+        self._matrix = compute_tiles(path, self.features, metric, dtype, tile_size, n_workers, self.background)
+
+    @classmethod
+    def load(cls, path, active_sites, metric='jaccard', cache=None):
+        '''
+        Reopen a matrix written earlier for the same sites (in the same order)
+        without recomputing it
+
+        Input: path of the .npy file, list of ActiveSite instances, metric name
+        Output: BlockedSimilarityMatrix
+        '''
+        matrix = np.load(path, mmap_mode='r')
+        similarity = cls.__new__(cls)
+        SimilarityMatrix.__init__(similarity, active_sites, matrix.dtype.type, metric, cache)
+        if matrix.shape != (len(similarity), len(similarity)):
+            raise ValueError("%s holds a %s matrix, expected %d x %d" % (path, matrix.shape, len(similarity), len(similarity)))
+        similarity.path = path
+        similarity._matrix = matrix
+        return similarity
+
+    def __repr__(self):
+        return "BlockedSimilarityMatrix(%d sites, %s, %s)" % (len(self), self.metric, self.path)
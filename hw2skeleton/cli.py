@@ -0,0 +1,223 @@
+import argparse
+import json
+import sys
+
+# legacy single-letter flags: python -m hw2skeleton -P <pdb directory> <output file>
+LEGACY_FLAGS = {'-P': 'partition', '-H': 'hierarchical', '-R': 'random'}
+METHODS = ('partition', 'hierarchical', 'random')
+
+
+def clustering_function(method):
+    '''
+    Input: method name ('partition', 'hierarchical' or 'random')
+    Output: the matching cluster_* function
+    '''
+    from . import cluster
+    return {'partition': cluster.cluster_by_partitioning,
+            'hierarchical': cluster.cluster_hierarchically,
+            'random': cluster.cluster_randomly}[method]
+
+
+def run_clustering(args, active_sites, method, k, similarity):
+    '''
+    Cluster with the options shared by every subcommand
+
+    Input: parsed arguments, list of ActiveSite instances, method name,
+    number of clusters, SimilarityMatrix covering the sites
+    Output: list of clusters
+    '''
+    from . import cluster
+    if method == 'partition':
+        return cluster.cluster_by_partitioning(active_sites, k, similarity, method=args.algorithm, random_state=args.seed,
+                                               n_restarts=args.restarts, n_workers=args.workers, dedupe=args.dedupe)
+    if method == 'hierarchical':
+        return cluster.cluster_hierarchically(active_sites, k, similarity, method=args.linkage)
+    return cluster.cluster_randomly(active_sites, k, similarity)
+
+
+def _load(args):
+    import numpy as np
+    from .io import read_active_sites
+    from .similarity import SimilarityMatrix
+
+    if args.seed is not None:
+        np.random.seed(args.seed)     # cluster_randomly and unseeded helpers
+    active_sites = read_active_sites(args.directory, cache=args.cache or None, n_workers=args.workers)
+    return active_sites, SimilarityMatrix(active_sites, metric=args.metric)
+
+
+def _emit(args, result, text):
+    # one result to stdout (or --output), as text lines or JSON
+    out = open(args.output, 'w') if getattr(args, 'output', None) else sys.stdout
+    try:
+        if args.format == 'json':
+            json.dump(result, out, indent=2)
+            out.write("\n")
+        else:
+            out.write(text + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def command_cluster(args):
+    from .cluster import quality_index
+    from .io import write_clustering
+
+    active_sites, similarity = _load(args)
+    print("Clustering using %s method" % args.method)
+    clustering = run_clustering(args, active_sites, args.method, args.k, similarity)
+    quality = quality_index(clustering, similarity)
+    print(quality)
+
+    if args.format == 'json':
+        with open(args.outfile, 'w') as out:
+            json.dump({'method': args.method, 'k': args.k, 'metric': args.metric, 'quality': quality,
+                       'clusters': [[site.name for site in c] for c in clustering]}, out, indent=2)
+            out.write("\n")
+    else:
+        write_clustering(args.outfile, clustering)
+
+
+def command_evaluate(args):
+    from . import scoring
+    from .cluster import clusters_to_labels
+
+    active_sites, similarity = _load(args)
+    clustering = run_clustering(args, active_sites, args.method, args.k, similarity)
+    members, labels = clusters_to_labels(clustering)
+    rows = similarity.index(members)
+    result = {'method': args.method, 'k': args.k, 'metric': args.metric,
+              'quality': scoring.quality_from_labels(similarity, labels, args.k, rows),
+              'silhouette': scoring.silhouette(similarity, labels, args.k, rows),
+              'davies_bouldin': scoring.davies_bouldin(similarity, labels, args.k, rows)}
+    _emit(args, result, "\n".join("%s\t%s" % (key, result[key]) for key in ['method', 'k', 'metric', 'quality', 'silhouette', 'davies_bouldin']))
+
+
+def command_sweep(args):
+    from .sweep import run_sweep
+
+    active_sites, similarity = _load(args)
+    result = run_sweep(similarity, args.method, range(args.min_k, args.max_k + 1), args.repetitions,
+                       random_state=args.seed, n_workers=args.workers, algorithm=args.algorithm, linkage=args.linkage,
+                       n_restarts=args.restarts, dedupe=args.dedupe)
+
+    curves = {method: ([r.k for r in result.results if r.method == method], [r.quality for r in result.results if r.method == method])
+              for method in args.method}
+    if args.plot:
+        from . import plots
+        plots.quality_sweep(curves, args.plot)
+    summary = {method: {'elbow': result.elbow[method],
+                        'k': sorted(by_k),
+                        'summary': [by_k[k]._asdict() for k in sorted(by_k)],
+                        'quality': curves[method][1]}
+               for method, by_k in result.summary.items()}
+    lines = []
+    for method, by_k in result.summary.items():
+        lines.append("%s\telbow\t%d" % (method, result.elbow[method]))
+        lines.extend("%s\t%d\t%s\t%s\t%s\t%s" % (method, k, s.mean, s.std, s.min, s.max) for k, s in sorted(by_k.items()))
+    _emit(args, summary, "\n".join(lines))
+
+
+def command_compare(args):
+    from .compare import compare_clusterings
+
+    active_sites, similarity = _load(args)
+    rows = []
+    for repetition in range(args.repetitions):
+        for k in args.k:
+            a = run_clustering(args, active_sites, args.a, k, similarity)
+            b = run_clustering(args, active_sites, args.b, k, similarity)
+            agreement = compare_clusterings(a, b)
+            rows.append({'k': k, 'overlap': agreement.overlap/float(len(active_sites)), 'ari': agreement.ari, 'nmi': agreement.nmi})
+
+    if args.plot:
+        from . import plots
+        plots.overlap_sweep([r['k'] for r in rows], [r['overlap'] for r in rows], "%s, %s" % (args.a, args.b), args.plot)
+    _emit(args, rows, "\n".join("%(k)d\t%(overlap)s\t%(ari)s\t%(nmi)s" % r for r in rows))
+
+
+def build_parser():
+    '''
+    Output: argparse.ArgumentParser for every subcommand
+    '''
+    from .similarity import METRICS
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('directory', help="directory of PDB files")
+    common.add_argument('--metric', default='jaccard', choices=sorted(METRICS), help="similarity metric")
+    common.add_argument('--seed', type=int, default=None, help="random seed")
+    common.add_argument('--workers', type=int, default=1, help="worker processes (0 for one per core)")
+    common.add_argument('--cache', action='store_true', help="keep parsed sites in a binary cache inside the directory")
+    common.add_argument('--format', default='text', choices=['text', 'json'], help="output format")
+    common.add_argument('--algorithm', default='alternate', choices=['alternate', 'pam', 'clara'], help="partitioning algorithm")
+    common.add_argument('--restarts', type=int, default=1, help="independently seeded partitioning restarts")
+    common.add_argument('--dedupe', action='store_true', help="cluster identical sites once, as weighted profiles")
+    common.add_argument('--linkage', default='average', choices=['single', 'complete', 'average', 'ward'], help="hierarchical linkage")
+    common.add_argument('--stats', help="write counters and phase timings of the run to this JSON file")
+    common.add_argument('--profile', action='store_true', help="also run cProfile and tracemalloc (report on stderr)")
+
+    parser = argparse.ArgumentParser(prog='python -m hw2skeleton', description="Cluster enzyme active sites.")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    sub = commands.add_parser('cluster', parents=[common], help="cluster sites and write the clusters out")
+    sub.add_argument('outfile', help="where to write the clustering")
+    sub.add_argument('--method', default='partition', choices=METHODS)
+    sub.add_argument('-k', type=int, default=3, help="number of clusters")
+    sub.set_defaults(run=command_cluster)
+
+    sub = commands.add_parser('evaluate', parents=[common], help="score one clustering")
+    sub.add_argument('--method', default='partition', choices=METHODS)
+    sub.add_argument('-k', type=int, default=3, help="number of clusters")
+    sub.add_argument('--output', help="file to write to instead of stdout")
+    sub.set_defaults(run=command_evaluate)
+
+    sub = commands.add_parser('sweep', parents=[common], help="quality index across numbers of clusters")
+    sub.add_argument('--method', nargs='+', default=['partition'], choices=METHODS)
+    sub.add_argument('--repetitions', type=int, default=1)
+    sub.add_argument('--min-k', type=int, default=2, help="smallest number of clusters")
+    sub.add_argument('--max-k', type=int, default=19, help="largest number of clusters")
+    sub.add_argument('--plot', help="save a quality vs. k plot to this file")
+    sub.add_argument('--output', help="file to write to instead of stdout")
+    sub.set_defaults(run=command_sweep)
+
+    sub = commands.add_parser('compare', parents=[common], help="agreement between two clustering methods")
+    sub.add_argument('--a', default='partition', choices=METHODS)
+    sub.add_argument('--b', default='hierarchical', choices=METHODS)
+    sub.add_argument('-k', type=int, nargs='+', default=[3], help="numbers of clusters")
+    sub.add_argument('--repetitions', type=int, default=1)
+    sub.add_argument('--plot', help="save an overlap vs. k plot to this file")
+    sub.add_argument('--output', help="file to write to instead of stdout")
+    sub.set_defaults(run=command_compare)
+
+    return parser
+
+
+def main(argv=None):
+    '''
+    Entry point for python -m hw2skeleton
+
+    The original form, -P|-H|-R <pdb directory> <output file>, still works
+    and means "cluster --method partition|hierarchical|random" with k = 3.
+
+    Input: argument list (sys.argv[1:] by default)
+    '''
+    if argv is None:
+        argv = sys.argv[1:]
+    argv = list(argv)
+    if argv and argv[0][0:2] in LEGACY_FLAGS:
+        argv = ['cluster', '--method', LEGACY_FLAGS[argv[0][0:2]]] + argv[1:]
+
+    args = build_parser().parse_args(argv)
+    if not (args.stats or args.profile):
+        args.run(args)
+        return
+
+    from . import instrument
+    with instrument.collect(profile=args.profile) as stats:
+        args.run(args)
+    if args.stats:
+        stats.dump(args.stats)
+    if args.profile:
+        sys.stderr.write("peak traced memory: %.1f MB\n%s" % (stats.peak_memory/2.0**20, stats.profile))
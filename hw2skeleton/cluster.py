@@ -1,18 +1,26 @@
 from .utils import Atom, Residue, ActiveSite
+from .similarity import similarity_matrix
+from . import dedup, hierarchy, instrument, medoids, minhash, scoring
 import numpy as np
-import collections
-import matplotlib.pyplot as plt
+import collections.abc
+import contextlib
 
 def flatten(x):
     '''
     flatten a nested list into a simple list
     (Why is this not a native python function?!)
     '''
-    if isinstance(x, collections.Iterable):
+    if isinstance(x, collections.abc.Iterable):
         return [a for i in x for a in flatten(i)]
     else:
         return [x]
 
+def _collect(return_stats):
+    # stats for one call: off, on (True) or with cProfile/tracemalloc ('profile')
+    if not return_stats:
+        return contextlib.nullcontext()
+    return instrument.collect(profile=return_stats == 'profile')
+
 def compute_jaccard_similarity(site_a, site_b):
     """
     Compute the Jaccard similarity between two given ActiveSite instances.
@@ -29,168 +37,178 @@ def compute_jaccard_similarity(site_a, site_b):
     similarity = float(intersection)/float(union)
     return similarity
 
-def initialize_k_clusters(data,k):
-    '''
-    Randomly choose starting points and assign all data to nearest starting
-    points
+def _assign(similarity, centers, rows, approximate):
+    # labels of the nearest center, exact or from the MinHash/LSH index
+    if not approximate:
+        return medoids.assign(similarity, centers, rows)[0]
+    if similarity.metric != 'jaccard':
+        raise ValueError("approximate assignment needs the jaccard metric, not %r" % similarity.metric)
+    return minhash.nearest_centers(similarity.features[rows], centers)[0]
 
-    Input: list of data to be clustered (data), number of clusters (k)
+def initialize_k_clusters(data, k, similarity=None, init='random', metric=None, approximate=False):
+    '''
+    Choose starting points and assign all data to nearest starting points
+
+    Input: list of data to be clustered (data), number of clusters (k),
+    optional precomputed SimilarityMatrix covering data, how to pick the
+    starting points ('random', '++' to favor points far from those already
+    picked, or 'build' for greedy PAM BUILD; see medoids.init_medoids),
+    similarity metric ('jaccard' by default, or 'geometric'), whether to
+    compare each point only with the centers a MinHash/LSH index proposes
+    (jaccard only; see minhash.nearest_centers)
     Output: list of k lists of data with each inner list representing a
     cluster
     '''
+    similarity = similarity_matrix(data, similarity, metric)
+    rows = similarity.index(data)
 
-    n = len(data)
-    clusters = [[] for i in range(k)]
-
-    # randomly pick starting points
-    center_indices = np.random.choice(range(n), size = k, replace = False)
-    centers = [data[i] for i in center_indices]
+    # pick starting points and assign all data points to nearest center
+    center_indices = medoids.init_medoids(similarity, k, init, rows)
+    labels = _assign(similarity, center_indices, rows, approximate)
 
-    # assign all data points to nearest center
-    for data_point in data:
-        similarity = []
-        if data_point in centers: # make sure centers are in their respective clusters
-            assign_to = centers.index(data_point)
-        else:
-            for center in centers:
-                similarity.append(compute_jaccard_similarity(data_point, center))
-            assign_to = similarity.index(max(similarity))
-        clusters[assign_to].append(data_point)
+    return labels_to_clusters(data, labels, k)
 
-    return(clusters)
-
-def update_clusters(clusters):
+def update_clusters(clusters, similarity=None, metric=None, approximate=False):
     '''
     Find new centers of clusters and reassign data to nearest new center
 
-    Input: list of k lists representing clustered data
+    Input: list of k lists representing clustered data, optional precomputed
+    SimilarityMatrix covering the data, similarity metric, whether to
+    reassign through a MinHash/LSH index (see initialize_k_clusters)
     Output: updated list of k lists representing clustered data (hopefully with
     more representative centers)
     '''
-
-    # find new centers (largest average similarity to all other elements within a cluster)
-    new_centers = []
-    for cluster in clusters:
-        similarities = []
-        for element in list(cluster):
-            sub_similarities = []
-            for all_other_elements in cluster:
-                x = compute_jaccard_similarity(element,all_other_elements)
-                sub_similarities.append(x)
-            similarities.append(np.average(sub_similarities)) # can change average to other metrics for different linkage types?
-
-        max_sim = max(similarities)
-        central_element = cluster[similarities.index(max_sim)]
-        new_centers.append(central_element)
-
-
-    # assign all data points to new centers
     k = len(clusters)
-    data = [val for sublist in clusters for val in sublist] # flatten the list of lists
-    new_clusters = [[] for i in range(k)]
-    for data_point in data:
-        if data_point in new_centers: # make sure centers are in their respective clusters
-            assign_to = new_centers.index(data_point)
-        else:
-            similarity = []
-            for center in new_centers:
-                similarity.append(compute_jaccard_similarity(data_point, center))
-            assign_to = similarity.index(max(similarity))
+    data, labels = clusters_to_labels(clusters)
+
+    similarity = similarity_matrix(data, similarity, metric)
+    rows = similarity.index(data)
 
-        new_clusters[assign_to].append(data_point)
+    # find new centers (largest average similarity to all other elements
+    # within a cluster) and assign all data points to them
+    new_centers = medoids.update_medoids(similarity, labels, k, rows)
+    labels = _assign(similarity, new_centers, rows, approximate)
 
-    return(new_clusters)
+    return labels_to_clusters(data, labels, k)
 
-def cluster_by_partitioning(active_sites, k):
+def cluster_by_partitioning(active_sites, k, similarity=None, method='alternate', random_state=None, n_restarts=1, n_workers=1, init=None, return_n_iter=False, metric=None, dedupe=False, return_stats=False):
     """
     Cluster a given set of ActiveSite instances using a partitioning method.
 
-    Input: a list of ActiveSite instances
+    All methods are k-medoids over label arrays (see medoids.py):
+    'alternate' moves each center to the most central member of its cluster
+    until the labels stop changing, 'pam' uses greedy BUILD starting centers
+    and PAM swaps, 'clara' runs PAM on random samples and never needs the
+    full n x n similarity matrix. Starting centers can be picked with init
+    ('random', '++' or 'build'; see medoids.init_medoids).
+
+    With n_restarts > 1, independently seeded restarts (derived from
+    random_state) run across n_workers processes and the one with the best
+    quality_index is returned; see medoids.multi_restart for per-restart
+    stats.
+
+    With dedupe, sites with identical encodings (e.g. the same set of
+    residue types under jaccard) are clustered once as a weighted profile
+    and every copy gets that profile's label (see dedup.unique_profiles).
+    Iterations and costs match those on the full data, so with 'build'
+    seeding the result is the same. Random and '++' seeding draw profiles
+    in proportion to their weights, but from a different random stream (and
+    never two copies of one profile), so for a given seed they can start
+    from other medoids than the run without dedupe.
+
+    Input: a list of ActiveSite instances, number of clusters, optional
+           precomputed SimilarityMatrix covering them, method, seed /
+           generator (global np.random state by default), number of
+           restarts, number of worker processes, seeding, whether to also
+           return the number of iterations to convergence, similarity
+           metric ('jaccard' by default, or 'geometric'), whether to
+           collapse identical sites first, whether to also return an
+           instrument.Stats of the run (True, or 'profile' to include
+           cProfile and tracemalloc results)
     Output: a clustering of ActiveSite instances
             (this is really a list of clusters, each of which is list of
-            ActiveSite instances)
+            ActiveSite instances), plus the iteration count if return_n_iter
+            and the Stats if return_stats
     """
-    # randomly initialize clusters
-    clusters = initialize_k_clusters(active_sites, k)
+    with _collect(return_stats) as stats:
+        similarity = similarity_matrix(active_sites, similarity, metric)
+        rows = similarity.index(active_sites)
+        weights = None
+        if dedupe:
+            profiles = dedup.unique_profiles(similarity, rows)
+            rows, weights = profiles.rows, profiles.weights
+
+        if n_restarts > 1:
+            score = lambda result: scoring.quality_from_labels(similarity, result.labels, k, rows, weights)
+            result = medoids.multi_restart(similarity, k, n_restarts, method, rows, random_state, n_workers, score, init, weights).best
+        else:
+            result = medoids.run(similarity, k, method, rows, random_state, init, weights)
 
-    # iteratively update clusters until convergence
-    while clusters != update_clusters(clusters) or clusters != update_clusters(update_clusters(clusters)):
-        clusters = update_clusters(clusters)
+        labels = dedup.expand_labels(result.labels, profiles) if dedupe else result.labels
+        clusters = labels_to_clusters(active_sites, labels, k)
 
-    return clusters
+    output = (clusters,) + ((result.n_iter,) if return_n_iter else ()) + ((stats,) if return_stats else ())
+    return output if len(output) > 1 else clusters
 
 
-def cluster_hierarchically(active_sites, k):
+def build_dendrogram(active_sites, similarity=None, method='average', metric=None):
     """
-    Cluster the given set of ActiveSite instances using a hierarchical algorithm.                                                                  #
+    Build the full hierarchical merge tree over the given ActiveSite instances.
+
+    Distances are 1 - similarity and the tree is built with the nearest
+    neighbor chain algorithm (see hierarchy.linkage). Cutting the result at
+    different k is cheap, so sweeps over k should build it once.
 
-    Input: a list of ActiveSite instances
-    Output: a list of clusterings
-            (each clustering is a list of lists of Sequence objects)
+    Input: a list of ActiveSite instances, optional precomputed
+           SimilarityMatrix covering them, linkage method ('average',
+           'single', 'complete' or 'ward'), similarity metric
+    Output: hierarchy.Dendrogram over active_sites
+    """
+    similarity = similarity_matrix(active_sites, similarity, metric)
+
+    rows = similarity.index(active_sites)
+    Z = hierarchy.linkage(1 - similarity.block(rows, rows), method)
+
+    return hierarchy.Dendrogram(Z, list(active_sites))
+
+def cluster_hierarchically(active_sites, k, similarity=None, method='average', metric=None, return_stats=False):
+    """
+    Cluster the given set of ActiveSite instances using a hierarchical algorithm.
+
+    Input: a list of ActiveSite instances, number of clusters, optional
+           precomputed SimilarityMatrix covering them, linkage method
+           ('average', 'single', 'complete' or 'ward'), similarity metric,
+           whether to also return an instrument.Stats of the run (see
+           cluster_by_partitioning)
+    Output: a list of k clusters (lists of ActiveSite instances), ordered by
+            their first member in active_sites, plus the Stats if
+            return_stats
     """
+    with _collect(return_stats) as stats:
+        clusters = build_dendrogram(active_sites, similarity, method, metric).clusters(k)
+    if return_stats:
+        return clusters, stats
+    return clusters
+
+def labels_to_clusters(active_sites, labels, k):
+    '''
+    Turn an array of cluster labels into the list of lists representation
 
-    # calculate initial pairwise distances (list of n^2-n (active_site_i-active_site_j, distance) pairs)
-    pairwise_distances = []
-    n = len(active_sites)
-    for i in range(n):
-        for j in range(i+1,n):
-            label = [active_sites[i],active_sites[j]]
-            distance = compute_jaccard_similarity(active_sites[i],active_sites[j])
-            pairwise_distances.append((label,distance))
-
-    # find minimum distance in pairwise distances and group those objects
-    max_value = max([i[1] for i in pairwise_distances])
-    index = [i[1] for i in pairwise_distances].index(max_value)
-    to_group = pairwise_distances[index][0]
-
-    new_clusters = []
-    for i in active_sites:
-        if i not in to_group:
-            new_clusters.append(i)
-    new_clusters.append(to_group)
-
-    # iteratively cluster the closest 'objects' in the cluster
-    while len(new_clusters) > k:
-        # calculate new pairwise distances:
-        pairwise_distances = []
-        n = len(new_clusters)
-        for i in range(n):
-            for j in range(i+1,n):
-                label = [new_clusters[i],new_clusters[j]]
-                flattened_cluster_i = flatten(new_clusters[i])
-                flattened_cluster_j = flatten(new_clusters[j])
-                distances = []
-                for site_i in flattened_cluster_i:
-                    for site_j in flattened_cluster_j:
-                        distances.append(compute_jaccard_similarity(site_i,site_j))
-
-                distance = (np.average(distances))
-                pairwise_distances.append((label,distance))
-
-        # find minimum distance in pairwise distances and group those objects
-        max_value = max([i[1] for i in pairwise_distances])
-        index = [i[1] for i in pairwise_distances].index(max_value)
-        to_group = pairwise_distances[index][0]
-
-        updated = []
-        for i in new_clusters:
-            if i not in to_group:
-                updated.append(i)
-        updated.append(to_group)
-
-        new_clusters = updated
-
-    output = []
-    for i in new_clusters:
-        output.append(flatten(i))
-
-    return output
-
-def cluster_randomly(active_sites, k):
+    input: list of active sites, integer label per site, number of clusters
+    output: list of k lists of active sites
+    '''
+    clusters = [[] for i in range(k)]
+    for site, c in zip(active_sites, labels):
+        clusters[c].append(site)
+    return(clusters)
+
+def cluster_randomly(active_sites, k, similarity=None, metric=None):
     '''
     Generate randomly clustered data as a control measure
 
-    input: list of active sites to put into k clusters
+    input: list of active sites to put into k clusters (similarity and metric
+    are accepted so all clustering methods share a signature, but are not
+    needed)
     output: list of lists containing active sites representing k clusters
     '''
     clusters = [[]for i in range(k)]
@@ -201,59 +219,80 @@ def cluster_randomly(active_sites, k):
 
 
 
-def quality_index(clustering_result):
+def clusters_to_labels(clustering_result):
     '''
-    Returns a weighted average of ratios of average intra-cluster similarity to average
-    extra-cluster similarity
+    Turn the list of lists representation into a flat list of members and a
+    label array
 
     input: list of clusters
-    output: float representing a 'quality index' of clustering
+    output: (list of all members, integer label per member)
     '''
     all_data = flatten(clustering_result)
+    labels = np.repeat(np.arange(len(clustering_result)), [len(c) for c in clustering_result])
+    return all_data, labels
 
-    ratios = []
-    sizes = []
-
-    for cluster in clustering_result:
-        intra_cluster_sim = []
-        outside_cluster_sim = []
-
-        if len(cluster) > 1:
-            for j in enumerate(cluster):
-                for i in enumerate(cluster):
-                    if i[0] > j[0]:
-                        intra_cluster_sim.append(compute_jaccard_similarity(i[1],j[1]))
-            for j in cluster:
-                for i in all_data:
-                    if i not in cluster:
-                        outside_cluster_sim.append(compute_jaccard_similarity(i,j))
-
-            ins = np.average(intra_cluster_sim)
-            out = np.average(outside_cluster_sim)
-            #print(out)
-            ratios.append(ins/out)
-            sizes.append(len(cluster))
-
-    weighted_avg_ratio = np.sum(np.multiply(ratios,sizes))/len(all_data)
+def quality_index(clustering_result, similarity=None, metric=None, dedupe=False):
+    '''
+    Returns a weighted average of ratios of average intra-cluster similarity to average
+    extra-cluster similarity
 
-    return(weighted_avg_ratio)
+    Computed from a label array with grouped matrix products (see
+    scoring.quality_from_labels; equal to the per-pair definition up to
+    rounding). With dedupe, identical sites in the same cluster are scored
+    once with their count as weight (same result, up to rounding).
 
-def test_cluster_number(clustering_method, data, repetitions):
+    input: list of clusters, optional precomputed SimilarityMatrix covering
+    them, similarity metric ('jaccard' by default, or 'geometric'), whether
+    to collapse identical sites first
+    output: float representing a 'quality index' of clustering
+    '''
+    all_data, labels = clusters_to_labels(clustering_result)
+    similarity = similarity_matrix(all_data, similarity, metric)
+    rows = similarity.index(all_data)
+
+    if dedupe:
+        profiles = dedup.unique_profiles(similarity, rows, labels)
+        profile_labels = np.empty(len(profiles.rows), dtype=np.intp)
+        profile_labels[profiles.inverse] = labels     # shared by every copy
+        return scoring.quality_from_labels(similarity, profile_labels, len(clustering_result), profiles.rows, profiles.weights)
+    return scoring.quality_from_labels(similarity, labels, len(clustering_result), rows)
+
+def test_cluster_number(clustering_method, data, repetitions, similarity=None, metric=None, random_state=None, n_workers=1,
+                        method=None, n_restarts=1, dedupe=False):
     '''
     produce an elbow plot to help determine ideal number of clusters
 
-    input: clustering algorithm and data to be clustered
-    output: scatterplot showing quality index as a function of cluster size
+    The three methods here run on the sweep engine (see sweep.run_sweep):
+    each (k, repetition) is seeded from random_state and can run in a
+    process pool, and a hierarchical tree is built once and cut at each k.
+    Any other clustering function is called in turn. data is not modified.
+    method, n_restarts and dedupe mean what they do for the clustering
+    function (method: the partitioning algorithm or the linkage).
+
+    input: clustering algorithm and data to be clustered, optional precomputed
+    SimilarityMatrix covering data (built once here otherwise), similarity
+    metric ('jaccard' by default, or 'geometric'), seed, number of worker
+    processes, clustering options
+    output: (k, quality) lists, k = 2..19 for each repetition in turn
     '''
+    from . import sweep
+    similarity = similarity_matrix(data, similarity, metric)
+
+    methods = {cluster_by_partitioning: 'partition', cluster_hierarchically: 'hierarchical', cluster_randomly: 'random'}
+    if clustering_method in methods:
+        options = {'n_restarts': n_restarts, 'dedupe': dedupe}
+        if method is not None:
+            options['linkage' if clustering_method is cluster_hierarchically else 'algorithm'] = method
+        result = sweep.run_sweep(similarity, [methods[clustering_method]], range(2,20), repetitions,
+                                 similarity.index(data), random_state, n_workers, **options)
+        return([r.k for r in result.results], [r.quality for r in result.results])
+
     k = []
     quality = []
-
     for j in range(repetitions): # Repeat
         for i in range(2,20): # Check different numbers of clusters
-            np.random.shuffle(data) # shuffle data (not sure if data order plays a role?)
-
             k.append(i)
-            clusters = clustering_method(data,i)
-            q = quality_index(clusters)
+            clusters = clustering_method(data, i, similarity)
+            q = quality_index(clusters, similarity)
             quality.append(q)
     return(k,quality)
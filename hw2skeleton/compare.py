@@ -0,0 +1,118 @@
+import collections
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+# overlap: members shared under the best one-to-one matching of clusters,
+# matching: (clusters of a, matched clusters of b), ari: adjusted Rand index,
+# nmi: normalized mutual information
+Agreement = collections.namedtuple('Agreement', ['overlap', 'matching', 'ari', 'nmi'])
+
+
+def shared_labels(clusters_a, clusters_b):
+    '''
+    Label arrays of two clusterings of the same items, in a common order
+
+    Input: two lists of clusters (lists of ActiveSite instances, or any
+    hashable items) covering the same items
+    Output: (labels_a, labels_b) integer arrays, one entry per item
+    '''
+    position = {}
+    for cluster in clusters_a:
+        for item in cluster:
+            position[item] = len(position)
+
+    labels_a = np.empty(len(position), dtype=np.intp)
+    for c, cluster in enumerate(clusters_a):
+        for item in cluster:
+            labels_a[position[item]] = c
+    labels_b = np.full(len(position), -1, dtype=np.intp)
+    for c, cluster in enumerate(clusters_b):
+        for item in cluster:
+            if item not in position:
+                raise ValueError("the two clusterings do not cover the same items")
+            labels_b[position[item]] = c
+    if np.any(labels_b < 0):
+        raise ValueError("the two clusterings do not cover the same items")
+    return labels_a, labels_b
+
+
+def contingency(labels_a, labels_b, k_a=None, k_b=None):
+    '''
+    Input: two label arrays over the same items, optional numbers of
+    clusters (max label + 1 by default)
+    Output: k_a x k_b array, entry [i, j] counting the items in cluster i of
+    a and cluster j of b
+    '''
+    labels_a = np.asarray(labels_a, dtype=np.intp)
+    labels_b = np.asarray(labels_b, dtype=np.intp)
+    if k_a is None:
+        k_a = labels_a.max() + 1 if len(labels_a) else 0
+    if k_b is None:
+        k_b = labels_b.max() + 1 if len(labels_b) else 0
+    return np.bincount(labels_a*k_b + labels_b, minlength=k_a*k_b).reshape(k_a, k_b)
+
+
+def best_matching(table):
+    '''
+    One-to-one matching of clusters that maximizes the number of shared
+    members (Hungarian algorithm, O(k^3))
+
+    Input: contingency table
+    Output: (total overlap, (clusters of a, matched clusters of b))
+    '''
+    rows, cols = linear_sum_assignment(table, maximize=True)
+    return int(table[rows, cols].sum()), (rows, cols)
+
+
+def _pairs(x):
+    return np.sum(x*(x - 1))/2.0
+
+
+def adjusted_rand_index(table):
+    '''
+    Input: contingency table
+    Output: adjusted Rand index (1 for identical clusterings, about 0 for
+    independent ones)
+    '''
+    n = table.sum()
+    index = _pairs(table)
+    a = _pairs(table.sum(axis=1))
+    b = _pairs(table.sum(axis=0))
+    expected = a*b/_pairs(np.array([n])) if n > 1 else 0.0
+    maximum = (a + b)/2
+    if maximum == expected:
+        return 1.0
+    return float((index - expected)/(maximum - expected))
+
+
+def normalized_mutual_info(table):
+    '''
+    Input: contingency table
+    Output: mutual information divided by the mean of the two entropies
+    (1 for identical clusterings, 0 for independent ones)
+    '''
+    n = float(table.sum())
+    p = table/n
+    pa = p.sum(axis=1)
+    pb = p.sum(axis=0)
+    nonzero = p > 0
+    mi = np.sum(p[nonzero]*np.log(p[nonzero]/np.outer(pa, pb)[nonzero]))
+    ha = -np.sum(pa[pa > 0]*np.log(pa[pa > 0]))
+    hb = -np.sum(pb[pb > 0]*np.log(pb[pb > 0]))
+    if ha + hb == 0:
+        return 1.0
+    return float(max(mi, 0)/((ha + hb)/2))
+
+
+def compare_clusterings(clusters_a, clusters_b):
+    '''
+    Agreement between two clusterings of the same items, all from one
+    contingency table
+
+    Input: two lists of clusters (as returned by the cluster_* functions)
+    Output: Agreement
+    '''
+    labels_a, labels_b = shared_labels(clusters_a, clusters_b)
+    table = contingency(labels_a, labels_b, len(clusters_a), len(clusters_b))
+    overlap, matching = best_matching(table)
+    return Agreement(overlap, matching, adjusted_rand_index(table), normalized_mutual_info(table))
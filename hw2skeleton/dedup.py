@@ -0,0 +1,45 @@
+import collections
+import numpy as np
+
+# rows: row number of one representative per distinct profile (in order of
+# first appearance), weights: how many points share each profile, inverse:
+# the profile of every point
+Profiles = collections.namedtuple('Profiles', ['rows', 'weights', 'inverse'])
+
+
+def unique_profiles(similarity, rows=None, labels=None):
+    '''
+    Collapse points with identical encodings into one weighted profile
+
+    Every metric compares sites only through their encoding, so points that
+    share one are interchangeable: clustering the profiles with their
+    multiplicities as weights (and expanding the labels back) matches
+    clustering every point. With labels, points are only merged when they
+    also share a label, so a given clustering can be scored exactly.
+
+    Input: SimilarityMatrix, optional row numbers of the points (all rows by
+    default), optional label per point
+    Output: Profiles
+    '''
+    if rows is None:
+        rows = np.arange(len(similarity))
+    rows = np.asarray(rows, dtype=np.intp)
+
+    keys = similarity.features[rows]
+    if labels is not None:
+        keys = np.column_stack([keys, labels])
+    _, first, inverse, counts = np.unique(keys, axis=0, return_index=True, return_inverse=True, return_counts=True)
+
+    # np.unique sorts the profiles; put them back in order of first appearance
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return Profiles(rows[first[order]], counts[order].astype(np.float64), rank[inverse.ravel()])
+
+
+def expand_labels(labels, profiles):
+    '''
+    Input: label per profile, Profiles
+    Output: label per original point
+    '''
+    return np.asarray(labels)[profiles.inverse]
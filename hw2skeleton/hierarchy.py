@@ -0,0 +1,204 @@
+import numpy as np
+from . import instrument
+
+METHODS = ('single', 'complete', 'average', 'ward')
+
+
+def _lance_williams(method, d_a, d_b, d_ab, n_a, n_b, n_k):
+    '''
+    Distance from every cluster k to the union of clusters a and b, given
+    only the old distances (Lance-Williams update)
+
+    Input: linkage method, arrays of distances from each k to a and to b,
+    distance between a and b, sizes of a and b, array of sizes of each k
+    Output: array of distances from each k to the merged cluster
+    '''
+    if method == 'single':
+        return np.minimum(d_a, d_b)
+    if method == 'complete':
+        return np.maximum(d_a, d_b)
+    if method == 'average':
+        return (n_a*d_a + n_b*d_b)/(n_a + n_b)
+    if method == 'ward':
+        total = n_a + n_b + n_k
+        return np.sqrt(np.maximum(((n_a + n_k)*d_a**2 + (n_b + n_k)*d_b**2 - n_k*d_ab**2)/total, 0))
+    raise ValueError("unknown linkage method %r (expected one of %s)" % (method, ', '.join(METHODS)))
+
+
+def linkage(distance, method='average'):
+    '''
+    Agglomerative clustering of a dense distance matrix with the nearest
+    neighbor chain algorithm
+
+    The cluster-to-cluster distance matrix is kept in memory and updated in
+    place after each merge with the Lance-Williams formula, so nothing is ever
+    recomputed from the original points: O(n^2) memory and O(n^2) time for
+    all four (reducible) linkage methods.
+
+    Input: symmetric n x n distance matrix, linkage method (single, complete,
+    average or ward)
+    Output: (n-1) x 4 merge array in the scipy convention. Row i merges
+    clusters Z[i, 0] and Z[i, 1] at height Z[i, 2] into a cluster of Z[i, 3]
+    points with id n + i; ids below n are the original points.
+    '''
+    if method not in METHODS:
+        raise ValueError("unknown linkage method %r (expected one of %s)" % (method, ', '.join(METHODS)))
+
+    D = np.array(distance, dtype=np.float64)
+    n = D.shape[0]
+    if D.shape != (n, n):
+        raise ValueError("distance matrix must be square")
+    if n < 2:
+        return np.zeros((0, 4))
+
+    with instrument.phase('linkage'):
+        return _nn_chain(D, method)
+
+
+def _nn_chain(D, method):
+    n = D.shape[0]
+    np.fill_diagonal(D, np.inf)
+    size = np.ones(n)
+    active = np.ones(n, dtype=bool)
+
+    # merges as (point in a, point in b, height, size); each live cluster is
+    # stored in the row of one of its points
+    merges = []
+    chain = []
+    while len(merges) < n - 1:
+        if not chain:
+            chain.append(int(np.argmax(active)))
+
+        # follow nearest neighbors until two clusters are each other's nearest
+        while True:
+            a = chain[-1]
+            b = int(np.argmin(D[a]))
+            if len(chain) > 1 and D[a, chain[-2]] <= D[a, b]:
+                b = chain[-2]
+            if len(chain) > 1 and b == chain[-2]:
+                break
+            chain.append(b)
+
+        chain.pop()
+        chain.pop()
+        height = D[a, b]
+
+        # merged cluster lives on in row b
+        update = _lance_williams(method, D[a], D[b], height, size[a], size[b], size)
+        update[~active] = np.inf
+        D[b] = update
+        D[:, b] = update
+        D[b, b] = np.inf
+        D[a] = np.inf
+        D[:, a] = np.inf
+        active[a] = False
+
+        size[b] = size[a] + size[b]
+        merges.append((a, b, height, size[b]))
+
+    instrument.count('merges', len(merges))
+    return _relabel(merges, n)
+
+
+def _relabel(merges, n):
+    '''
+    Sort nearest neighbor chain merges by height and translate the point
+    each cluster was stored under into scipy style cluster ids
+    '''
+    order = sorted(range(len(merges)), key=lambda i: merges[i][2])
+
+    # union-find over cluster ids 0..2n-2
+    parent = np.arange(2*n - 1)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    Z = np.zeros((n - 1, 4))
+    for i, m in enumerate(order):
+        a, b, height, count = merges[m]
+        x, y = find(a), find(b)
+        parent[x] = parent[y] = n + i
+        Z[i] = (min(x, y), max(x, y), height, count)
+    return Z
+
+
+def cut_linkage(Z, k):
+    '''
+    Cut a merge array so that k clusters remain
+
+    Input: (n-1) x 4 merge array from linkage, number of clusters
+    Output: integer label array of length n; clusters are numbered in order
+    of their first point
+    '''
+    n = len(Z) + 1
+    if not 1 <= k <= n:
+        raise ValueError("k must be between 1 and %d" % n)
+
+    # walk the tree down from the cut: merges above it are ignored so their
+    # children are roots, everything below inherits its parent's root
+    root = np.arange(2*n - 1)
+    for i in range(n - k - 1, -1, -1):
+        root[int(Z[i, 0])] = root[n + i]
+        root[int(Z[i, 1])] = root[n + i]
+    roots = root[:n]
+
+    _, first, labels = np.unique(roots, return_index=True, return_inverse=True)
+    # renumber so cluster 0 holds point 0, the next new cluster is 1, ...
+    rank = np.empty(len(first), dtype=np.intp)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[labels.ravel()]
+
+
+class Dendrogram:
+    """
+    A full merge tree, kept as the compact (n-1) x 4 merge array from linkage.
+
+    Every level of the hierarchy is already in the tree, so clusterings for
+    any number of clusters come from cutting it (O(n) per cut) rather than
+    clustering again.
+    """
+
+    def __init__(self, Z, items=None):
+        self.Z = np.asarray(Z, dtype=np.float64)
+        self.n = len(self.Z) + 1
+        if items is not None and len(items) != self.n:
+            raise ValueError("dendrogram over %d points given %d items" % (self.n, len(items)))
+        self.items = items
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        return "Dendrogram(%d points)" % self.n
+
+    @property
+    def heights(self):
+        '''
+        merge heights, in merge order
+        '''
+        return self.Z[:, 2]
+
+    def cut(self, k):
+        '''
+        Input: number of clusters
+        Output: integer label array, clusters numbered in order of their first
+        point
+        '''
+        return cut_linkage(self.Z, k)
+
+    def clusters(self, k):
+        '''
+        Input: number of clusters
+        Output: list of k lists of the items the tree was built over
+        '''
+        if self.items is None:
+            raise ValueError("dendrogram was built without items")
+        clusters = [[] for i in range(k)]
+        for item, c in zip(self.items, self.cut(k)):
+            clusters[c].append(item)
+        return clusters
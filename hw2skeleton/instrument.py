@@ -0,0 +1,141 @@
+import collections
+import contextlib
+import cProfile
+import io as _io
+import json
+import pstats
+import time
+import tracemalloc
+
+# the Stats being collected, or None (the default) when instrumentation is
+# off; every hook below is then a single comparison
+STATS = None
+
+
+class Stats:
+    """
+    Counters and per-phase wall-clock timings gathered while collect() is
+    active.
+
+    counts maps an event name (similarity_evaluations, iterations, merges,
+    files_parsed, ...) to how often it happened; timings maps a phase name
+    (parse, featurize, assign, update_medoids, linkage, ...) to total
+    seconds spent in it and calls to how many times it was entered. With
+    profiling on, profile holds the cProfile report and peak_memory the
+    tracemalloc peak in bytes.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.timings = collections.Counter()
+        self.calls = collections.Counter()
+        self.wall_time = None
+        self.profile = None
+        self.peak_memory = None
+
+    def __repr__(self):
+        return "Stats(%s)" % ', '.join("%s=%d" % item for item in sorted(self.counts.items()))
+
+    def to_dict(self):
+        '''
+        Output: the stats as plain JSON-serializable types
+        '''
+        return {'counts': dict(self.counts),
+                'timings': {name: {'seconds': self.timings[name], 'calls': self.calls[name]} for name in self.timings},
+                'wall_time': self.wall_time,
+                'peak_memory': self.peak_memory,
+                'profile': self.profile}
+
+    def dump(self, path):
+        '''
+        Write the stats to a JSON file
+
+        Input: path
+        '''
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+def count(name, n=1):
+    '''
+    Input: event name, number of events
+    '''
+    if STATS is not None:
+        STATS.counts[name] += n
+
+
+class _Phase:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if STATS is not None:
+            STATS.timings[self.name] += time.perf_counter() - self.start
+            STATS.calls[self.name] += 1
+        return False
+
+
+_OFF = contextlib.nullcontext()
+
+
+def phase(name):
+    '''
+    Time a block of code: with instrument.phase('assign'): ...
+
+    Input: phase name
+    Output: context manager (a shared no-op one when instrumentation is off)
+    '''
+    if STATS is None:
+        return _OFF
+    return _Phase(name)
+
+
+@contextlib.contextmanager
+def collect(profile=False, top=30):
+    '''
+    Turn instrumentation on for the enclosed block
+
+    Collections nest: an inner collect() gathers its own Stats and hands its
+    events on to the outer one when it ends. Work done in worker processes
+    is not counted.
+
+    Input: whether to also run cProfile and tracemalloc, number of functions
+    to keep in the profile report
+    Output: (context manager) the Stats being filled in
+    '''
+    global STATS
+    outer = STATS
+    stats = STATS = Stats()
+    profiler = None
+    tracing = False
+    if profile:
+        profiler = cProfile.Profile()
+        tracing = not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.wall_time = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            report = _io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(top)
+            stats.profile = report.getvalue()
+            stats.peak_memory = tracemalloc.get_traced_memory()[1]
+            if tracing:
+                tracemalloc.stop()
+        STATS = outer
+        if outer is not None:
+            outer.counts.update(stats.counts)
+            outer.timings.update(stats.timings)
+            outer.calls.update(stats.calls)
@@ -1,28 +1,282 @@
 import glob
+import multiprocessing
 import os
-from .utils import Atom, Residue, ActiveSite
+import sys
+import numpy as np
+from .utils import Atom, Residue, ActiveSite, ActiveSiteStore, _ranges
+from .parallel import worker_count
+from . import instrument
 
+# default name of the binary cache compile_cache writes inside a PDB directory
+CACHE_FILENAME = '.active_sites.store'
 
-def read_active_sites(dir):
+
+def read_active_sites(dir, cache=None, n_workers=1):
     """
     Read in all of the active sites from the given directory.
 
-    Input: directory
-    Output: list of ActiveSite instances
+    Sites are packed into one ActiveSiteStore as they are read, so only one
+    chunk of files' worth of Atom/Residue objects exists at a time. With a
+    cache, the store is memory-mapped from a binary file instead and only new
+    or changed PDB files are parsed (see compile_cache).
+
+    The count read is reported on stderr, leaving stdout to the results.
+
+    Input: directory, optional cache (True for CACHE_FILENAME inside the
+    directory, or a path), number of parsing processes (None for one per
+    core)
+    Output: list of ActiveSite instances (views into an ActiveSiteStore)
     """
-    files = glob.glob(dir + '/*.pdb')
+    if cache:
+        store, parsed = compile_cache(dir, None if cache is True else cache, n_workers)
+        active_sites = store.sites()
+        instrument.count('sites_read', len(active_sites))
+        print("Read in %d active sites (%d parsed, %d from cache)" % (len(active_sites), parsed, len(active_sites) - parsed), file=sys.stderr)
+        return active_sites
 
-    active_sites = []
     # iterate over each .pdb file in the given directory
-    for filepath in glob.iglob(os.path.join(dir, "*.pdb")):
-
-        active_sites.append(read_active_site(filepath))
+    store = parse_files(pdb_files(dir), n_workers)
+    active_sites = store.sites()
+    instrument.count('sites_read', len(active_sites))
 
-    print("Read in %d active sites"%len(active_sites))
+    print("Read in %d active sites"%len(active_sites), file=sys.stderr)
 
     return active_sites
 
 
+def pdb_files(dir):
+    '''
+    Input: directory
+    Output: list of the .pdb files in it
+    '''
+    return glob.glob(os.path.join(dir, "*.pdb"))
+
+
+def _parse_chunk(filepaths):
+    return read_active_site_batch(filepaths)
+
+
+def iter_site_chunks(filepaths, chunksize=64, n_workers=1, ordered=True):
+    """
+    Parse PDB files a chunk at a time, yielding each chunk as soon as it is
+    ready.
+
+    With more than one worker, chunks are parsed across a process pool and
+    come back as compact ActiveSiteStores (cheap to send between processes).
+
+    Input: list of PDB file paths, files per chunk, number of parsing
+    processes (None for one per core), whether chunks must come back in file
+    order (otherwise in the order they finish)
+    Output: yields one ActiveSiteStore per chunk
+    """
+    chunks = [filepaths[i:i + chunksize] for i in range(0, len(filepaths), chunksize)]
+    n_workers = min(worker_count(n_workers), len(chunks))
+
+    if n_workers <= 1:
+        for chunk in chunks:
+            yield _parse_chunk(chunk)
+        return
+
+    with multiprocessing.Pool(n_workers) as pool:
+        parsed = pool.imap(_parse_chunk, chunks) if ordered else pool.imap_unordered(_parse_chunk, chunks)
+        for store in parsed:
+            yield store
+
+
+def iter_active_sites(dir, chunksize=64, n_workers=1, ordered=True):
+    """
+    Stream the active sites of a directory as they are parsed, so work on
+    the first sites can start before the last file is read.
+
+    Input: directory, files per chunk, number of parsing processes, whether
+    to keep file order (see iter_site_chunks)
+    Output: yields ActiveSite instances (views into one store per chunk)
+    """
+    for store in iter_site_chunks(pdb_files(dir), chunksize, n_workers, ordered):
+        for site in store.sites():
+            yield site
+
+
+def parse_files(filepaths, n_workers=1, chunksize=64):
+    """
+    Parse PDB files into one ActiveSiteStore, in file order.
+
+    Input: list of PDB file paths, number of parsing processes, files per
+    chunk
+    Output: ActiveSiteStore
+    """
+    instrument.count('files_parsed', len(filepaths))
+    with instrument.phase('parse'):
+        return ActiveSiteStore.concatenate(list(iter_site_chunks(filepaths, chunksize, n_workers)))
+
+
+def _file_key(filepath):
+    '''
+    what identifies a file's contents in the cache manifest: name, size and
+    modification time
+    '''
+    st = os.stat(filepath)
+    return [os.path.basename(filepath), st.st_size, st.st_mtime_ns]
+
+
+def compile_cache(dir, cache_path=None, n_workers=1):
+    """
+    Parse a directory of PDB files once into a single binary cache file and
+    memory-map it.
+
+    The cache header lists every file's name, size and modification time.
+    When the cache is up to date it is mapped as is; otherwise sites of
+    unchanged files are copied over from the old cache, only new or changed
+    files are parsed, removed files are dropped, and the cache is rewritten.
+    Processes mapping the same cache share its pages.
+
+    Input: directory, cache path (CACHE_FILENAME inside the directory by
+    default), number of parsing processes
+    Output: (ActiveSiteStore mapped from the cache, number of files parsed)
+    """
+    if cache_path is None:
+        cache_path = os.path.join(dir, CACHE_FILENAME)
+
+    files = pdb_files(dir)
+    keys = [_file_key(f) for f in files]
+
+    old = None
+    cached = {}
+    if os.path.exists(cache_path):
+        try:
+            manifest = ActiveSiteStore.read_header(cache_path)['metadata']['files']
+            if manifest == keys:
+                return ActiveSiteStore.load(cache_path), 0
+            old = ActiveSiteStore.load(cache_path)
+            cached = {tuple(key): i for i, key in enumerate(manifest)}
+        except (IOError, ValueError, KeyError, TypeError):
+            # unreadable or from another version: start over
+            old = None
+            cached = {}
+
+    # copy unchanged sites over, parse the rest, then put everything back in file order
+    reused = [cached[tuple(key)] for key in keys if tuple(key) in cached]
+    to_parse = [f for f, key in zip(files, keys) if tuple(key) not in cached]
+    pieces = [parse_files(to_parse, n_workers)]
+    if reused:
+        pieces.insert(0, old.take(reused))
+    combined = ActiveSiteStore.concatenate(pieces)
+
+    is_cached = [tuple(key) in cached for key in keys]
+    order = sorted(range(len(files)), key=lambda i: not is_cached[i])
+    position = [0]*len(files)
+    for new, i in enumerate(order):
+        position[i] = new
+
+    combined.take(position).save(cache_path, {'directory': os.path.abspath(dir), 'files': keys})
+    return ActiveSiteStore.load(cache_path), len(to_parse)
+
+
+def read_active_site_arrays(filepath):
+    """
+    Read in a single active site given a PDB file, straight into an
+    ActiveSiteStore (see read_active_site_batch).
+
+    Input: PDB file path
+    Output: ActiveSiteStore holding one site
+    """
+    return read_active_site_batch([filepath])
+
+
+def read_active_site_batch(filepaths):
+    """
+    Read in a batch of PDB files straight into one ActiveSiteStore.
+
+    Each file is read as one bytes buffer, and the fixed ATOM columns of every
+    line of every file in the batch are decoded at once through numpy views
+    over the raw bytes, with the same rules as read_active_site (a residue
+    starts when the residue number changes and is kept when a TER card
+    follows it). If the batch has lines this can't handle (short or
+    malformed), files are decoded one at a time and the offending ones go
+    through read_active_site instead.
+
+    Input: list of PDB file paths
+    Output: ActiveSiteStore with one site per file, in order
+    """
+    names = []
+    file_lines = []
+    for filepath in filepaths:
+        basename = os.path.basename(filepath)
+        name = os.path.splitext(basename)
+
+        if name[1] != ".pdb":
+            raise IOError("%s is not a PDB file"%filepath)
+
+        with open(filepath, "rb") as f:
+            file_lines.append(f.read().splitlines())
+        names.append(name[0])
+
+    try:
+        return _decode_atom_columns(names, file_lines)
+    except ValueError:
+        if len(filepaths) > 1:
+            return ActiveSiteStore.concatenate([read_active_site_batch([f]) for f in filepaths])
+        return ActiveSiteStore.from_sites([read_active_site(filepaths[0])])
+
+
+def _decode_atom_columns(names, file_lines):
+    n_files = len(names)
+    line_counts = [len(lines) for lines in file_lines]
+    if min(line_counts, default=0) == 0:
+        raise ValueError("empty PDB file")
+
+    # every line of every file as one n x 54 byte matrix (longer lines are
+    # cut, shorter ones padded with zero bytes)
+    raw = np.array([line for lines in file_lines for line in lines], dtype='S54')
+    lengths = np.char.str_len(raw)
+    raw = raw.view(np.uint8).reshape(-1, 54)
+    site_of_line = np.repeat(np.arange(n_files), line_counts)
+
+    ter = (raw[:, 0] == ord('T')) & (raw[:, 1] == ord('E')) & (raw[:, 2] == ord('R'))
+    if np.any(lengths[~ter] < 54):
+        raise ValueError("short ATOM line")
+    atom_rows = raw[~ter]
+    site_of_atom = site_of_line[~ter]
+
+    def column(start, stop):
+        return np.ascontiguousarray(atom_rows[:, start:stop]).view('S%d' % (stop - start)).ravel()
+
+    atom_names = np.char.strip(column(13, 17))
+    coords = np.ascontiguousarray(atom_rows[:, 30:54]).view('S8').reshape(-1, 3).astype(np.float64)
+    residue_types = column(17, 20)
+    residue_numbers = column(23, 26).astype(np.int64)
+
+    # a new residue starts at the top of each file and whenever the residue
+    # number changes...
+    new_residue = np.ones(len(atom_rows), dtype=bool)
+    new_residue[1:] = (residue_numbers[1:] != residue_numbers[:-1]) | (site_of_atom[1:] != site_of_atom[:-1])
+    starts = np.flatnonzero(new_residue)
+    residue_of_atom = np.cumsum(new_residue) - 1
+
+    # ...and is kept once for every TER card that follows it
+    last_atom = np.cumsum(~ter)[ter] - 1
+    if np.any(last_atom < 0) or np.any(site_of_atom[last_atom] != site_of_line[ter]):
+        raise ValueError("TER card before any atom")
+    kept = residue_of_atom[last_atom]
+
+    atom_counts = np.diff(np.append(starts, len(atom_rows)))[kept]
+    atoms = _ranges(starts[kept], atom_counts)
+    residues_per_site = np.bincount(site_of_atom[starts[kept]], minlength=n_files)
+
+    residue_vocab, residue_codes = np.unique(residue_types[starts[kept]], return_inverse=True)
+    atom_vocab, atom_codes = np.unique(atom_names[atoms], return_inverse=True)
+
+    return ActiveSiteStore(names,
+                           np.concatenate([[0], np.cumsum(residues_per_site)]),
+                           residue_codes.ravel(),
+                           residue_numbers[starts[kept]],
+                           np.concatenate([[0], np.cumsum(atom_counts)]),
+                           atom_codes.ravel(),
+                           coords[atoms],
+                           [t.decode() for t in residue_vocab],
+                           [t.decode() for t in atom_vocab])
+
+
 def read_active_site(filepath):
     """
     Read in a single active site given a PDB file
@@ -0,0 +1,424 @@
+import collections
+import numpy as np
+from .parallel import similarity_pool, worker, worker_count, row_numbers
+from . import instrument
+
+# labels: cluster of each point, medoids: position of each cluster's medoid,
+# n_iter: rounds until convergence, cost: total distance (1 - similarity) of
+# every point to its medoid
+KMedoidsResult = collections.namedtuple('KMedoidsResult', ['labels', 'medoids', 'n_iter', 'cost'])
+
+# best: KMedoidsResult of the winning restart, score: its score, restarts:
+# one dict of stats per restart (in seed order)
+MultiRestartResult = collections.namedtuple('MultiRestartResult', ['best', 'score', 'restarts'])
+
+
+def check_random_state(random_state):
+    '''
+    Turn a seed into something with a numpy random API
+
+    Input: None (use the global np.random state), an int or SeedSequence to
+    seed a new Generator, or an existing Generator / RandomState
+    Output: random number generator
+    '''
+    if random_state is None:
+        return np.random
+    if isinstance(random_state, (np.random.Generator, np.random.RandomState)):
+        return random_state
+    return np.random.default_rng(random_state)
+
+
+def _total(values, weights=None):
+    # column sums, each row counted weights[i] times
+    if weights is None:
+        return values.sum(axis=0)
+    return np.dot(weights, values)
+
+
+def assign(similarity, medoids, rows=None, block_size=4096):
+    '''
+    Assign every point to its most similar medoid
+
+    Input: SimilarityMatrix, positions of the medoids, optional row numbers
+    of the points being clustered (positions index into these)
+    Output: (labels, similarity of each point to its medoid)
+    '''
+    rows = row_numbers(similarity, rows)
+    medoids = np.asarray(medoids, dtype=np.intp)
+
+    labels = np.empty(len(rows), dtype=np.intp)
+    best = np.empty(len(rows))
+    with instrument.phase('assign'):
+        for start in range(0, len(rows), block_size):
+            S = similarity.block(rows[start:start + block_size], rows[medoids])
+            labels[start:start + block_size] = np.argmax(S, axis=1)
+            best[start:start + block_size] = S.max(axis=1)
+
+    # make sure medoids are in their respective clusters
+    labels[medoids] = np.arange(len(medoids))
+    best[medoids] = similarity.block(rows[medoids], rows[medoids]).diagonal()
+    return labels, best
+
+
+def update_medoids(similarity, labels, k, rows=None, weights=None, block_size=1024):
+    '''
+    Find the member of each cluster with the largest average similarity to
+    the rest of its cluster
+
+    Members are scored block_size at a time, so memory stays at block_size x
+    cluster size.
+
+    Input: SimilarityMatrix, label array, number of clusters, optional row
+    numbers of the points being clustered, optional multiplicity of each
+    point, members scored at a time
+    Output: array of k medoid positions
+    '''
+    rows = row_numbers(similarity, rows)
+
+    medoids = np.empty(k, dtype=np.intp)
+    with instrument.phase('update_medoids'):
+        for c in range(k):
+            members = np.flatnonzero(labels == c)
+            if len(members) == 0:
+                raise ValueError("cluster %d is empty" % c)
+            w = None if weights is None else weights[members]
+            totals = np.empty(len(members))
+            for start in range(0, len(members), block_size):
+                S = similarity.block(rows[members[start:start + block_size]], rows[members])
+                totals[start:start + block_size] = _total(S.T, w)
+            medoids[c] = members[np.argmax(totals)]
+    return medoids
+
+
+def alternate(similarity, k, medoids=None, rows=None, max_iter=100, random_state=None, init='random', weights=None):
+    '''
+    k-medoids by alternating between assigning points to the nearest medoid
+    and moving each medoid to the most central member of its cluster
+
+    Convergence is checked on the label array: stop once an update leaves
+    every label unchanged (or starts cycling between two labelings).
+
+    Input: SimilarityMatrix, number of clusters, optional starting medoid
+    positions (picked by init otherwise), optional row numbers of the points
+    to cluster, iteration cap, seed / generator, seeding (see init_medoids),
+    optional multiplicity of each point (a point of weight w counts as w
+    identical points)
+    Output: KMedoidsResult
+    '''
+    rows = row_numbers(similarity, rows)
+    n = len(rows)
+    if not 1 <= k <= n:
+        raise ValueError("k must be between 1 and %d" % n)
+
+    if medoids is None:
+        medoids = init_medoids(similarity, k, init, rows, random_state, weights)
+    labels, best = assign(similarity, medoids, rows)
+
+    previous = None
+    n_iter = 0
+    while n_iter < max_iter:
+        n_iter += 1
+        instrument.count('iterations')
+        medoids = update_medoids(similarity, labels, k, rows, weights)
+        new_labels, best = assign(similarity, medoids, rows)
+        with instrument.phase('convergence_check'):
+            converged = np.array_equal(new_labels, labels) or (previous is not None and np.array_equal(new_labels, previous))
+        if converged:
+            labels = new_labels
+            break
+        previous, labels = labels, new_labels
+
+    return KMedoidsResult(labels, medoids, n_iter, float(_total(1 - best, weights)))
+
+
+def build(similarity, k, rows=None, block_size=1024, weights=None):
+    '''
+    Greedy PAM BUILD seeding: start from the most central point and keep
+    adding the point that lowers the total distance the most
+
+    Candidates are scored a band of similarity columns at a time, so memory
+    stays at n x block_size.
+
+    Input: SimilarityMatrix, number of clusters, optional row numbers,
+    number of candidates scored at a time, optional multiplicity of each
+    point
+    Output: array of k medoid positions
+    '''
+    rows = row_numbers(similarity, rows)
+    n = len(rows)
+
+    medoids = []
+    nearest = np.full(n, np.inf)
+    for i in range(k):
+        gain = np.empty(n)
+        for start in range(0, n, block_size):
+            D = 1 - similarity.block(rows, rows[start:start + block_size])
+            if i == 0:
+                # first medoid: smallest total distance to everything
+                gain[start:start + block_size] = -_total(D, weights)
+            else:
+                gain[start:start + block_size] = _total(np.maximum(nearest[:, None] - D, 0), weights)
+        gain[medoids] = -np.inf
+        new = int(np.argmax(gain))
+        medoids.append(new)
+        nearest = np.minimum(nearest, 1 - similarity.block(rows, rows[[new]])[:, 0])
+    return np.array(medoids, dtype=np.intp)
+
+
+def plus_plus(similarity, k, rows=None, random_state=None, weights=None):
+    '''
+    k-medoids++ seeding: each new medoid is drawn with probability
+    proportional to the squared distance to the nearest medoid chosen so far
+
+    Only one similarity row is computed per medoid (O(nk) in total).
+
+    Input: SimilarityMatrix, number of clusters, optional row numbers, seed /
+    generator, optional multiplicity of each point
+    Output: array of k medoid positions
+    '''
+    rows = row_numbers(similarity, rows)
+    n = len(rows)
+    rng = check_random_state(random_state)
+
+    if weights is None:
+        medoids = [int(rng.choice(n))]
+    else:
+        medoids = [int(rng.choice(n, p = weights/np.sum(weights)))]
+    nearest = 1 - similarity.block(rows, rows[medoids])[:, 0]
+    for i in range(1, k):
+        p = np.maximum(nearest, 0)**2
+        if weights is not None:
+            p = p*weights
+        p[medoids] = 0
+        if p.sum() > 0:
+            new = int(rng.choice(n, p = p/p.sum()))
+        else:
+            # everything left is identical to a medoid already
+            new = int(rng.choice(np.setdiff1d(np.arange(n), medoids)))
+        medoids.append(new)
+        nearest = np.minimum(nearest, 1 - similarity.block(rows, rows[[new]])[:, 0])
+    return np.array(medoids, dtype=np.intp)
+
+
+INITS = ('random', '++', 'build')
+
+
+def init_medoids(similarity, k, init='random', rows=None, random_state=None, weights=None):
+    '''
+    Pick starting medoids
+
+    Input: SimilarityMatrix, number of clusters, seeding ('random': uniform
+    without replacement, '++': distance weighted, 'build': greedy PAM BUILD),
+    optional row numbers of the points to cluster, seed / generator,
+    optional multiplicity of each point (random draws are proportional to it)
+    Output: array of k medoid positions
+    '''
+    n = len(row_numbers(similarity, rows))
+    if not 1 <= k <= n:
+        raise ValueError("k must be between 1 and %d" % n)
+
+    with instrument.phase('init'):
+        return _init_medoids(similarity, k, init, rows, random_state, weights, n)
+
+
+def _init_medoids(similarity, k, init, rows, random_state, weights, n):
+    if init == 'random':
+        if weights is None:
+            return check_random_state(random_state).choice(n, size = k, replace = False)
+        return check_random_state(random_state).choice(n, size = k, replace = False, p = weights/np.sum(weights))
+    if init == '++':
+        return plus_plus(similarity, k, rows, random_state, weights)
+    if init == 'build':
+        return build(similarity, k, rows, weights=weights)
+    raise ValueError("unknown seeding %r (expected one of %s)" % (init, ', '.join(INITS)))
+
+
+def pam(similarity, k, medoids=None, rows=None, max_iter=100, block_size=1024, random_state=None, init='build', weights=None):
+    '''
+    k-medoids with PAM swaps, evaluated FastPAM1 style
+
+    Each round scores swapping every medoid with every non-medoid at once
+    from the distances to the nearest and second nearest medoid (O(n^2) per
+    round instead of O(k n^2)) and applies the best swap, until no swap
+    lowers the total distance. The distances are fetched once as an n x n
+    array, except from a BlockedSimilarityMatrix, which is read block_size
+    rows at a time every round so memory stays at n x block_size.
+
+    Input: SimilarityMatrix, number of clusters, optional starting medoid
+    positions (picked by init otherwise), optional row numbers of the points
+    to cluster, iteration cap, number of candidates scored at a time, seed /
+    generator and seeding (see init_medoids), optional multiplicity of each
+    point
+    Output: KMedoidsResult
+    '''
+    rows = row_numbers(similarity, rows)
+    n = len(rows)
+    if not 1 <= k <= n:
+        raise ValueError("k must be between 1 and %d" % n)
+
+    if medoids is None:
+        medoids = init_medoids(similarity, k, init, rows, random_state, weights)
+    medoids = np.array(medoids, dtype=np.intp)
+    D = None if getattr(similarity, 'path', None) else 1 - similarity.block(rows, rows)
+
+    def distances(cols):
+        # n x len(cols), from rows of the (symmetric) matrix when out of core
+        if D is not None:
+            return D[:, cols]
+        return (1 - similarity.block(rows[cols], rows)).T
+
+    n_iter = 0
+    while n_iter < max_iter:
+        n_iter += 1
+        instrument.count('iterations')
+
+        # nearest and second nearest medoid of every point
+        Dm = distances(medoids)
+        order = np.argsort(Dm, axis=1)
+        nearest = order[:, 0]
+        d1 = Dm[np.arange(n), nearest]
+        d2 = Dm[np.arange(n), order[:, 1]] if k > 1 else np.full(n, np.inf)
+        members = np.zeros((n, k))
+        members[np.arange(n), nearest] = 1 if weights is None else weights
+
+        best_delta, best_swap = 0.0, None
+        candidates = np.setdiff1d(np.arange(n), medoids)
+        for start in range(0, len(candidates), block_size):
+            x = candidates[start:start + block_size]
+            Dx = distances(x)
+
+            # points that move to x whatever medoid leaves...
+            gain = np.minimum(Dx - d1[:, None], 0)
+            # ...and, for points whose own medoid leaves, the better of x and
+            # their second nearest medoid
+            loss = np.minimum(Dx, d2[:, None]) - d1[:, None] - gain
+            delta = _total(gain, weights)[None, :] + members.T.dot(loss)
+
+            i, j = np.unravel_index(np.argmin(delta), delta.shape)
+            if delta[i, j] < best_delta - 1e-12:
+                best_delta, best_swap = delta[i, j], (i, x[j])
+
+        if best_swap is None:
+            break
+        instrument.count('swaps')
+        medoids[best_swap[0]] = best_swap[1]
+
+    labels, best = assign(similarity, medoids, rows)
+    return KMedoidsResult(labels, medoids, n_iter, float(_total(1 - best, weights)))
+
+
+def clara(similarity, k, rows=None, n_samples=5, sample_size=None, max_iter=100, random_state=None, weights=None):
+    '''
+    CLARA: run PAM on random samples and keep the medoids that fit the whole
+    data set best
+
+    Only sample x sample and n x k blocks are ever computed, so this works on
+    corpora too large for a dense n x n matrix.
+
+    Input: SimilarityMatrix, number of clusters, optional row numbers of the
+    points to cluster, number of samples, points per sample (40 + 2k by
+    default), iteration cap per PAM run, seed / generator, optional
+    multiplicity of each point (samples are drawn uniformly and PAM weighs
+    each sampled point by it, so a multiplicity counts once)
+    Output: KMedoidsResult
+    '''
+    rows = row_numbers(similarity, rows)
+    n = len(rows)
+    if not 1 <= k <= n:
+        raise ValueError("k must be between 1 and %d" % n)
+    if sample_size is None:
+        sample_size = 40 + 2*k
+    sample_size = max(min(sample_size, n), k)
+    rng = check_random_state(random_state)
+
+    result = None
+    for s in range(n_samples):
+        # carry the best medoids so far into each new sample
+        sample = rng.choice(n, size = sample_size, replace = False)
+        if result is not None:
+            sample = np.union1d(result.medoids, sample)
+
+        fit = pam(similarity, k, rows=rows[sample], max_iter=max_iter, weights=None if weights is None else weights[sample])
+        medoids = sample[fit.medoids]
+        labels, best = assign(similarity, medoids, rows)
+        cost = float(_total(1 - best, weights))
+
+        if result is None or cost < result.cost:
+            result = KMedoidsResult(labels, medoids, fit.n_iter, cost)
+
+    return result
+
+
+METHODS = ('alternate', 'pam', 'clara')
+
+
+def run(similarity, k, method='alternate', rows=None, random_state=None, init=None, weights=None):
+    '''
+    Run one of the k-medoids methods by name
+
+    Input: SimilarityMatrix, number of clusters, method name, optional row
+    numbers of the points to cluster, seed / generator, seeding (see
+    init_medoids). By default alternate seeds randomly and pam seeds with
+    BUILD, seed or no seed. Optional multiplicity of each point.
+    Output: KMedoidsResult
+    '''
+    if method == 'alternate':
+        return alternate(similarity, k, rows=rows, random_state=random_state, init=init or 'random', weights=weights)
+    if method == 'pam':
+        return pam(similarity, k, rows=rows, random_state=random_state, init=init or 'build', weights=weights)
+    if method == 'clara':
+        return clara(similarity, k, rows=rows, random_state=random_state, weights=weights)
+    raise ValueError("unknown partitioning method %r (expected one of %s)" % (method, ', '.join(METHODS)))
+
+
+def _restart(job):
+    k, method, seed, init = job
+    return run(worker['similarity'], k, method, worker['rows'], np.random.default_rng(seed), init, worker['weights'])
+
+
+def multi_restart(similarity, k, n_restarts=10, method='alternate', rows=None, random_state=None, n_workers=1, score=None, init=None, weights=None):
+    '''
+    Run independently seeded restarts and keep the best one
+
+    Restart i is seeded with the i-th child of SeedSequence(random_state),
+    so results depend only on the seed, not on the global np.random state or
+    the number of workers. BUILD being deterministic, pam restarts seed
+    randomly unless another seeding is asked for. With n_workers > 1
+    restarts run in a process pool; the encoded sites (and full matrix
+    unless method is clara) are put in shared memory once and mapped by
+    every worker rather than copied. A matrix already on disk
+    (BlockedSimilarityMatrix) is mapped from its file.
+
+    Input: SimilarityMatrix, number of clusters, number of restarts, method
+    name, optional row numbers of the points to cluster, seed (or
+    SeedSequence), number of worker processes (None for one per core),
+    optional score(result) callable where higher is better (defaults to
+    -cost), seeding (see run), optional multiplicity of each point
+    Output: MultiRestartResult
+    '''
+    rows = row_numbers(similarity, rows)
+    if not isinstance(random_state, np.random.SeedSequence):
+        random_state = np.random.SeedSequence(random_state)
+    seeds = random_state.spawn(n_restarts)
+    if method == 'pam' and init is None:
+        init = 'random'
+    jobs = [(k, method, seed, init) for seed in seeds]
+    n_workers = min(worker_count(n_workers), n_restarts)
+
+    if n_workers == 1:
+        results = [run(similarity, k, method, rows, np.random.default_rng(seed), init, weights) for seed in seeds]
+    else:
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+        with similarity_pool(similarity, n_workers, method != 'clara', rows=rows, weights=weights) as pool:
+            results = pool.map(_restart, jobs)
+
+    if score is None:
+        score = lambda result: -result.cost
+
+    restarts = []
+    for i, result in enumerate(results):
+        restarts.append({'restart': i, 'n_iter': result.n_iter, 'cost': result.cost, 'score': float(score(result))})
+    best = max(range(n_restarts), key=lambda i: restarts[i]['score'])
+
+    return MultiRestartResult(results[best], restarts[best]['score'], restarts)
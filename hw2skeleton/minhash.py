@@ -0,0 +1,216 @@
+import numpy as np
+import scipy.sparse
+from .similarity import jaccard_from_features, pad_columns
+from .utils import _ranges
+
+# a prime just above 2**32; hash values (and the empty-set sentinel) stay below it
+_PRIME = 4294967311
+
+
+def hash_parameters(n_hashes, random_state=0):
+    '''
+    Input: number of hash functions, seed
+    Output: (a, b) arrays of coefficients for h(c) = (a*(c + 1) + b) mod p
+    '''
+    rng = np.random.default_rng(random_state)
+    a = rng.integers(1, _PRIME, size=n_hashes, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, size=n_hashes, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(features, n_hashes=128, random_state=0, block_size=1024):
+    '''
+    MinHash signature of every site's residue-type set
+
+    Column c is hashed by each function independently of how many columns
+    there are, so signatures stay the same when columns are appended.
+    Two sites agree on a signature entry with probability equal to their
+    Jaccard similarity.
+
+    Input: n x m 0/1 array (the jaccard featurization), number of hash
+    functions, seed, rows per block
+    Output: n x n_hashes uint64 array (empty sets get the value p everywhere)
+    '''
+    a, b = hash_parameters(n_hashes, random_state)
+    columns = np.arange(1, features.shape[1] + 1, dtype=np.uint64)
+    H = (a[:, None]*columns[None, :] + b[:, None]) % np.uint64(_PRIME)
+
+    signatures = np.empty((len(features), n_hashes), dtype=np.uint64)
+    for start in range(0, len(features), block_size):
+        present = features[start:start + block_size, None, :] > 0
+        signatures[start:start + block_size] = np.where(present, H[None, :, :], np.uint64(_PRIME)).min(axis=2)
+    return signatures
+
+
+def band_keys(signatures, bands, rows):
+    '''
+    One 64-bit key per band of each signature
+
+    Input: n x (bands*rows) signatures (band b is entries b*rows to
+    (b + 1)*rows), number of bands, rows per band
+    Output: n x bands uint64 array; equal bands give equal keys (unequal
+    bands collide with negligible probability, which only adds a candidate)
+    '''
+    keys = np.zeros((len(signatures), bands), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for r in range(rows):
+            keys = keys*np.uint64(_PRIME) + signatures[:, r::rows][:, :bands]
+    return keys
+
+
+class MinHashIndex:
+    """
+    Locality-sensitive hashing index over MinHash signatures of residue-type
+    sets.
+
+    Signatures are cut into `bands` bands of `rows` entries; two sites
+    become candidates when they agree on a whole band, which happens with
+    probability 1 - (1 - s**rows)**bands for Jaccard similarity s. More bands
+    (or fewer rows per band) catch more true neighbors at the price of more
+    candidates to check. Candidates are ranked by their exact Jaccard
+    similarity, so only recall is approximate.
+
+    Each band is kept as its sorted keys, so a whole block of queries is
+    looked up with one searchsorted per band.
+
+    Sites with identical residue sets always share every bucket; collapse
+    them first (see the deduplication stage) when there are many.
+    """
+
+    def __init__(self, features, bands=32, rows=4, random_state=0):
+        self.features = features
+        self.bands = bands
+        self.rows = rows
+        self.random_state = random_state
+        self.signatures = minhash_signatures(features, bands*rows, random_state)
+
+        # per band: sorted keys, the ids in that order, and where each
+        # distinct key's bucket starts (plus the end)
+        self._buckets = []
+        for keys in band_keys(self.signatures, bands, rows).T:
+            order = np.argsort(keys, kind='stable')
+            unique, starts = np.unique(keys[order], return_index=True)
+            self._buckets.append((unique, order, np.append(starts, len(keys))))
+
+    def __len__(self):
+        return len(self.features)
+
+    def __repr__(self):
+        return "MinHashIndex(%d sites, %d bands x %d rows)" % (len(self), self.bands, self.rows)
+
+    def _pairs(self, signatures):
+        # (query, indexed id) for every band shared, duplicates included
+        keys = band_keys(signatures, self.bands, self.rows)
+        queries = []
+        ids = []
+        for band, (unique, order, bounds) in enumerate(self._buckets):
+            if len(unique) == 0:
+                continue
+            position = np.minimum(np.searchsorted(unique, keys[:, band]), len(unique) - 1)
+            hit = np.flatnonzero(unique[position] == keys[:, band])
+            lengths = bounds[position[hit] + 1] - bounds[position[hit]]
+            queries.append(np.repeat(hit, lengths))
+            ids.append(order[_ranges(bounds[position[hit]], lengths)])
+        if not queries:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        return np.concatenate(queries), np.concatenate(ids)
+
+    def candidates(self, signature):
+        '''
+        Input: one MinHash signature (from this index's hash functions)
+        Output: sorted array of ids of the indexed sites sharing a band with it
+        '''
+        return np.unique(self._pairs(np.asarray(signature)[None, :])[1]).astype(np.intp)
+
+    def query(self, features, k=1, exclude_self=False, block_size=1024):
+        '''
+        Most similar indexed sites for each query site
+
+        Candidates of a block of queries are found band by band, scored with
+        one row-wise product and ranked with one sort, without a per-query
+        loop.
+
+        Input: q x m 0/1 array over the same columns as the index (narrower
+        arrays are zero-padded), number of neighbors, whether query i is
+        indexed site i and should not be its own neighbor, queries per block
+        Output: (ids, similarities), both q x k, ordered from most similar;
+        slots without a candidate hold id -1 and similarity nan
+        '''
+        features = pad_columns(features, self.features.shape[1])
+        signatures = minhash_signatures(features, self.bands*self.rows, self.random_state)
+        sizes = self.features.sum(axis=1)
+
+        ids = np.full((len(features), k), -1, dtype=np.intp)
+        similarities = np.full((len(features), k), np.nan)
+        for start in range(0, len(features), block_size):
+            query, found = self._pairs(signatures[start:start + block_size])
+            query = query + start
+            pair = np.unique(query*len(self) + found)
+            query, found = pair//len(self), pair % len(self)
+            if exclude_self:
+                keep = query != found
+                query, found = query[keep], found[keep]
+            if len(query) == 0:
+                continue
+
+            # exact Jaccard of every candidate pair
+            intersection = np.einsum('ij,ij->i', features[query], self.features[found], dtype=np.float64)
+            union = features[query].sum(axis=1, dtype=np.float64) + sizes[found] - intersection
+            with np.errstate(invalid='ignore', divide='ignore'):
+                S = np.where(union > 0, intersection/union, 1.0)
+
+            # best k per query: sort by query, then similarity, then id
+            order = np.lexsort((found, -S, query))
+            query, found, S = query[order], found[order], S[order]
+            rank = np.arange(len(query)) - np.searchsorted(query, query)
+            top = rank < k
+            ids[query[top], rank[top]] = found[top]
+            similarities[query[top], rank[top]] = S[top]
+        return ids, similarities
+
+
+def nearest_centers(features, centers, bands=16, rows=2, random_state=0):
+    '''
+    Assign every site to its most similar center, looking only at the
+    centers the LSH index proposes
+
+    Sites for which no center shares a band are compared with every center,
+    so each site always gets a label.
+
+    Input: n x m 0/1 array of the sites, positions of the centers among
+    them, LSH bands and rows per band, seed
+    Output: (labels, similarity of each site to its center)
+    '''
+    centers = np.asarray(centers, dtype=np.intp)
+    index = MinHashIndex(features[centers], bands, rows, random_state)
+    labels, best = index.query(features, k=1)
+    labels, best = labels[:, 0], best[:, 0]
+
+    missed = np.flatnonzero(labels < 0)
+    if len(missed):
+        S = jaccard_from_features(features[missed], features[centers])
+        labels[missed] = np.argmax(S, axis=1)
+        best[missed] = S.max(axis=1)
+
+    labels[centers] = np.arange(len(centers))
+    best[centers] = 1.0
+    return labels, best
+
+
+def knn_graph(features, k=10, bands=32, rows=4, random_state=0):
+    '''
+    Sparse k-nearest-neighbor similarity graph in place of the dense
+    all-pairs matrix
+
+    Input: n x m 0/1 array of the sites, neighbors per site, LSH bands and
+    rows per band, seed
+    Output: n x n scipy.sparse.csr_matrix with at most k entries per row:
+    the Jaccard similarity of site i to each of its approximate nearest
+    neighbors (self excluded)
+    '''
+    index = MinHashIndex(features, bands, rows, random_state)
+    ids, similarities = index.query(features, k, exclude_self=True)
+
+    found = ids >= 0
+    row = np.repeat(np.arange(len(features)), k)[found.ravel()]
+    return scipy.sparse.csr_matrix((similarities[found], (row, ids[found])), shape=(len(features), len(features)))
@@ -0,0 +1,182 @@
+import os
+import numpy as np
+from . import medoids
+from .similarity import SimilarityMatrix, similarity_matrix, align_columns, pad_columns, fit_background, metric_kernel, _metric
+
+
+class ClusteringModel:
+    """
+    A k-medoids clustering that can be saved and grown one batch of sites at
+    a time instead of being recomputed from scratch.
+
+    The model keeps every site's name, encoding and label plus the medoid
+    positions, so new sites are placed by comparing them with the k medoids
+    only (O(k) per site). Each site's similarity to its medoid is tracked;
+    once the mean drops below its value after the last fit by more than
+    `threshold` times that value's magnitude (so the test also holds for
+    zero or negative values, as 'jaccard_z' can give), the medoids are
+    refined with alternating updates started from the current ones.
+
+    Metrics with a background ('jaccard_oe', 'jaccard_z') fit it on the
+    sites the model holds, so every update refits it and reassigns them all.
+    """
+
+    def __init__(self, names, features, labels, medoids, metric='jaccard', types=None, threshold=0.1):
+        self.names = list(names)
+        self.features = np.asarray(features)
+        self.labels = np.asarray(labels, dtype=np.intp)
+        self.medoids = np.asarray(medoids, dtype=np.intp)
+        self.metric = metric
+        self.types = None if types is None else list(types)
+        self.threshold = threshold
+        self.n_refinements = 0
+        self._fit_background()
+        self._positions = {name: i for i, name in enumerate(self.names)}
+        self.best = self._nearest(self.features)[1]
+        self.baseline = float(np.mean(self.best))
+
+    @classmethod
+    def fit(cls, active_sites, k, similarity=None, method='pam', random_state=None, init=None, metric=None, threshold=0.1):
+        '''
+        Cluster active_sites from scratch
+
+        Input: list of ActiveSite instances, number of clusters, optional
+        precomputed SimilarityMatrix covering them, method, seed and seeding
+        (see medoids.run), similarity metric, refinement threshold
+        Output: ClusteringModel
+        '''
+        similarity = similarity_matrix(active_sites, similarity, metric)
+        rows = similarity.index(active_sites)
+        result = medoids.run(similarity, k, method, rows, random_state, init)
+        return cls([site.name for site in active_sites], similarity.features[rows], result.labels, result.medoids,
+                   similarity.metric, similarity.types, threshold)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return "ClusteringModel(%d sites, k=%d, %s)" % (len(self), self.k, self.metric)
+
+    @property
+    def k(self):
+        return len(self.medoids)
+
+    def _fit_background(self):
+        self.background = fit_background(self.metric, self.types, self.features)
+        self._kernel = metric_kernel(self.metric, self.background)
+
+    def _nearest(self, features):
+        # features may be wider than the model's (new residue types)
+        S = self._kernel(features, pad_columns(self.features[self.medoids], features.shape[1]), np.float64)
+        labels = np.argmax(S, axis=1)
+        return labels, S[np.arange(len(S)), labels]
+
+    def _encode(self, active_sites, types):
+        # encode new sites over the given columns, appending any new ones
+        columns, features = _metric(self.metric).featurize(active_sites)
+        if columns is None:
+            return features
+        return align_columns(columns, features, types)
+
+    def assign(self, active_sites):
+        '''
+        Input: list of ActiveSite instances
+        Output: label of the nearest medoid for each (the model is unchanged)
+        '''
+        types = None if self.types is None else list(self.types)
+        return self._nearest(self._encode(active_sites, types))[0]
+
+    def update(self, active_sites):
+        '''
+        Add sites to the model by nearest medoid, refining the clustering if
+        the fit has degraded past the threshold
+
+        Sites whose name the model already holds replace the stored copy;
+        if that copy was a medoid, its cluster's medoid is picked again.
+
+        Input: list of ActiveSite instances
+        Output: their labels (after any refinement)
+        '''
+        features = self._encode(active_sites, self.types)
+        if self.types is not None and len(self.types) > self.features.shape[1]:
+            self.features = pad_columns(self.features, len(self.types))
+
+        positions = []
+        for site in active_sites:
+            if site.name not in self._positions:
+                self._positions[site.name] = len(self.names)
+                self.names.append(site.name)
+            positions.append(self._positions[site.name])
+        positions = np.array(positions, dtype=np.intp)
+
+        grow = len(self.names) - len(self.features)
+        if grow:
+            self.features = np.vstack([self.features, np.zeros((grow, self.features.shape[1]), dtype=self.features.dtype)])
+            self.labels = np.append(self.labels, np.zeros(grow, dtype=np.intp))
+            self.best = np.append(self.best, np.zeros(grow))
+        self.features[positions] = features
+        if self.background is None:
+            self.labels[positions], self.best[positions] = self._nearest(features)
+        else:
+            self._fit_background()
+            self.labels, self.best = self._nearest(self.features)
+            self.labels[self.medoids] = np.arange(self.k)
+        replaced = np.flatnonzero(np.isin(self.medoids, positions))
+        if len(replaced):
+            self._repick(replaced)
+
+        if np.mean(self.best) < self.baseline - abs(self.baseline)*self.threshold:
+            self.refine()
+        return self.labels[positions]
+
+    def _repick(self, clusters):
+        # new medoids for the given clusters (the most central member left,
+        # or the old medoid if it was the only one), then reassign everything
+        similarity = SimilarityMatrix.from_arrays(self.types, self.features, metric=self.metric, background=self.background)
+        for c in clusters:
+            members = np.flatnonzero(self.labels == c)
+            if len(members):
+                self.medoids[c] = members[medoids.update_medoids(similarity, np.zeros(len(members), dtype=np.intp), 1, members)[0]]
+        self.labels, self.best = self._nearest(self.features)
+        self.labels[self.medoids] = np.arange(self.k)
+
+    def refine(self):
+        '''
+        Re-optimize the medoids of the whole model, starting from the
+        current ones
+        '''
+        similarity = SimilarityMatrix.from_arrays(self.types, self.features, metric=self.metric, background=self.background)
+        result = medoids.alternate(similarity, self.k, medoids=self.medoids)
+        self.labels, self.medoids = result.labels, result.medoids
+        self.best = self._nearest(self.features)[1]
+        self.baseline = float(np.mean(self.best))
+        self.n_refinements += 1
+
+    def save(self, path):
+        '''
+        Write the model to a .npz file (replaced atomically)
+
+        Input: path
+        '''
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            np.savez(f, names=np.array(self.names, dtype=str), features=self.features, labels=self.labels,
+                     medoids=self.medoids, metric=np.array(self.metric), threshold=np.array(self.threshold),
+                     types=np.array(self.types if self.types is not None else [], dtype=str),
+                     has_types=np.array(self.types is not None), baseline=np.array(self.baseline),
+                     n_refinements=np.array(self.n_refinements))
+        os.replace(temp, path)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Input: path written by save
+        Output: ClusteringModel
+        '''
+        with np.load(path, allow_pickle=False) as saved:
+            types = [str(t) for t in saved['types']] if saved['has_types'] else None
+            model = cls([str(name) for name in saved['names']], saved['features'], saved['labels'], saved['medoids'],
+                        str(saved['metric']), types, float(saved['threshold']))
+            model.baseline = float(saved['baseline'])
+            model.n_refinements = int(saved['n_refinements'])
+        return model
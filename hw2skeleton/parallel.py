@@ -0,0 +1,110 @@
+import contextlib
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from .similarity import SimilarityMatrix
+
+
+@contextlib.contextmanager
+def share_arrays(arrays):
+    '''
+    Copy arrays into shared memory blocks once so worker processes can map
+    them instead of receiving a pickled copy each
+
+    Input: dict of name -> numpy array
+    Output: (context manager) dict of name -> (block name, shape, dtype) to
+    hand to attach_arrays; the blocks are freed on exit
+    '''
+    blocks = []
+    specs = {}
+    try:
+        for key, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            specs[key] = (block.name, array.shape, array.dtype.str)
+        yield specs
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def attach_arrays(specs):
+    '''
+    Map arrays shared by share_arrays in a worker process
+
+    Input: specs from share_arrays
+    Output: (dict of name -> read-only array view, list of blocks to keep
+    alive while the arrays are in use)
+    '''
+    arrays = {}
+    blocks = []
+    for key, (name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+        arrays[key] = array
+    return arrays, blocks
+
+
+def worker_count(n_workers):
+    '''
+    Input: requested number of worker processes (None or < 1 means one per
+    core)
+    Output: number of workers to start
+    '''
+    if n_workers is None or n_workers < 1:
+        return multiprocessing.cpu_count()
+    return n_workers
+
+
+def row_numbers(similarity, rows=None):
+    '''
+    Input: SimilarityMatrix, optional row numbers
+    Output: the row numbers as an integer array (every row by default)
+    '''
+    if rows is None:
+        return np.arange(len(similarity))
+    return np.asarray(rows, dtype=np.intp)
+
+
+# per worker process of a similarity_pool: 'similarity' rebuilt over shared
+# memory, plus each extra array by name
+worker = {}
+
+
+def _init_similarity_worker(specs, names, types, dtype, metric, background, path):
+    arrays, blocks = attach_arrays(specs)
+    worker['blocks'] = blocks
+    matrix = arrays.pop('matrix', None) if path is None else np.load(path, mmap_mode='r')
+    worker['similarity'] = SimilarityMatrix.from_arrays(types, arrays.pop('features'), matrix, dtype, metric, background)
+    for name in names:
+        worker[name] = arrays.get(name)
+
+
+@contextlib.contextmanager
+def similarity_pool(similarity, n_workers, share_matrix=True, **arrays):
+    '''
+    Start a process pool whose workers map the encoded sites (and the full
+    matrix, unless share_matrix is False) from shared memory instead of
+    receiving a pickled copy each; a matrix already on disk
+    (BlockedSimilarityMatrix) is mapped from its file. The metric's
+    background is handed over as it is, not refit in the workers.
+
+    Input: SimilarityMatrix, number of worker processes, whether workers
+    need the matrix, extra arrays by name (None is passed through as None)
+    Output: (context manager) multiprocessing.Pool whose tasks find the
+    SimilarityMatrix and the extra arrays in parallel.worker
+    '''
+    path = getattr(similarity, 'path', None)
+    shared = {'features': similarity.features}
+    if share_matrix and path is None:
+        shared['matrix'] = similarity.matrix
+    shared.update((name, array) for name, array in arrays.items() if array is not None)
+    with share_arrays(shared) as specs:
+        initargs = (specs, list(arrays), similarity.types, similarity.dtype, similarity.metric, similarity.background, path)
+        with multiprocessing.Pool(n_workers, _init_similarity_worker, initargs) as pool:
+            yield pool
@@ -0,0 +1,93 @@
+def _pyplot(path):
+    # imported on first use only; without a display, plots can still be saved
+    import matplotlib
+    if path is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _finish(plt, path):
+    if path is None:
+        plt.show()
+    else:
+        plt.savefig(path)
+        plt.close()
+
+
+COLORS = {'random': 'green', 'hierarchical': 'red', 'partition': 'blue'}
+LABELS = {'random': 'Random', 'hierarchical': 'Hierarchical', 'partition': 'Partition'}
+
+
+def quality_sweep(curves, path=None):
+    '''
+    Scatter plot of quality index against number of clusters
+
+    Input: dict of method name -> (k values, quality values), optional file
+    to save to (shown on screen otherwise)
+    '''
+    plt = _pyplot(path)
+    plt.figure(facecolor = 'white')
+    for method, (k, q) in curves.items():
+        plt.scatter(k, q, alpha = 0.4, marker = 'o', color = COLORS.get(method), label = LABELS.get(method, method))
+    plt.xlim(0,20)
+    plt.xlabel('Number of Clusters')
+    plt.ylabel('Quality Index')
+    plt.grid()
+    plt.legend()
+    _finish(plt, path)
+
+
+def overlap_sweep(k, overlap, label, path=None):
+    '''
+    Scatter plot of the fraction of sites two clusterings agree on against
+    number of clusters
+
+    Input: k values, overlap fractions, legend label, optional file to save
+    to (shown on screen otherwise)
+    '''
+    plt = _pyplot(path)
+    plt.figure(facecolor = 'white')
+    plt.ylabel('Overlap of Cluster Contents')
+    plt.xlabel('Number of Clusters')
+    plt.scatter(k, overlap, marker = 'o', color = 'blue', alpha = 0.4, label = label)
+    plt.ylim(0,1)
+    plt.xlim(0,10)
+    plt.legend()
+    _finish(plt, path)
+
+
+def residue_statistics(sizes, types, totals, path=None):
+    '''
+    Histogram of residues per site and bar chart of residue type counts
+
+    Input: residues in each site, residue types, number of residues of each
+    type, optional file to save to (shown on screen otherwise)
+    '''
+    plt = _pyplot(path)
+    plt.figure(facecolor = 'white', figsize = (10,4))
+    plt.subplot(1,2,1)
+    plt.hist(sizes, bins = range(0, max(sizes) + 2))
+    plt.xlabel('Residue Number')
+    plt.ylabel('Frequency')
+    plt.subplot(1,2,2)
+    plt.bar(range(len(totals)), totals, width = 1)
+    plt.xticks(range(len(types)), types, rotation = 'vertical')
+    _finish(plt, path)
+
+
+def cooccurrence_heatmap(matrix, types, title, path=None):
+    '''
+    Heat map of a residue type x residue type matrix
+
+    Input: matrix, residue types, title, optional file to save to (shown on
+    screen otherwise)
+    '''
+    plt = _pyplot(path)
+    plt.figure(facecolor = 'white')
+    plt.imshow(matrix, interpolation = 'nearest', cmap = 'YlOrRd', vmin = 0, vmax = 0.05)
+    plt.xticks(range(len(types)), types, rotation = 'vertical')
+    plt.yticks(range(len(types)), types)
+    plt.colorbar()
+    plt.title(title)
+    _finish(plt, path)
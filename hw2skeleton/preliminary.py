@@ -1,88 +1,206 @@
+'''
+Residue statistics of active sites: residue type frequencies, observed and
+expected co-occurrence of residue types, and the Jaccard similarity expected
+between random sites of given sizes (a null model for normalizing
+similarities)
+
+usage: python -m hw2skeleton.preliminary <pdb directory> [plot file prefix]
+'''
+import sys
 import numpy as np
-from .utils import Atom, Residue, ActiveSite
-from .io import read_active_sites,write_clustering, write_mult_clusterings
-from .cluster import *
-
-datapath = '/Users/student/Documents/Algorithms/BMI203_HW2/data'
-active_sites = read_active_sites(datapath)
-
-lengths = []
-for i in active_sites:
-    lengths.append(len(i.residues))
-
-# plot histogram of number of residues in active sites
-plt.hist(lengths, bins = np.linspace(0,50,21))
-plt.xlabel('Residue Number')
-plt.ylabel('Frequency')
-plt.show()
-
-# plot histogram of types of residues in active sites
-residues_str = []
-for i in active_sites:
-    for j in i.residues:
-        residues_str.append(j.type)
-unique = list(set(residues_str))
-
-counts = np.zeros(len(unique))
-for i in enumerate(unique):
-    for j in residues:
-        if i[1] == j:
-            counts[i[0]] += 1
-
-plt.bar(left = range(len(counts)), width = 1, height = counts)
-plt.xticks([i+0.5 for i in range(len(counts))],unique, rotation = 'vertical')
-plt.xlim(0,17)
-plt.show()
-
-probs = [i/sum(counts) for i in counts]
-
-# plot co-occurence of amino acids in active sites
-residues = []
-for i in active_sites:
-    residues.append(i.residues)
-
-result = np.zeros((len(unique),len(unique)))
-for i in enumerate(unique):
-    for j in enumerate(unique):
-        for k in residues:
-            if i[1] in [aa.type for aa in k]:
-                new_list = [aa.type for aa in k]
-                new_list.remove(i[1])
-                if j[1] in new_list:
-                    result[i[0]][j[0]] += 1
-
-total = np.sum(np.sum(result))
-
-expected_result = np.zeros((len(unique),len(unique)))
-for i in enumerate(probs):
-    for j in enumerate(probs):
-        expected_result[i[0]][j[0]] = i[1]*j[1]
-
-plt.imshow(result/total, interpolation = 'nearest', cmap = 'YlOrRd', vmin = 0, vmax = 0.05)
-plt.xticks(range(17),unique, rotation = 'vertical')
-plt.yticks(range(17),unique)
-plt.colorbar()
-plt.title('Observed Co-occurence')
-plt.show()
-
-plt.imshow(expected_result, interpolation = 'nearest', cmap = 'YlOrRd', vmin = 0, vmax = 0.05)
-plt.xticks(range(17),unique, rotation = 'vertical')
-plt.yticks(range(17),unique)
-plt.colorbar()
-plt.title('Expected Co-occurence')
-plt.show()
-
-# find 'expected' Jaccard similarity for randomly generated active sites
-n = 50
-matrix = np.zeros((n,n))
-
-for sim_i in range(1,n):
-    for sim_j in range(1,n):
-        rand_data_a = np.random.choice(unique, p = probs, size = (100,sim_i))
-        rand_data_b = np.random.choice(unique, p = probs, size = (100,sim_j))
-
-        sims = []
-        for i in enumerate(rand_data_a):
-            for j in enumerate(rand_data_b):
-                sims.append(compute_jaccard_similarity(i[1],j[1]))
-        matrix[sim_i][sim_j] = np.average(sims)
+
+
+def residue_counts(active_sites, types=None):
+    '''
+    Count the residues of each type in each active site
+
+    Sites that are views into one ActiveSiteStore are counted straight from
+    its residue type codes, without building Residue objects.
+
+    Input: list of ActiveSite instances, optional list of residue types to
+    use as columns (defaults to every type seen in active_sites, sorted)
+    Output: (types, counts) where counts is an n x len(types) integer array
+    '''
+    store = active_sites[0].store if len(active_sites) else None
+    if store is not None and all(site.store is store for site in active_sites):
+        owner, codes = store.residue_type_codes([site.index for site in active_sites])
+        if types is None:
+            types = sorted(set(store.residue_types[c] for c in np.unique(codes)))
+        column = np.full(len(store.residue_types), -1, dtype=np.intp)
+        for i, t in enumerate(types):
+            if t in store.residue_types:
+                column[store.residue_types.index(t)] = i
+        if np.any(column[codes] < 0):
+            raise KeyError("residue type not in the given types")
+
+        counts = np.zeros((len(active_sites), len(types)), dtype=np.int64)
+        np.add.at(counts, (owner, column[codes]), 1)
+        return list(types), counts
+
+    if types is None:
+        types = sorted(set(r.type for site in active_sites for r in site.residues))
+    column = {t: i for i, t in enumerate(types)}
+
+    counts = np.zeros((len(active_sites), len(types)), dtype=np.int64)
+    for i, site in enumerate(active_sites):
+        for residue in site.residues:
+            counts[i, column[residue.type]] += 1
+    return list(types), counts
+
+
+def residue_frequencies(counts):
+    '''
+    Input: n x types residue count array
+    Output: fraction of all residues that are of each type
+    '''
+    totals = counts.sum(axis=0).astype(np.float64)
+    return totals/totals.sum()
+
+
+def cooccurrence(counts):
+    '''
+    Number of sites in which each pair of residue types occurs together
+
+    All pairs come from one product of the 0/1 site x type indicator matrix
+    with itself. On the diagonal, a type "co-occurs with itself" in sites
+    holding at least two residues of that type.
+
+    Input: n x types residue count array
+    Output: types x types integer array
+    '''
+    present = (counts > 0).astype(np.int64)
+    result = np.dot(present.T, present)
+    result[np.diag_indices_from(result)] = (counts >= 2).sum(axis=0)
+    return result
+
+
+def expected_cooccurrence(frequencies):
+    '''
+    Input: residue type frequencies
+    Output: types x types array of the chance of drawing each pair of types
+    '''
+    return np.outer(frequencies, frequencies)
+
+
+def expected_jaccard(frequencies, sizes_a, sizes_b=None):
+    '''
+    Jaccard similarity expected between random sites whose residues are
+    drawn independently with the given type frequencies
+
+    A site of m residues contains type t with probability 1 - (1 - p_t)^m,
+    which gives the expected size of the intersection and of the union of
+    two sites. Their ratio approximates the expected Jaccard similarity: on
+    data/ it is within 0.01 of monte_carlo_jaccard on average, and worst
+    (about 0.05 low) for sites of a single residue.
+
+    Input: residue type frequencies, site sizes along each axis (sizes_b
+    defaults to sizes_a)
+    Output: len(sizes_a) x len(sizes_b) array
+    '''
+    sizes_a = np.asarray(sizes_a, dtype=np.float64)
+    sizes_b = sizes_a if sizes_b is None else np.asarray(sizes_b, dtype=np.float64)
+    absent = 1 - np.asarray(frequencies, dtype=np.float64)
+
+    # a x types, b x types: chance that a type is missing from a site
+    missing_a = absent[None, :]**sizes_a[:, None]
+    missing_b = absent[None, :]**sizes_b[:, None]
+    intersection = np.dot(1 - missing_a, (1 - missing_b).T)
+    union = len(absent) - np.dot(missing_a, missing_b.T)
+    return intersection/union
+
+
+def _popcount(x):
+    # number of set bits of each uint64
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return table[np.ascontiguousarray(x)[..., None].view(np.uint8)].sum(axis=-1)
+
+
+def random_bitmasks(frequencies, size, n, random_state=None):
+    '''
+    Draw random sites as bitmasks of the residue types they contain
+
+    Input: residue type frequencies (at most 64 types), residues per site,
+    number of sites, seed / generator
+    Output: n uint64 bitmasks, bit t set if the site contains type t
+    '''
+    if len(frequencies) > 64:
+        raise ValueError("bitmasks hold at most 64 residue types, got %d" % len(frequencies))
+    rng = np.random.default_rng(random_state)
+    drawn = rng.choice(len(frequencies), size=(n, int(size)), p=frequencies)
+    return np.bitwise_or.reduce(np.left_shift(np.uint64(1), drawn.astype(np.uint64)), axis=1)
+
+
+def monte_carlo_jaccard(frequencies, sizes_a, sizes_b=None, n_samples=100, random_state=None):
+    '''
+    Estimate the Jaccard similarity expected between random sites (see
+    expected_jaccard) by sampling
+
+    n_samples random sites are drawn for every size, each as a bitmask, and
+    every sample of one size is compared with every sample of the other, so
+    each entry averages n_samples^2 similarities computed with bitwise and,
+    or and popcount. Without sizes_b, a second independent set is drawn for
+    each size (right after the first), so no sample is compared with itself
+    and a longer list of sizes starts with the same draws; entries (i, j)
+    and (j, i) then pool both sets of pairs, keeping the result symmetric.
+
+    Input: residue type frequencies (at most 64 types), site sizes along each
+    axis (sizes_b defaults to sizes_a), samples per size, seed / generator
+    Output: (mean, std) arrays of shape len(sizes_a) x len(sizes_b)
+    '''
+    rng = np.random.default_rng(random_state)
+    sizes_a = np.asarray(sizes_a)
+    if sizes_b is None:
+        pairs = [(random_bitmasks(frequencies, m, n_samples, rng), random_bitmasks(frequencies, m, n_samples, rng)) for m in sizes_a]
+        masks_a = np.array([a for a, b in pairs])
+        masks_b = np.array([b for a, b in pairs])
+    else:
+        masks_a = np.array([random_bitmasks(frequencies, m, n_samples, rng) for m in sizes_a])
+        masks_b = np.array([random_bitmasks(frequencies, m, n_samples, rng) for m in np.asarray(sizes_b)])
+
+    mean = np.empty((len(masks_a), len(masks_b)))
+    std = np.empty((len(masks_a), len(masks_b)))
+    for i, a in enumerate(masks_a):
+        # len(sizes_b) x n_samples x n_samples
+        a = a[None, :, None]
+        similarity = _popcount(a & masks_b[:, None, :])/_popcount(a | masks_b[:, None, :]).astype(np.float64)
+        mean[i] = similarity.mean(axis=(1, 2))
+        std[i] = similarity.std(axis=(1, 2))
+    if sizes_b is None:
+        square = (std**2 + mean**2 + (std**2 + mean**2).T)/2
+        mean = (mean + mean.T)/2
+        std = np.sqrt(np.maximum(square - mean**2, 0))
+    return mean, std
+
+
+def main(argv=None):
+    '''
+    Print the residue statistics of a directory of sites, and plot them if
+    given a file prefix
+
+    Input: argument list (sys.argv[1:] by default)
+    '''
+    from .io import read_active_sites
+
+    argv = sys.argv[1:] if argv is None else argv
+    active_sites = read_active_sites(argv[0])
+    types, counts = residue_counts(active_sites)
+    frequencies = residue_frequencies(counts)
+    observed = cooccurrence(counts)
+    sizes = counts.sum(axis=1)
+
+    print("residues per site: min %d, median %d, max %d" % (sizes.min(), np.median(sizes), sizes.max()))
+    for t, p in sorted(zip(types, frequencies), key=lambda x: -x[1]):
+        print("%s\t%.4f" % (t, p))
+
+    if len(argv) > 1:
+        from . import plots
+        prefix = argv[1]
+        plots.residue_statistics(sizes, types, counts.sum(axis=0), prefix + 'residues.png')
+        plots.cooccurrence_heatmap(observed/float(observed.sum()), types, 'Observed Co-occurence', prefix + 'observed.png')
+        plots.cooccurrence_heatmap(expected_cooccurrence(frequencies), types, 'Expected Co-occurence', prefix + 'expected.png')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import numpy as np
+from . import instrument
+from .parallel import row_numbers
+
+
+def cluster_sums(similarity, labels, k=None, rows=None, block_size=1024, weights=None):
+    '''
+    Total similarity of every point to every cluster, in one pass over the
+    similarity matrix
+
+    Each band of rows is multiplied by the n x k cluster indicator matrix, so
+    all the grouped sums the indices below need come from matrix products
+    rather than per-pair loops.
+
+    Input: SimilarityMatrix, label array, number of clusters (max label + 1
+    by default), optional row numbers of the labelled points, rows per band,
+    optional multiplicity of each point
+    Output: (P, diag) where P[i, c] is the summed similarity of point i to
+    every member of cluster c (itself included, members counted with their
+    multiplicity) and diag[i] is its self-similarity
+    '''
+    rows = row_numbers(similarity, rows)
+    labels = np.asarray(labels, dtype=np.intp)
+    if k is None:
+        k = labels.max() + 1
+    n = len(rows)
+
+    H = np.zeros((n, k))
+    H[np.arange(n), labels] = 1 if weights is None else weights
+
+    P = np.empty((n, k))
+    diag = np.empty(n)
+    with instrument.phase('cluster_sums'):
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            S = similarity.block(rows[start:stop], rows)
+            P[start:stop] = S.dot(H)
+            diag[start:stop] = S[np.arange(stop - start), np.arange(start, stop)]
+    return P, diag
+
+
+def quality_from_labels(similarity, labels, k=None, rows=None, weights=None):
+    '''
+    Size-weighted average over clusters of the ratio of average
+    intra-cluster similarity to average similarity with everything outside
+    the cluster (same index as cluster.quality_index)
+
+    Singleton and empty clusters count as zero. O(n^2) once, with no
+    membership tests. With weights, point i stands for weights[i] identical
+    points and the result equals that of the expanded data. The sums are
+    taken in a different order than the original per-pair loops, so the
+    two agree to rounding (about 1e-15 relative), not always bit for bit.
+
+    Input: SimilarityMatrix, label array, number of clusters, optional row
+    numbers of the labelled points, optional multiplicity of each point
+    Output: float
+    '''
+    labels = np.asarray(labels, dtype=np.intp)
+    P, diag = cluster_sums(similarity, labels, k, rows, weights=weights)
+    k = P.shape[1]
+    w = np.ones(len(labels)) if weights is None else np.asarray(weights, dtype=np.float64)
+    n = w.sum()
+
+    B = np.zeros((k, k))
+    np.add.at(B, labels, w[:, None]*P)          # B[c, d]: all similarities between c and d
+    self_sim = np.bincount(labels, weights=w*diag, minlength=k)
+    sizes = np.bincount(labels, weights=w, minlength=k)
+
+    within = np.diagonal(B)
+    intra = (within - self_sim)/2
+    outside = B.sum(axis=1) - within
+
+    scored = sizes > 1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ins = intra/(sizes*(sizes - 1)/2)
+        out = outside/(sizes*(n - sizes))
+        ratios = ins/out
+
+    return np.sum(ratios[scored]*sizes[scored])/n
+
+
+def silhouette(similarity, labels, k=None, rows=None):
+    '''
+    Mean silhouette width with distance = 1 - similarity
+
+    For each point, a is its average distance to the rest of its cluster and
+    b the smallest average distance to another cluster; its width is
+    (b - a)/max(a, b), and 0 for points alone in their cluster.
+
+    Input: SimilarityMatrix, label array, number of clusters, optional row
+    numbers of the labelled points
+    Output: float between -1 and 1 (higher is better)
+    '''
+    labels = np.asarray(labels, dtype=np.intp)
+    P, diag = cluster_sums(similarity, labels, k, rows)
+    n, k = P.shape
+    sizes = np.bincount(labels, minlength=k).astype(np.float64)
+    own_size = sizes[labels]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a = 1 - (P[np.arange(n), labels] - diag)/(own_size - 1)
+        other = 1 - P/sizes[None, :]
+    other[np.arange(n), labels] = np.inf
+    other[:, sizes == 0] = np.inf
+    b = other.min(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        width = (b - a)/np.maximum(a, b)
+    width[(own_size < 2) | ~np.isfinite(width)] = 0
+    return float(width.mean())
+
+
+def davies_bouldin(similarity, labels, k=None, rows=None):
+    '''
+    Davies-Bouldin index on similarities: a cluster's scatter is its average
+    intra-cluster distance and the separation of two clusters is their
+    average pairwise distance (distance = 1 - similarity)
+
+    Input: SimilarityMatrix, label array, number of clusters, optional row
+    numbers of the labelled points
+    Output: float >= 0 (lower is better); empty clusters are ignored
+    '''
+    labels = np.asarray(labels, dtype=np.intp)
+    P, diag = cluster_sums(similarity, labels, k, rows)
+    k = P.shape[1]
+
+    B = np.zeros((k, k))
+    np.add.at(B, labels, P)
+    self_sim = np.bincount(labels, weights=diag, minlength=k)
+    sizes = np.bincount(labels, minlength=k).astype(np.float64)
+
+    present = sizes > 0
+    B = B[np.ix_(present, present)]
+    self_sim = self_sim[present]
+    sizes = sizes[present]
+    if len(sizes) < 2:
+        return 0.0
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scatter = 1 - (np.diagonal(B) - self_sim)/(sizes*(sizes - 1))
+        separation = 1 - B/np.outer(sizes, sizes)
+    scatter[sizes < 2] = 0
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        R = (scatter[:, None] + scatter[None, :])/separation
+    R[np.isnan(R)] = 0                          # two identical, tight clusters
+    np.fill_diagonal(R, -np.inf)
+    return float(np.mean(R.max(axis=1)))
@@ -0,0 +1,622 @@
+import collections
+import functools
+import hashlib
+import numpy as np
+from . import instrument
+from .preliminary import expected_jaccard, monte_carlo_jaccard, residue_counts
+
+
+def encode_residue_types(active_sites, types=None):
+    '''
+    Encode each active site once as a 0/1 vector over residue types
+
+    Sites that are views into one ActiveSiteStore are encoded straight from
+    its residue type codes, without building Residue objects.
+
+    Input: list of ActiveSite instances, optional list of residue types to
+    use as columns (defaults to every type seen in active_sites, sorted)
+    Output: (types, features) where features is an n x len(types) array with
+    features[i, t] = 1 if site i contains a residue of type types[t]
+    '''
+    store = active_sites[0].store if len(active_sites) else None
+    if store is not None and all(site.store is store for site in active_sites):
+        owner, codes = store.residue_type_codes([site.index for site in active_sites])
+        if types is None:
+            types = sorted(set(store.residue_types[c] for c in np.unique(codes)))
+        column = np.full(len(store.residue_types), -1, dtype=np.intp)
+        for i, t in enumerate(types):
+            if t in store.residue_types:
+                column[store.residue_types.index(t)] = i
+        if np.any(column[codes] < 0):
+            raise KeyError("residue type not in the given types")
+
+        features = np.zeros((len(active_sites), len(types)), dtype=np.float32)
+        features[owner, column[codes]] = 1
+        return list(types), features
+
+    if types is None:
+        types = sorted(set(r.type for site in active_sites for r in site.residues))
+    column = {t: i for i, t in enumerate(types)}
+
+    features = np.zeros((len(active_sites), len(types)), dtype=np.float32)
+    for i, site in enumerate(active_sites):
+        for residue in site.residues:
+            features[i, column[residue.type]] = 1
+
+    return list(types), features
+
+
+# edges (in Angstrom) of the residue-centroid distance histogram used by the
+# geometric metric; distances past the last edge share one overflow bin
+DISTANCE_BINS = np.arange(0.0, 64.0, 4.0)
+
+
+def residue_centroids(active_site):
+    '''
+    Input: ActiveSite instance
+    Output: r x 3 array with the mean atom position of each residue
+    '''
+    store = active_site.store
+    if store is not None:
+        start = store.residue_offsets[active_site.index]
+        stop = store.residue_offsets[active_site.index + 1]
+        offsets = store.atom_offsets[start:stop + 1]
+        if stop == start:
+            return np.zeros((0, 3))
+        coords = store.coords[offsets[0]:offsets[-1]].astype(np.float64)
+        return np.add.reduceat(coords, offsets[:-1] - offsets[0])/np.diff(offsets)[:, None]
+
+    return np.array([np.mean([atom.coords for atom in residue.atoms], axis=0) for residue in active_site.residues]).reshape(-1, 3)
+
+
+def encode_distance_histograms(active_sites, bins=DISTANCE_BINS):
+    '''
+    Reduce each active site once to a fixed-length geometric descriptor: the
+    histogram of distances between all pairs of its residue centroids
+
+    Rows are stored as the square root of the normalized histogram, so the
+    Bhattacharyya coefficient between two sites is a plain dot product.
+
+    Input: list of ActiveSite instances, histogram bin edges
+    Output: n x len(bins) array (last column is the overflow bin); sites
+    with fewer than two residues get a row of zeros
+    '''
+    features = np.zeros((len(active_sites), len(bins)), dtype=np.float32)
+    edges = np.append(bins, np.inf)
+    for i, site in enumerate(active_sites):
+        centroids = residue_centroids(site)
+        if len(centroids) < 2:
+            continue
+        upper = np.triu_indices(len(centroids), 1)
+        distances = np.sqrt(((centroids[:, None, :] - centroids[None, :, :])**2).sum(axis=2))[upper]
+        counts, _ = np.histogram(distances, edges)
+        features[i] = np.sqrt(counts/float(len(distances)))
+    return features
+
+
+def bhattacharyya_from_features(features_a, features_b, dtype=np.float64):
+    '''
+    Batched Bhattacharyya coefficient between two sets of square-rooted
+    histograms: one matrix product per block
+
+    Input: arrays of shape (a, m) and (b, m) from encode_distance_histograms
+    Output: a x b array of similarities between 0 and 1 (two empty
+    descriptors count as identical)
+    '''
+    similarity = np.clip(np.dot(features_a.astype(dtype), features_b.T.astype(dtype)), 0, 1)
+    empty_a = ~features_a.any(axis=1)
+    empty_b = ~features_b.any(axis=1)
+    similarity[np.outer(empty_a, empty_b)] = 1.0
+    return similarity
+
+
+def jaccard_from_features(features_a, features_b, dtype=np.float64):
+    '''
+    Batched Jaccard similarity between two sets of 0/1 encoded sites
+
+    intersections come from a single matrix product and unions from the row
+    sums, so an a x b block costs one BLAS call instead of a*b set builds.
+
+    Input: 0/1 arrays of shape (a, m) and (b, m)
+    Output: a x b array of Jaccard similarities
+    '''
+    intersection = np.dot(features_a, features_b.T).astype(dtype)
+    union = features_a.sum(axis=1, dtype=dtype)[:, None] + features_b.sum(axis=1, dtype=dtype)[None, :] - intersection
+
+    # two empty sites are identical
+    with np.errstate(invalid='ignore', divide='ignore'):
+        similarity = intersection / union
+    similarity[union == 0] = 1.0
+    return similarity
+
+
+def align_columns(columns, features, target):
+    '''
+    Lay an encoding out over the columns of an earlier one, so encodings
+    of different sets of sites (each with its own columns) line up
+
+    Input: column names of features, n x len(columns) array, the column
+    names to align to (a list, extended in place with any it lacks)
+    Output: n x len(target) array
+    '''
+    for t in columns:
+        if t not in target:
+            target.append(t)
+    position = {t: i for i, t in enumerate(target)}
+    aligned = np.zeros((len(features), len(target)), dtype=features.dtype)
+    aligned[:, [position[t] for t in columns]] = features
+    return aligned
+
+
+def pad_columns(features, width):
+    '''
+    Input: n x m array, width >= m
+    Output: n x width array with zeros in the added columns
+    '''
+    if features.shape[1] >= width:
+        return features
+    padded = np.zeros((len(features), width), dtype=features.dtype)
+    padded[:, :features.shape[1]] = features
+    return padded
+
+
+Metric = collections.namedtuple('Metric', ['featurize', 'kernel', 'background'])
+
+# metric name -> Metric(featurize, kernel, background)
+METRICS = {}
+
+
+def register_metric(name, featurize, kernel, background=None):
+    '''
+    Make a similarity metric available by name to SimilarityMatrix and every
+    clustering function
+
+    Input: metric name, featurize(active_sites) -> (columns, features) with
+    features an n x m array whose row i depends on site i alone (columns may
+    be None), kernel(features_a, features_b, dtype) -> a x b similarities,
+    optional background(columns, features) fit on the encoding of all the
+    sites a matrix covers and then passed to the kernel as a fourth argument
+    Output: the registered Metric
+    '''
+    METRICS[name] = Metric(featurize, kernel, background)
+    return METRICS[name]
+
+
+register_metric('jaccard', encode_residue_types, jaccard_from_features)
+register_metric('geometric', lambda active_sites: (None, encode_distance_histograms(active_sites)), bhattacharyya_from_features)
+
+
+class ExpectedJaccard:
+    """
+    Jaccard similarity expected between random active sites of each pair of
+    sizes, given the background frequency of each residue type.
+
+    Values are looked up in tables indexed by (size_a, size_b), computed on
+    first use and grown (to at least double the size) when a larger site
+    comes along. The mean comes from preliminary.expected_jaccard; the
+    spread used for z-scores is sampled with preliminary.monte_carlo_jaccard
+    (n_samples sites per size, seeded, so a table grown later holds the same
+    values for the sizes it already had). A site with no residues (size 0)
+    is expected to be 1 to another empty site and 0 to any other, with no
+    spread.
+    """
+
+    def __init__(self, frequencies, n_samples=100, random_state=0):
+        self.frequencies = np.asarray(frequencies, dtype=np.float64)
+        self.n_samples = n_samples
+        self.random_state = random_state
+        self._mean = None
+        self._spread = None
+
+    def __repr__(self):
+        return "ExpectedJaccard(%d residue types)" % len(self.frequencies)
+
+    # equal backgrounds give equal similarities (used in cache keys)
+    def _key(self):
+        return (self.frequencies.tobytes(), self.n_samples, self.random_state)
+
+    def __eq__(self, other):
+        return isinstance(other, ExpectedJaccard) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _grown(self, table, sizes_a, sizes_b):
+        # the table width needed for these sizes, or None if table covers them
+        largest = int(max(np.max(sizes_a, initial=0), np.max(sizes_b, initial=0)))
+        if table is not None and largest < len(table):
+            return None
+        return max(largest, 2*(len(table) - 1) if table is not None else 0, 16)
+
+    def _table(self, values, empty):
+        # row and column 0 hold the fixed values for empty sites
+        table = np.zeros((len(values) + 1, len(values) + 1))
+        table[0, 0] = empty
+        table[1:, 1:] = values
+        return table
+
+    def mean(self, sizes_a, sizes_b):
+        '''
+        Input: integer site sizes along each axis
+        Output: len(sizes_a) x len(sizes_b) array of expected similarities
+        '''
+        largest = self._grown(self._mean, sizes_a, sizes_b)
+        if largest is not None:
+            self._mean = self._table(expected_jaccard(self.frequencies, np.arange(1, largest + 1)), 1.0)
+        return self._mean[np.ix_(sizes_a, sizes_b)]
+
+    def spread(self, sizes_a, sizes_b):
+        '''
+        Input: integer site sizes along each axis
+        Output: (mean, std) of sampled similarities, each len(sizes_a) x
+        len(sizes_b)
+        '''
+        largest = self._grown(None if self._spread is None else self._spread[0], sizes_a, sizes_b)
+        if largest is not None:
+            mean, std = monte_carlo_jaccard(self.frequencies, np.arange(1, largest + 1), n_samples=self.n_samples, random_state=self.random_state)
+            self._spread = (self._table(mean, 1.0), self._table(std, 0.0))
+        index = np.ix_(sizes_a, sizes_b)
+        return self._spread[0][index], self._spread[1][index]
+
+
+def residue_background(columns, features):
+    '''
+    Background of the size-corrected metrics ('jaccard_oe', 'jaccard_z'):
+    the residue type frequencies of the encoded sites (types in name order,
+    absent ones left out, so neither column order nor unused columns matter)
+
+    Input: columns and features from encode_sized_residue_types
+    Output: ExpectedJaccard
+    '''
+    totals = features[:, 1:].sum(axis=0, dtype=np.float64)
+    order = [i for i in np.argsort(columns[1:], kind='stable') if totals[i] > 0]
+    return ExpectedJaccard(totals[order]/totals.sum())
+
+
+def encode_sized_residue_types(active_sites):
+    '''
+    Encode each active site as its number of residues followed by its count
+    of each residue type seen in active_sites (see residue_counts)
+
+    Input: list of ActiveSite instances
+    Output: (columns, features) with columns ['#residues'] + residue types
+    '''
+    types, counts = residue_counts(active_sites)
+    features = np.zeros((len(active_sites), len(types) + 1), dtype=np.float32)
+    features[:, 0] = counts.sum(axis=1)
+    features[:, 1:] = counts
+    return ['#residues'] + types, features
+
+
+def _observed_and_sizes(features_a, features_b, dtype):
+    present_a = (features_a[:, 1:] > 0).astype(np.float32)
+    present_b = (features_b[:, 1:] > 0).astype(np.float32)
+    observed = jaccard_from_features(present_a, present_b, dtype)
+    return observed, features_a[:, 0].astype(np.intp), features_b[:, 0].astype(np.intp)
+
+
+def jaccard_oe_from_features(features_a, features_b, dtype=np.float64, background=None):
+    '''
+    Jaccard similarity divided by the similarity expected between random
+    sites of the same two sizes (1 means no more alike than chance; 0 for
+    pairs with an empty site, which carry no information)
+
+    Input: arrays of shape (a, m) and (b, m) from encode_sized_residue_types,
+    dtype, ExpectedJaccard (see residue_background)
+    Output: a x b array
+    '''
+    observed, sizes_a, sizes_b = _observed_and_sizes(features_a, features_b, dtype)
+    expected = background.mean(sizes_a, sizes_b)
+    empty = (sizes_a[:, None] == 0) | (sizes_b[None, :] == 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        oe = np.where(empty, 0.0, observed/expected)
+    return oe.astype(dtype)
+
+
+def jaccard_z_from_features(features_a, features_b, dtype=np.float64, background=None):
+    '''
+    Jaccard similarity as a z-score against random sites of the same two
+    sizes (0 where random sites of those sizes never differ, which includes
+    every pair with an empty site)
+
+    Input: arrays of shape (a, m) and (b, m) from encode_sized_residue_types,
+    dtype, ExpectedJaccard (see residue_background)
+    Output: a x b array
+    '''
+    observed, sizes_a, sizes_b = _observed_and_sizes(features_a, features_b, dtype)
+    mean, std = background.spread(sizes_a, sizes_b)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = np.where(std > 0, (observed - mean)/std, 0.0)
+    return z.astype(dtype)
+
+
+register_metric('jaccard_oe', encode_sized_residue_types, jaccard_oe_from_features, residue_background)
+register_metric('jaccard_z', encode_sized_residue_types, jaccard_z_from_features, residue_background)
+
+
+def _metric(metric):
+    if metric not in METRICS:
+        raise ValueError("unknown metric %r (expected one of %s)" % (metric, ', '.join(sorted(METRICS))))
+    return METRICS[metric]
+
+
+def fit_background(metric, columns, features):
+    '''
+    Input: metric name, an encoding of all the sites to compare
+    Output: the metric's background for them (None if it has none)
+    '''
+    background = _metric(metric).background
+    return None if background is None else background(columns, features)
+
+
+def metric_kernel(metric, background=None):
+    '''
+    Input: metric name, its background (see fit_background)
+    Output: kernel(features_a, features_b, dtype)
+    '''
+    kernel = _metric(metric).kernel
+    return kernel if background is None else functools.partial(kernel, background=background)
+
+
+# rough per-entry bookkeeping cost (key, dict slot, array header) in bytes
+_ENTRY_OVERHEAD = 200
+
+
+class SimilarityCache:
+    """
+    Memoizes per-site featurizations and similarity blocks across
+    SimilarityMatrix instances, so clustering the same sites again (with any
+    method, k or seed) skips straight to the cached work.
+
+    Featurizations are keyed by (metric, site), so a re-read or renamed
+    site is a different entry (store views of one position count as the
+    same site, and keys keep their sites alive until evicted); each row is
+    kept with its column names and lined up with the others by name, since
+    sites encoded together share columns only with each other. Blocks are
+    keyed by (metric, dtype), the metric's background and a digest of the
+    encodings along each axis, so two lists of sites share a block only if
+    they encode identically and are measured against the same background.
+    Least recently used entries are evicted to stay under max_bytes.
+    """
+
+    def __init__(self, max_bytes=256*2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return "SimilarityCache(%d entries, %d/%d bytes)" % (len(self), self.nbytes, self.max_bytes)
+
+    def get(self, key):
+        '''
+        Input: cache key
+        Output: the cached array, or None
+        '''
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        '''
+        Store an array, evicting the least recently used entries to make room
+        (arrays larger than the whole budget are not kept)
+
+        Input: cache key, numpy array (or tuple of them and None)
+        '''
+        size = _nbytes(value) + _ENTRY_OVERHEAD
+        if key in self._entries:
+            self.nbytes -= _nbytes(self._entries.pop(key)) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        while self.nbytes + size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= _nbytes(evicted) + _ENTRY_OVERHEAD
+        self._entries[key] = value
+        self.nbytes += size
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def features(self, metric, active_sites):
+        '''
+        Featurize active_sites with the given metric, only encoding the sites
+        not already cached
+
+        Input: metric name, list of ActiveSite instances
+        Output: (columns, n x m feature array)
+        '''
+        featurize = _metric(metric).featurize
+        rows = [self.get((metric, site)) for site in active_sites]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        columns, encoded = featurize([active_sites[i] for i in missing])
+        names = None if columns is None else np.array(columns, dtype=str)
+        for i, row in zip(missing, encoded):
+            rows[i] = (names, row.copy())
+            self.put((metric, active_sites[i]), rows[i])
+
+        if not rows:
+            return columns, encoded
+        if rows[0][0] is None:
+            return None, np.array([row for names, row in rows])
+        columns = []
+        aligned = [align_columns([str(c) for c in names], row[None, :], columns) for names, row in rows]
+        return columns, np.vstack([pad_columns(row, len(columns)) for row in aligned])
+
+    def block(self, metric, dtype, row_features, col_features, compute, background=None):
+        '''
+        Input: metric name, dtype, the encodings along each axis, compute()
+        -> the block (called on a miss), the metric's background
+        Output: len(row_features) x len(col_features) array
+        '''
+        key = (metric, np.dtype(dtype).str, _digest(row_features), _digest(col_features), background)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            value.flags.writeable = False       # shared by every later caller
+            self.put(key, value)
+        return value
+
+
+def _nbytes(value):
+    if isinstance(value, tuple):
+        return sum(v.nbytes for v in value if v is not None)
+    return value.nbytes
+
+
+def _digest(features):
+    # content hash of an encoding, shape and dtype included
+    features = np.ascontiguousarray(features)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((features.shape, features.dtype.str)).encode())
+    h.update(features.data)
+    return h.digest()
+
+
+# used by the clustering functions when set; off by default, turn it on with
+# similarity.CACHE = similarity.SimilarityCache()
+CACHE = None
+
+
+class SimilarityMatrix:
+    """
+    Pairwise similarities for a fixed list of ActiveSite instances.
+
+    Sites are encoded once up front by the chosen metric ('jaccard' on
+    residue types, or 'geometric' on residue-centroid distance histograms).
+    The full n x n matrix is only built the first time it is asked for;
+    smaller blocks are computed straight from the encoding so callers never
+    need more than they use. With a SimilarityCache both the encoding and
+    the full matrix are shared with earlier matrices over the same sites.
+
+    Metrics with a background ('jaccard_oe', 'jaccard_z') fit it on this
+    matrix's own sites, so similarities depend only on the sites given.
+    """
+
+    def __init__(self, active_sites, dtype=np.float64, metric='jaccard', cache=None):
+        featurize = _metric(metric).featurize
+        self.sites = list(active_sites)
+        self.dtype = dtype
+        self.metric = metric
+        self.cache = cache
+        with instrument.phase('featurize'):
+            if cache is None:
+                self.types, self.features = featurize(self.sites)
+            else:
+                self.types, self.features = cache.features(metric, self.sites)
+        self.background = fit_background(metric, self.types, self.features)
+        self._kernel = metric_kernel(metric, self.background)
+        self._positions = {site: i for i, site in enumerate(self.sites)}
+        self._matrix = None
+
+    @classmethod
+    def from_arrays(cls, types, features, matrix=None, dtype=np.float64, metric='jaccard', background=None):
+        '''
+        Rebuild a SimilarityMatrix from an existing encoding (and full matrix,
+        if one was computed), e.g. from shared memory in a worker process.
+        There are no sites to look up, so callers work with row numbers. The
+        metric's background is fit on features unless it is given.
+        '''
+        if background is None:
+            background = fit_background(metric, types, features)
+        similarity = cls.__new__(cls)
+        similarity.background = background
+        similarity._kernel = metric_kernel(metric, background)
+        similarity.sites = None
+        similarity.dtype = dtype
+        similarity.metric = metric
+        similarity.cache = None
+        similarity.types = None if types is None else list(types)
+        similarity.features = features
+        similarity._positions = {}
+        similarity._matrix = matrix
+        return similarity
+
+    def __len__(self):
+        return len(self.features)
+
+    def __repr__(self):
+        return "SimilarityMatrix(%d sites, %s)" % (len(self), self.metric)
+
+    def _evaluate(self, features_a, features_b):
+        instrument.count('similarity_evaluations', len(features_a)*len(features_b))
+        return self._kernel(features_a, features_b, self.dtype)
+
+    @property
+    def matrix(self):
+        '''
+        full n x n similarity matrix (computed once and kept)
+        '''
+        if self._matrix is None:
+            compute = lambda: self._evaluate(self.features, self.features)
+            if self.cache is None:
+                self._matrix = compute()
+            else:
+                self._matrix = self.cache.block(self.metric, self.dtype, self.features, self.features, compute, self.background)
+        return self._matrix
+
+    def index(self, active_sites):
+        '''
+        Row numbers of the given ActiveSite instances
+
+        Input: list of ActiveSite instances (all known to this matrix)
+        Output: integer array of row numbers
+        '''
+        return np.array([self._positions[site] for site in active_sites], dtype=np.intp)
+
+    def block(self, rows, cols):
+        '''
+        Similarities between two groups of sites given by row numbers
+
+        Input: integer arrays of row numbers
+        Output: len(rows) x len(cols) array
+        '''
+        rows = np.asarray(rows, dtype=np.intp)
+        cols = np.asarray(cols, dtype=np.intp)
+        if self._matrix is not None:
+            return self._matrix[np.ix_(rows, cols)]
+        return self._evaluate(self.features[rows], self.features[cols])
+
+    def iter_row_blocks(self, block_size=1024):
+        '''
+        Walk the full matrix a band of rows at a time
+
+        Output: yields (start, stop, block) with block the rows start:stop
+        against every column
+        '''
+        n = len(self)
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            if self._matrix is not None:
+                yield start, stop, self._matrix[start:stop]
+            else:
+                yield start, stop, self._evaluate(self.features[start:stop], self.features)
+
+
+def similarity_matrix(active_sites, similarity=None, metric=None):
+    '''
+    Return a SimilarityMatrix covering active_sites, reusing the given one
+    when provided (or else a new one, drawing on CACHE if it is turned on)
+
+    Input: list of ActiveSite instances, optional SimilarityMatrix, metric
+    name (to build one with, 'jaccard' by default; if a SimilarityMatrix is
+    given as well they have to agree)
+    Output: SimilarityMatrix
+    '''
+    if similarity is None:
+        similarity = SimilarityMatrix(active_sites, metric=metric or 'jaccard', cache=CACHE)
+    elif metric is not None and similarity.metric != metric:
+        raise ValueError("given a %s SimilarityMatrix but asked for metric %r" % (similarity.metric, metric))
+    return similarity
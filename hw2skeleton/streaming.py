@@ -0,0 +1,231 @@
+import itertools
+import json
+import os
+import numpy as np
+from . import medoids
+from .similarity import SimilarityMatrix, align_columns, pad_columns, fit_background, metric_kernel, _metric
+
+
+def batches(active_sites, batch_size):
+    '''
+    Input: iterable of ActiveSite instances (e.g. io.iter_active_sites),
+    sites per batch
+    Output: yields lists of at most batch_size sites
+    '''
+    active_sites = iter(active_sites)
+    while True:
+        batch = list(itertools.islice(active_sites, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class MiniBatchKMedoids:
+    """
+    k-medoids over a stream of active sites, in memory bounded by k and the
+    reservoir size rather than by the number of sites.
+
+    Each batch is assigned to the nearest current medoids. Every cluster
+    keeps a uniform reservoir sample (Algorithm R) of at most
+    reservoir_size of the sites it has received, and after each batch its
+    medoid moves to the candidate (reservoir members and the old medoid)
+    with the largest total similarity to the reservoir. Sites themselves are
+    not kept; only encodings and names in the reservoirs are.
+
+    Metrics with a background ('jaccard_oe', 'jaccard_z') fit it on the
+    sites the medoids were seeded from and keep it for the whole stream.
+    """
+
+    def __init__(self, k, metric='jaccard', reservoir_size=64, random_state=None):
+        self.k = k
+        self.metric = metric
+        self.reservoir_size = reservoir_size
+        self.rng = np.random.default_rng(random_state)
+        self.types = None
+        self.medoids = None                 # k x m encodings of the medoids
+        self.medoid_names = None
+        self.reservoirs = None              # k x reservoir_size x m
+        self.reservoir_names = [[] for c in range(k)]
+        self.filled = np.zeros(k, dtype=np.intp)
+        self.counts = np.zeros(k, dtype=np.int64)
+        self.n_seen = 0
+        self.n_batches = 0
+        self._pending = []
+        self.background = None
+        self._background_features = None    # the encoding it was fit on
+        self._kernel = metric_kernel(metric)
+
+    def __repr__(self):
+        return "MiniBatchKMedoids(k=%d, %s, %d sites seen)" % (self.k, self.metric, self.n_seen)
+
+    def _encode(self, active_sites):
+        columns, features = _metric(self.metric).featurize(active_sites)
+        if columns is None:
+            return features
+        if self.types is None:
+            self.types = []
+        features = align_columns(columns, features, self.types)
+        if self.medoids is not None and len(self.types) > self.medoids.shape[1]:
+            width = len(self.types)
+            self.medoids = pad_columns(self.medoids, width)
+            self.reservoirs = pad_columns(self.reservoirs.reshape(-1, self.reservoirs.shape[2]), width).reshape(self.k, self.reservoir_size, width)
+        return features
+
+    def _nearest(self, features):
+        S = self._kernel(features, self.medoids, np.float64)
+        labels = np.argmax(S, axis=1)
+        return labels, S[np.arange(len(S)), labels]
+
+    def _fit_background(self, features):
+        columns = None if self.types is None else self.types[:features.shape[1]]
+        self.background = fit_background(self.metric, columns, features)
+        if self.background is not None:
+            self._background_features = features
+        self._kernel = metric_kernel(self.metric, self.background)
+
+    def _start(self, features, names):
+        # seed the medoids k-medoids++ style on the first k or more sites
+        self._fit_background(features)
+        similarity = SimilarityMatrix.from_arrays(self.types, features, metric=self.metric, background=self.background)
+        first = medoids.plus_plus(similarity, self.k, random_state=self.rng)
+        self.medoids = features[first].copy()
+        self.medoid_names = [names[i] for i in first]
+        self.reservoirs = np.zeros((self.k, self.reservoir_size, features.shape[1]), dtype=features.dtype)
+
+    def _sample(self, features, names, labels):
+        for i, c in enumerate(labels):
+            self.counts[c] += 1
+            if self.filled[c] < self.reservoir_size:
+                slot = self.filled[c]
+                self.filled[c] += 1
+                self.reservoir_names[c].append(names[i])
+            else:
+                slot = self.rng.integers(self.counts[c])
+                if slot >= self.reservoir_size:
+                    continue
+                self.reservoir_names[c][slot] = names[i]
+            self.reservoirs[c, slot] = features[i]
+
+    def _update_medoids(self):
+        for c in range(self.k):
+            members = self.reservoirs[c, :self.filled[c]]
+            if len(members) == 0:
+                continue
+            candidates = np.vstack([self.medoids[c:c + 1], members])
+            total = self._kernel(candidates, members, np.float64).sum(axis=1)
+            best = int(np.argmax(total))
+            if best > 0:
+                self.medoids[c] = members[best - 1]
+                self.medoid_names[c] = self.reservoir_names[c][best - 1]
+
+    def partial_fit(self, active_sites):
+        '''
+        Consume one batch of sites
+
+        Until k sites have arrived they are only held back to seed the
+        medoids.
+
+        Input: list of ActiveSite instances
+        Output: self
+        '''
+        if not len(active_sites):
+            return self
+        features = self._encode(active_sites)
+        names = [site.name for site in active_sites]
+        self.n_seen += len(names)
+        self.n_batches += 1
+
+        if self.medoids is None:
+            self._pending.append((features, names))
+            if sum(len(n) for f, n in self._pending) < self.k:
+                return self
+            width = features.shape[1]
+            features = np.vstack([pad_columns(f, width) for f, n in self._pending])
+            names = [name for f, n in self._pending for name in n]
+            self._pending = []
+            self._start(features, names)
+
+        labels, _ = self._nearest(features)
+        self._sample(features, names, labels)
+        self._update_medoids()
+        return self
+
+    def predict(self, active_sites):
+        '''
+        Input: list of ActiveSite instances
+        Output: label of the nearest medoid for each
+        '''
+        if self.medoids is None:
+            raise ValueError("fewer than k=%d sites seen so far" % self.k)
+        return self._nearest(self._encode(active_sites))[0]
+
+    def save_checkpoint(self, path):
+        '''
+        Write the streaming state (medoids, reservoirs, counts, random state
+        and what the metric's background was fit on) to an .npz file, replaced atomically so a crash mid-write
+        leaves the last checkpoint intact
+
+        Input: path
+        '''
+        if self.medoids is None:
+            raise ValueError("nothing to checkpoint before the medoids are seeded")
+        names = np.array([name for c in range(self.k) for name in self.reservoir_names[c]], dtype=str)
+        temp = path + '.tmp'
+        with open(temp, 'wb') as f:
+            np.savez(f, k=np.array(self.k), metric=np.array(self.metric), reservoir_size=np.array(self.reservoir_size),
+                     types=np.array(self.types if self.types is not None else [], dtype=str),
+                     has_types=np.array(self.types is not None), medoids=self.medoids,
+                     medoid_names=np.array(self.medoid_names, dtype=str), reservoirs=self.reservoirs,
+                     reservoir_names=names, filled=self.filled, counts=self.counts,
+                     n_seen=np.array(self.n_seen), n_batches=np.array(self.n_batches),
+                     has_background=np.array(self.background is not None),
+                     background_features=self._background_features if self.background is not None else np.zeros((0, 0)),
+                     rng=np.array(json.dumps(self.rng.bit_generator.state)))
+        os.replace(temp, path)
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        '''
+        Input: path written by save_checkpoint
+        Output: MiniBatchKMedoids ready to continue the stream
+        '''
+        with np.load(path, allow_pickle=False) as saved:
+            model = cls(int(saved['k']), str(saved['metric']), int(saved['reservoir_size']))
+            model.types = [str(t) for t in saved['types']] if saved['has_types'] else None
+            model.medoids = saved['medoids']
+            model.medoid_names = [str(name) for name in saved['medoid_names']]
+            model.reservoirs = saved['reservoirs']
+            model.filled = saved['filled']
+            model.counts = saved['counts']
+            bounds = np.concatenate([[0], np.cumsum(model.filled)])
+            names = [str(name) for name in saved['reservoir_names']]
+            model.reservoir_names = [names[bounds[c]:bounds[c + 1]] for c in range(model.k)]
+            model.n_seen = int(saved['n_seen'])
+            model.n_batches = int(saved['n_batches'])
+            model.rng.bit_generator.state = json.loads(str(saved['rng']))
+            if saved['has_background']:
+                model._fit_background(saved['background_features'])
+        return model
+
+
+def fit_stream(active_sites, k, metric='jaccard', batch_size=256, reservoir_size=64, random_state=None,
+               checkpoint=None, checkpoint_every=10, model=None):
+    '''
+    Cluster a stream of active sites with mini-batch k-medoids
+
+    Input: iterable of ActiveSite instances (consumed once), number of
+    clusters, similarity metric, sites per batch, reservoir size per
+    cluster, seed, optional checkpoint path written every checkpoint_every
+    batches and at the end, optional model to continue (e.g. from
+    MiniBatchKMedoids.load_checkpoint)
+    Output: MiniBatchKMedoids
+    '''
+    if model is None:
+        model = MiniBatchKMedoids(k, metric, reservoir_size, random_state)
+    for batch in batches(active_sites, batch_size):
+        model.partial_fit(batch)
+        if checkpoint is not None and model.medoids is not None and model.n_batches % checkpoint_every == 0:
+            model.save_checkpoint(checkpoint)
+    if checkpoint is not None and model.medoids is not None:
+        model.save_checkpoint(checkpoint)
+    return model
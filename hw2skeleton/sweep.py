@@ -0,0 +1,158 @@
+import collections
+import numpy as np
+from . import dedup, hierarchy, medoids, scoring
+from .parallel import similarity_pool, worker, worker_count, row_numbers
+
+METHODS = ('partition', 'hierarchical', 'random')
+
+# quality of one clustering: method name, number of clusters, repetition
+SweepResult = collections.namedtuple('SweepResult', ['method', 'k', 'repetition', 'quality'])
+
+# quality statistics over the repetitions at one k
+KSummary = collections.namedtuple('KSummary', ['mean', 'std', 'min', 'max', 'n'])
+
+# results: every SweepResult (in job order), summary: method -> k ->
+# KSummary, elbow: method -> chosen k
+Sweep = collections.namedtuple('Sweep', ['results', 'summary', 'elbow'])
+
+
+def _partition(similarity, rows, weights, k, seed, algorithm, n_restarts):
+    # as cluster_by_partitioning does it
+    if n_restarts > 1:
+        score = lambda result: scoring.quality_from_labels(similarity, result.labels, k, rows, weights)
+        return medoids.multi_restart(similarity, k, n_restarts, algorithm, rows, seed, 1, score, weights=weights).best.labels
+    return medoids.run(similarity, k, algorithm, rows, np.random.default_rng(seed), weights=weights).labels
+
+
+def _evaluate(similarity, rows, profile_rows, weights, job):
+    # profile_rows and weights: the points partitioning runs on (see dedupe)
+    method, k, repetition, seed, algorithm, n_restarts = job
+    if method == 'partition':
+        labels = _partition(similarity, profile_rows, weights, k, seed, algorithm, n_restarts)
+        quality = scoring.quality_from_labels(similarity, labels, k, profile_rows, weights)
+    elif method == 'random':
+        labels = np.random.default_rng(seed).integers(0, k, size=len(rows))
+        quality = scoring.quality_from_labels(similarity, labels, k, rows)
+    else:
+        raise ValueError("unknown sweep method %r (expected one of %s)" % (method, ', '.join(METHODS)))
+    return SweepResult(method, k, repetition, float(quality))
+
+
+def _run(job):
+    return _evaluate(worker['similarity'], worker['rows'], worker['profile_rows'], worker['weights'], job)
+
+
+def iter_sweep(similarity, methods=('partition',), ks=range(2, 20), repetitions=1, rows=None, random_state=None, n_workers=1,
+               algorithm='alternate', linkage='average', n_restarts=1, dedupe=False):
+    '''
+    Cluster at every k, repeatedly, and score each clustering, yielding
+    results as soon as they are ready
+
+    Every (method, k, repetition) job gets its own child of
+    SeedSequence(random_state), so results depend only on the seed and not
+    on the number of workers or the order jobs finish in. With n_workers > 1
+    jobs run in a process pool that maps the encoded sites and the full
+    similarity matrix from shared memory (or from disk for a
+    BlockedSimilarityMatrix). A hierarchical tree is built once and cut at
+    each k; being deterministic, its repetitions repeat the same results.
+    The clustering options mean what they do for cluster_by_partitioning
+    (algorithm, n_restarts, dedupe) and cluster_hierarchically (linkage).
+
+    Input: SimilarityMatrix, method names ('partition', 'hierarchical',
+    'random'), numbers of clusters, repetitions per k, optional row numbers
+    of the points to cluster, seed, number of worker processes (None for one
+    per core), partitioning algorithm, hierarchical linkage, partitioning
+    restarts per job, whether to partition identical sites once
+    Output: yields SweepResult, in completion order when run in parallel
+    '''
+    rows = row_numbers(similarity, rows)
+    ks = list(ks)
+    methods = list(methods)
+    for method in methods:
+        if method not in METHODS:
+            raise ValueError("unknown sweep method %r (expected one of %s)" % (method, ', '.join(METHODS)))
+
+    seeds = iter(np.random.SeedSequence(random_state).spawn(len(methods)*repetitions*len(ks)))
+    jobs = [(method, k, repetition, next(seeds), algorithm, n_restarts) for method in methods for repetition in range(repetitions) for k in ks]
+    profile_rows, weights = rows, None
+    if dedupe:
+        profiles = dedup.unique_profiles(similarity, rows)
+        profile_rows, weights = profiles.rows, profiles.weights
+
+    if 'hierarchical' in methods:
+        Z = hierarchy.linkage(1 - similarity.block(rows, rows), linkage)
+        quality = {k: float(scoring.quality_from_labels(similarity, hierarchy.cut_linkage(Z, k), k, rows)) for k in ks}
+        for method, k, repetition, seed, _, _ in jobs:
+            if method == 'hierarchical':
+                yield SweepResult(method, k, repetition, quality[k])
+        jobs = [job for job in jobs if job[0] != 'hierarchical']
+
+    n_workers = min(worker_count(n_workers), max(len(jobs), 1))
+    if n_workers == 1:
+        for job in jobs:
+            yield _evaluate(similarity, rows, profile_rows, weights, job)
+        return
+
+    with similarity_pool(similarity, n_workers, rows=rows, profile_rows=profile_rows, weights=weights) as pool:
+        for result in pool.imap_unordered(_run, jobs):
+            yield result
+
+
+def elbow(ks, values):
+    '''
+    Pick the elbow of a curve as the point farthest from the straight line
+    through its first and last points (after scaling both axes to [0, 1])
+
+    Input: increasing k values, one value per k
+    Output: the chosen k (the first one if the curve is flat or too short)
+    '''
+    ks = np.asarray(ks, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(ks) < 3 or values[-1] == values[0]:
+        return int(ks[0])
+    x = (ks - ks[0])/(ks[-1] - ks[0])
+    y = (values - values[0])/(values[-1] - values[0])
+    return int(ks[np.argmax(np.abs(y - x))])
+
+
+def summarize(results):
+    '''
+    Input: iterable of SweepResult
+    Output: (summary, elbow) as in Sweep, from the mean quality at each k
+    '''
+    grouped = collections.defaultdict(lambda: collections.defaultdict(list))
+    for result in results:
+        grouped[result.method][result.k].append(result.quality)
+
+    summary = {}
+    elbows = {}
+    for method, by_k in grouped.items():
+        summary[method] = {}
+        for k in sorted(by_k):
+            q = np.array(by_k[k])
+            summary[method][k] = KSummary(float(q.mean()), float(q.std()), float(q.min()), float(q.max()), len(q))
+        ks = sorted(summary[method])
+        elbows[method] = elbow(ks, [summary[method][k].mean for k in ks])
+    return summary, elbows
+
+
+def run_sweep(similarity, methods=('partition',), ks=range(2, 20), repetitions=1, rows=None, random_state=None, n_workers=1, callback=None,
+              algorithm='alternate', linkage='average', n_restarts=1, dedupe=False):
+    '''
+    Run iter_sweep to completion
+
+    Input: as iter_sweep, with an optional callback(result) called as each
+    result arrives after n_workers
+    Output: Sweep with results in job order (method, repetition, k)
+    '''
+    results = []
+    for result in iter_sweep(similarity, methods, ks, repetitions, rows, random_state, n_workers,
+                             algorithm, linkage, n_restarts, dedupe):
+        if callback is not None:
+            callback(result)
+        results.append(result)
+
+    order = {method: i for i, method in enumerate(methods)}
+    results.sort(key=lambda r: (order[r.method], r.repetition, r.k))
+    summary, elbows = summarize(results)
+    return Sweep(results, summary, elbows)
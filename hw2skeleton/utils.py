@@ -1,41 +1,417 @@
 # Some utility classes to represent a PDB structure
+#
+# Atom, Residue and ActiveSite either hold their own data (when built up one
+# line at a time, e.g. by io.read_active_site) or are thin read-only views
+# into an ActiveSiteStore, which keeps a whole corpus in a few flat arrays.
 
-class Atom:
+import array
+import json
+import os
+import numpy as np
+
+# on-disk layout written by ActiveSiteStore.save: magic, header length
+# (8 bytes, little endian), JSON header, then each array at an aligned offset
+STORE_MAGIC = b'HW2STORE'
+STORE_VERSION = 1
+_STORE_ALIGN = 64
+_STORE_ARRAYS = ('residue_offsets', 'residue_codes', 'residue_numbers', 'atom_offsets', 'atom_codes', 'coords')
+
+
+class _View:
+    # views into the same ActiveSiteStore position are equal (and hash
+    # alike); standalone objects are only equal to themselves
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if self._store is None or type(other) is not type(self):
+            return self is other
+        return self._store is other._store and self._index == other._index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        if self._store is None:
+            return object.__hash__(self)
+        return hash((id(self._store), self._index))
+
+
+class Atom(_View):
     """
-    A simple class for an amino acid residue
+    A simple class for an atom
     """
+    __slots__ = ('_type', '_coords', '_store', '_index')
 
-    def __init__(self, type):
-        self.type = type
-        self.coords = (0.0, 0.0, 0.0)
+    def __init__(self, type, store=None, index=-1):
+        self._type = type
+        self._coords = (0.0, 0.0, 0.0)
+        self._store = store
+        self._index = index
+
+    @property
+    def type(self):
+        if self._store is None:
+            return self._type
+        return self._store.atom_names[self._store.atom_codes[self._index]]
+
+    @property
+    def coords(self):
+        if self._store is None:
+            return self._coords
+        return self._store.atom_coords(self._index)
+
+    @coords.setter
+    def coords(self, value):
+        if self._store is not None:
+            raise AttributeError("atoms in an ActiveSiteStore are read-only")
+        self._coords = value
 
     # Overload the __repr__ operator to make printing simpler.
     def __repr__(self):
         return self.type
 
-class Residue:
+class Residue(_View):
     """
-    A simple class for an amino acid residue
+    A simple class for an amino acid residue (the atoms of a store view are
+    a read-only tuple, built on first access)
     """
+    __slots__ = ('_type', '_number', '_atoms', '_store', '_index')
+
+    def __init__(self, type, number, store=None, index=-1):
+        self._type = type
+        self._number = number
+        self._atoms = [] if store is None else None
+        self._store = store
+        self._index = index
 
-    def __init__(self, type, number):
-        self.type = type
-        self.number = number
-        self.atoms = []
+    @property
+    def type(self):
+        if self._store is None:
+            return self._type
+        return self._store.residue_types[self._store.residue_codes[self._index]]
+
+    @property
+    def number(self):
+        if self._store is None:
+            return self._number
+        return int(self._store.residue_numbers[self._index])
+
+    @property
+    def atoms(self):
+        if self._atoms is None:
+            offsets = self._store.atom_offsets
+            self._atoms = tuple(Atom(None, self._store, i) for i in range(offsets[self._index], offsets[self._index + 1]))
+        return self._atoms
 
     # Overload the __repr__ operator to make printing simpler.
     def __repr__(self):
         return self.type# + " " + str(self.number)
 
-class ActiveSite:
+class ActiveSite(_View):
     """
-    A simple class for an active site
+    A simple class for an active site (the residues of a store view are a
+    read-only tuple, built on first access)
     """
+    __slots__ = ('_name', '_residues', '_store', '_index')
+
+    def __init__(self, name, store=None, index=-1):
+        self._name = name
+        self._residues = [] if store is None else None
+        self._store = store
+        self._index = index
 
-    def __init__(self, name):
-        self.name = name
-        self.residues = []
+    @property
+    def name(self):
+        if self._store is None:
+            return self._name
+        return str(self._store.names[self._index])
+
+    @property
+    def residues(self):
+        if self._residues is None:
+            offsets = self._store.residue_offsets
+            self._residues = tuple(Residue(None, None, self._store, i) for i in range(offsets[self._index], offsets[self._index + 1]))
+        return self._residues
+
+    @property
+    def store(self):
+        '''
+        the ActiveSiteStore this site is a view into (None if standalone)
+        '''
+        return self._store
+
+    @property
+    def index(self):
+        '''
+        position of this site in its ActiveSiteStore
+        '''
+        return self._index
 
     # Overload the __repr__ operator to make printing simpler.
     def __repr__(self):
         return self.name
+
+
+class ActiveSiteStore:
+    """
+    A whole corpus of active sites as flat arrays (structure of arrays).
+
+    Site i owns residues residue_offsets[i]:residue_offsets[i+1], and residue
+    j owns atoms atom_offsets[j]:atom_offsets[j+1]. Residue types and atom
+    names are small integer codes into the residue_types and atom_names
+    vocabularies; coordinates are float32. Compared to one Python object per
+    atom this is roughly 20 bytes per atom instead of several hundred.
+    """
+
+    def __init__(self, names, residue_offsets, residue_codes, residue_numbers, atom_offsets, atom_codes, coords, residue_types, atom_names):
+        self.names = np.asarray(names, dtype=str)
+        self.residue_offsets = np.asarray(residue_offsets, dtype=np.int64)
+        self.residue_codes = np.asarray(residue_codes, dtype=np.int16)
+        self.residue_numbers = np.asarray(residue_numbers, dtype=np.int32)
+        self.atom_offsets = np.asarray(atom_offsets, dtype=np.int64)
+        self.atom_codes = np.asarray(atom_codes, dtype=np.int16)
+        self.coords = np.asarray(coords, dtype=np.float32).reshape(-1, 3)
+        self.residue_types = list(residue_types)
+        self.atom_names = list(atom_names)
+
+    @classmethod
+    def from_sites(cls, active_sites):
+        '''
+        Pack ActiveSite instances into a store
+
+        Input: iterable of ActiveSite instances (consumed one at a time, so a
+        generator of freshly parsed sites never needs to be held in memory)
+        Output: ActiveSiteStore
+        '''
+        names = []
+        residue_offsets = array.array('q', [0])
+        residue_codes = array.array('h')
+        residue_numbers = array.array('i')
+        atom_offsets = array.array('q', [0])
+        atom_codes = array.array('h')
+        coords = array.array('f')
+        residue_types = {}
+        atom_names = {}
+
+        for site in active_sites:
+            names.append(site.name)
+            for residue in site.residues:
+                residue_codes.append(residue_types.setdefault(residue.type, len(residue_types)))
+                residue_numbers.append(residue.number)
+                for atom in residue.atoms:
+                    atom_codes.append(atom_names.setdefault(atom.type, len(atom_names)))
+                    coords.extend(atom.coords)
+                atom_offsets.append(len(atom_codes))
+            residue_offsets.append(len(residue_codes))
+
+        return cls(names, residue_offsets, residue_codes, residue_numbers, atom_offsets, atom_codes, coords, residue_types, atom_names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __repr__(self):
+        return "ActiveSiteStore(%d sites, %d residues, %d atoms)" % (len(self), len(self.residue_codes), len(self.atom_codes))
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError("site index out of range")
+        return ActiveSite(None, self, i % len(self))
+
+    def sites(self):
+        '''
+        Output: list of ActiveSite views, one per site
+        '''
+        return [ActiveSite(None, self, i) for i in range(len(self))]
+
+    @property
+    def nbytes(self):
+        '''
+        memory held by the arrays (vocabularies and names aside)
+        '''
+        return sum(a.nbytes for a in (self.residue_offsets, self.residue_codes, self.residue_numbers, self.atom_offsets, self.atom_codes, self.coords))
+
+    def atom_coords(self, i):
+        '''
+        Coordinates of atom i as a tuple of floats. PDB coordinates have three
+        decimals, so rounding the float32 values gives back exactly what was
+        parsed.
+        '''
+        x, y, z = self.coords[i]
+        return (round(float(x), 3), round(float(y), 3), round(float(z), 3))
+
+    def residue_type_codes(self, indices):
+        '''
+        Residue type codes of a group of sites, without building any objects
+
+        Input: integer array of site indices
+        Output: (owner, codes) where codes are the residue type codes of
+        every residue of those sites and owner[j] is the position in indices
+        of the site residue j belongs to
+        '''
+        indices = np.asarray(indices, dtype=np.intp)
+        starts = self.residue_offsets[indices]
+        lengths = self.residue_offsets[indices + 1] - starts
+        owner = np.repeat(np.arange(len(indices)), lengths)
+        return owner, self.residue_codes[_ranges(starts, lengths)]
+
+    def take(self, indices):
+        '''
+        Copy a subset of sites into a new store
+
+        Input: integer array of site indices
+        Output: ActiveSiteStore with those sites, in that order
+        '''
+        indices = np.asarray(indices, dtype=np.intp)
+
+        r_start = self.residue_offsets[indices]
+        r_len = self.residue_offsets[indices + 1] - r_start
+        residues = _ranges(r_start, r_len)
+
+        a_start = self.atom_offsets[residues]
+        a_len = self.atom_offsets[residues + 1] - a_start
+        atoms = _ranges(a_start, a_len)
+
+        return ActiveSiteStore(self.names[indices],
+                               np.concatenate([[0], np.cumsum(r_len)]),
+                               self.residue_codes[residues],
+                               self.residue_numbers[residues],
+                               np.concatenate([[0], np.cumsum(a_len)]),
+                               self.atom_codes[atoms],
+                               self.coords[atoms],
+                               self.residue_types,
+                               self.atom_names)
+
+    @classmethod
+    def concatenate(cls, stores):
+        '''
+        Join stores end to end, merging their vocabularies
+
+        Input: list of ActiveSiteStore
+        Output: ActiveSiteStore
+        '''
+        residue_types = {}
+        atom_names = {}
+        parts = {key: [] for key in ('names', 'residue_codes', 'residue_numbers', 'atom_codes', 'coords')}
+        residue_offsets = [np.zeros(1, dtype=np.int64)]
+        atom_offsets = [np.zeros(1, dtype=np.int64)]
+        n_residues = n_atoms = 0
+
+        for store in stores:
+            residue_map = np.array([residue_types.setdefault(t, len(residue_types)) for t in store.residue_types] or [0], dtype=np.int16)
+            atom_map = np.array([atom_names.setdefault(t, len(atom_names)) for t in store.atom_names] or [0], dtype=np.int16)
+
+            parts['names'].append(store.names)
+            parts['residue_codes'].append(residue_map[store.residue_codes])
+            parts['residue_numbers'].append(store.residue_numbers)
+            parts['atom_codes'].append(atom_map[store.atom_codes])
+            parts['coords'].append(store.coords)
+            residue_offsets.append(store.residue_offsets[1:] + n_residues)
+            atom_offsets.append(store.atom_offsets[1:] + n_atoms)
+            n_residues += len(store.residue_codes)
+            n_atoms += len(store.atom_codes)
+
+        def join(key, dtype, shape=(0,)):
+            return np.concatenate(parts[key]) if parts[key] else np.zeros(shape, dtype=dtype)
+
+        return cls(join('names', str),
+                   np.concatenate(residue_offsets),
+                   join('residue_codes', np.int16),
+                   join('residue_numbers', np.int32),
+                   np.concatenate(atom_offsets),
+                   join('atom_codes', np.int16),
+                   join('coords', np.float32, (0, 3)),
+                   residue_types,
+                   atom_names)
+
+    def save(self, path, metadata=None):
+        '''
+        Write the store to a single binary file that load() can memory-map
+
+        The file is written next to path and renamed into place, so readers
+        that already have the old file mapped are not disturbed.
+
+        Input: file path, optional JSON-serializable metadata to keep in the
+        header
+        Output: none
+        '''
+        header = {'version': STORE_VERSION,
+                  'names': [str(name) for name in self.names],
+                  'residue_types': self.residue_types,
+                  'atom_names': self.atom_names,
+                  'metadata': metadata,
+                  'arrays': {}}
+
+        # arrays go after the header, whose size depends on the offsets
+        # written into it, so grow the start until the header fits
+        offsets = {}
+        offset = 0
+        for key in _STORE_ARRAYS:
+            offsets[key] = offset
+            offset += -(-getattr(self, key).nbytes // _STORE_ALIGN)*_STORE_ALIGN
+        start = 0
+        while True:
+            for key in _STORE_ARRAYS:
+                a = getattr(self, key)
+                header['arrays'][key] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': start + offsets[key]}
+            encoded = json.dumps(header).encode()
+            needed = -(-(len(STORE_MAGIC) + 8 + len(encoded)) // _STORE_ALIGN)*_STORE_ALIGN
+            if needed <= start:
+                break
+            start = needed
+
+        tmp = path + '.tmp%d' % os.getpid()
+        with open(tmp, 'wb') as f:
+            f.write(STORE_MAGIC)
+            f.write(len(encoded).to_bytes(8, 'little'))
+            f.write(encoded)
+            for key in _STORE_ARRAYS:
+                f.seek(header['arrays'][key]['offset'])
+                f.write(np.ascontiguousarray(getattr(self, key)).tobytes())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def read_header(path):
+        '''
+        Input: path of a file written by save()
+        Output: its header dict
+        '''
+        with open(path, 'rb') as f:
+            if f.read(len(STORE_MAGIC)) != STORE_MAGIC:
+                raise IOError("%s is not an active site store" % path)
+            length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(length).decode())
+        if header.get('version') != STORE_VERSION:
+            raise IOError("%s has store version %r, expected %d" % (path, header.get('version'), STORE_VERSION))
+        return header
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Read a store written by save()
+
+        Input: file path, whether to memory-map the arrays (read-only and
+        shared between processes) instead of reading them into memory
+        Output: ActiveSiteStore
+        '''
+        header = cls.read_header(path)
+        arrays = {}
+        for key in _STORE_ARRAYS:
+            spec = header['arrays'][key]
+            dtype = np.dtype(spec['dtype'])
+            shape = tuple(spec['shape'])
+            if mmap and np.prod(shape) > 0:
+                arrays[key] = np.memmap(path, dtype=dtype, mode='r', offset=spec['offset'], shape=shape)
+            else:
+                with open(path, 'rb') as f:
+                    f.seek(spec['offset'])
+                    arrays[key] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+        return cls(header['names'], residue_types=header['residue_types'], atom_names=header['atom_names'], **arrays)
+
+
+def _ranges(starts, lengths):
+    '''
+    concatenation of range(s, s + l) for each start s and length l
+    '''
+    lengths = np.asarray(lengths, dtype=np.int64)
+    return np.arange(lengths.sum(), dtype=np.int64) + np.repeat(np.asarray(starts, dtype=np.int64) - np.cumsum(lengths) + lengths, lengths)
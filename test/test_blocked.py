@@ -0,0 +1,46 @@
+from hw2skeleton import blocked
+from hw2skeleton import cluster
+from hw2skeleton import io
+from hw2skeleton import medoids
+from hw2skeleton import scoring
+from hw2skeleton import similarity
+import numpy as np
+import os
+
+def test_blocked_matches_dense(tmpdir):
+    active_sites = io.read_active_sites("data")[:50]
+    dense = similarity.SimilarityMatrix(active_sites)
+
+    # small tiles, written by two processes
+    path = os.path.join(str(tmpdir), "sim.npy")
+    sim = blocked.BlockedSimilarityMatrix(active_sites, path, tile_size=16, n_workers=2)
+    assert isinstance(sim.matrix, np.memmap)
+    assert np.allclose(sim.matrix, dense.matrix, atol=1e-6)
+    assert np.allclose(sim.block([3, 1], [40, 2, 0]), dense.block([3, 1], [40, 2, 0]), atol=1e-6)
+
+    # and reopens without recomputing
+    again = blocked.BlockedSimilarityMatrix.load(path, active_sites)
+    assert np.array_equal(again.matrix, sim.matrix)
+
+    half = blocked.BlockedSimilarityMatrix(active_sites, dtype=np.float16, tile_size=7)
+    assert half.matrix.dtype == np.float16
+    assert np.allclose(half.matrix, dense.matrix, atol=1e-3)
+
+    # the partitioning and scoring code runs on it as on a dense matrix
+    labels = medoids.alternate(dense, 3, random_state=0).labels
+    result = medoids.alternate(sim, 3, random_state=0)
+    assert np.array_equal(result.labels, labels)
+    assert np.isclose(scoring.quality_from_labels(sim, labels), scoring.quality_from_labels(dense, labels))
+    best = medoids.multi_restart(sim, 3, n_restarts=4, random_state=0, n_workers=2)
+    assert np.isclose(best.best.cost, medoids.multi_restart(dense, 3, n_restarts=4, random_state=0).best.cost, atol=1e-4)
+    clusters = cluster.cluster_by_partitioning(active_sites, 3, similarity=sim, random_state=0)
+    assert np.isclose(cluster.quality_index(clusters, sim), cluster.quality_index(clusters, dense))
+
+    # pam and the medoid update read it a band of rows at a time
+    shapes = []
+    read = sim.block
+    sim.block = lambda rows, cols: shapes.append((len(rows), len(cols))) or read(rows, cols)
+    result = medoids.pam(sim, 3, block_size=8, random_state=0, init='random')
+    assert np.array_equal(result.medoids, medoids.pam(dense, 3, random_state=0, init='random').medoids)
+    medoids.update_medoids(sim, result.labels, 3, block_size=8)
+    assert max(r*c for r, c in shapes) <= 8*50
@@ -0,0 +1,46 @@
+from hw2skeleton import cli
+from hw2skeleton import cluster
+from hw2skeleton import io
+import json
+import numpy as np
+import os
+import subprocess
+import sys
+
+def test_cli_commands(tmpdir, capsys):
+    out = os.path.join(str(tmpdir), "clusters.txt")
+
+    # the original invocation still works
+    cli.main(["-P", "data", out])
+    assert open(out).read().count("Cluster") == 3
+
+    cli.main(["cluster", "data", out, "--method", "hierarchical", "-k", "4", "--format", "json"])
+    assert len(json.load(open(out))["clusters"]) == 4
+
+    capsys.readouterr()
+    cli.main(["evaluate", "data", "-k", "3", "--seed", "0", "--format", "json"])
+    captured = capsys.readouterr()
+    scores = json.loads(captured.out)
+    assert captured.err.startswith("Read in")
+    assert set(scores) >= {"quality", "silhouette", "davies_bouldin"}
+
+    cli.main(["compare", "data", "-k", "2", "3", "--seed", "0", "--format", "json"])
+    rows = json.loads(capsys.readouterr().out)
+    assert [r["k"] for r in rows] == [2, 3]
+    assert all(0 <= r["overlap"] <= 1 for r in rows)
+
+    plot = os.path.join(str(tmpdir), "sweep.png")
+    cli.main(["sweep", "data", "--method", "hierarchical", "--plot", plot])
+    assert os.path.exists(plot)
+
+    # sweep honours the clustering options
+    capsys.readouterr()
+    cli.main(["sweep", "data", "--method", "hierarchical", "--linkage", "single", "--min-k", "2", "--max-k", "3", "--format", "json"])
+    quality = json.loads(capsys.readouterr().out)["hierarchical"]["quality"]
+    active_sites = io.read_active_sites("data")
+    assert np.isclose(quality[0], cluster.quality_index(cluster.cluster_hierarchically(active_sites, 2, method='single')))
+
+def test_no_plotting_import():
+    # clustering alone never loads matplotlib
+    code = "import sys, hw2skeleton.cli, hw2skeleton.cluster; print('matplotlib' in sys.modules)"
+    assert subprocess.check_output([sys.executable, "-c", code]).strip() == b"False"
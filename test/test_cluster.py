@@ -1,5 +1,9 @@
 from hw2skeleton import cluster
+from hw2skeleton import dedup
 from hw2skeleton import io
+from hw2skeleton import medoids
+from hw2skeleton import similarity
+import numpy as np
 import os
 
 def test_similarity():
@@ -51,3 +55,34 @@ def test_hierarchical_clustering():
 
     # update this assertion
     assert cluster.cluster_hierarchically(active_sites,2) == [[active_sites[0]],[active_sites[1],active_sites[2]]]
+
+def test_deduplicated_clustering():
+    active_sites = io.read_active_sites("data")
+    sim = similarity.SimilarityMatrix(active_sites)
+    profiles = dedup.unique_profiles(sim)
+    assert len(profiles.rows) < len(active_sites)
+    assert profiles.weights.sum() == len(active_sites)
+    assert np.array_equal(sim.features[profiles.rows][profiles.inverse], sim.features)
+
+    # weighted profiles give the same clustering as every site on its own
+    for method in ['pam', 'alternate']:
+        full = medoids.run(sim, 4, method, init='build')
+        weighted = medoids.run(sim, 4, method, profiles.rows, init='build', weights=profiles.weights)
+        assert np.isclose(weighted.cost, full.cost)
+        assert np.array_equal(dedup.expand_labels(weighted.labels, profiles), full.labels)
+
+    clusters = cluster.cluster_by_partitioning(active_sites, 4, sim, method='pam', dedupe=True)
+    assert clusters == cluster.cluster_by_partitioning(active_sites, 4, sim, method='pam')
+
+    # random seedings start elsewhere, but still give a valid partition in
+    # which copies of a site stay together
+    for init in ['random', '++']:
+        clusters = cluster.cluster_by_partitioning(active_sites, 4, sim, random_state=0, init=init, dedupe=True)
+        assert len(clusters) == 4 and all(clusters)
+        assert sorted(map(id, cluster.flatten(clusters))) == sorted(map(id, active_sites))
+        members, labels = cluster.clusters_to_labels(clusters)
+        label = dict(zip(map(id, members), labels))
+        site_labels = np.array([label[id(site)] for site in active_sites])
+        assert np.array_equal(site_labels[profiles.rows][profiles.inverse], site_labels)
+    random_clusters = cluster.cluster_randomly(active_sites, 4)
+    assert np.isclose(cluster.quality_index(random_clusters, sim, dedupe=True), cluster.quality_index(random_clusters, sim), rtol=1e-12)
@@ -0,0 +1,26 @@
+from hw2skeleton import cluster
+from hw2skeleton import compare
+from hw2skeleton import io
+import itertools
+import numpy as np
+
+def test_compare_clusterings():
+    active_sites = io.read_active_sites("data")
+    a = cluster.cluster_by_partitioning(active_sites, 4, random_state=0)
+    b = cluster.cluster_hierarchically(active_sites, 4)
+
+    # same answer as trying every permutation of cluster labels
+    brute = max(sum(len(set(a[j]) & set(b[p[j]])) for j in range(4)) for p in itertools.permutations(range(4)))
+    agreement = compare.compare_clusterings(a, b)
+    assert agreement.overlap == brute
+    assert -1 <= agreement.ari <= 1 and 0 <= agreement.nmi <= 1
+
+    # relabelling a clustering does not change it
+    same = compare.compare_clusterings(a, a[::-1])
+    assert same.overlap == len(active_sites)
+    assert np.isclose(same.ari, 1) and np.isclose(same.nmi, 1)
+
+    # ARI of a small textbook example
+    table = compare.contingency([0, 0, 0, 1, 1, 1], [0, 0, 1, 1, 2, 2])
+    assert table.tolist() == [[2, 1, 0], [0, 1, 2]]
+    assert np.isclose(compare.adjusted_rand_index(table), 0.24242424)
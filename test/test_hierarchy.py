@@ -0,0 +1,32 @@
+from hw2skeleton import hierarchy
+from scipy.cluster import hierarchy as scipy_hierarchy
+from scipy.spatial.distance import pdist, squareform
+import numpy as np
+import pytest
+
+@pytest.mark.parametrize("method", ["single", "complete", "average", "ward"])
+def test_linkage_matches_scipy(method):
+    points = np.random.RandomState(0).rand(40, 3)
+    distances = pdist(points)
+
+    Z = hierarchy.linkage(squareform(distances), method)
+
+    assert np.allclose(Z, scipy_hierarchy.linkage(distances, method))
+
+def test_cut_linkage():
+    # two tight pairs far apart, plus a loner in the middle
+    points = np.array([[0.0], [0.1], [5.0], [10.0], [10.1]])
+    Z = hierarchy.linkage(squareform(pdist(points)), 'average')
+
+    assert list(hierarchy.cut_linkage(Z, 5)) == [0, 1, 2, 3, 4]
+    assert list(hierarchy.cut_linkage(Z, 3)) == [0, 0, 1, 2, 2]
+    assert list(hierarchy.cut_linkage(Z, 1)) == [0, 0, 0, 0, 0]
+
+def test_dendrogram_clusters():
+    points = np.array([[0.0], [0.1], [5.0], [10.0], [10.1]])
+    Z = hierarchy.linkage(squareform(pdist(points)), 'average')
+    tree = hierarchy.Dendrogram(Z, ['a', 'b', 'c', 'd', 'e'])
+
+    assert len(tree) == 5
+    assert tree.clusters(3) == [['a', 'b'], ['c'], ['d', 'e']]
+    assert tree.clusters(2) == [['a', 'b', 'c'], ['d', 'e']]
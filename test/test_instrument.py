@@ -0,0 +1,37 @@
+from hw2skeleton import cli
+from hw2skeleton import cluster
+from hw2skeleton import instrument
+from hw2skeleton import io
+import json
+import os
+
+def test_instrumentation(tmpdir):
+    active_sites = io.read_active_sites("data")
+
+    # off unless asked for
+    assert instrument.STATS is None
+    clusters, n_iter, stats = cluster.cluster_by_partitioning(active_sites, 3, random_state=0, return_n_iter=True, return_stats=True)
+    assert instrument.STATS is None
+    assert len(clusters) == 3
+    assert stats.counts['iterations'] == n_iter
+    assert stats.calls['assign'] == n_iter + 1
+    assert stats.counts['similarity_evaluations'] > 0
+    assert set(stats.timings) >= {'init', 'assign', 'update_medoids', 'convergence_check'}
+
+    clusters, stats = cluster.cluster_hierarchically(active_sites[:40], 3, return_stats='profile')
+    assert stats.counts['merges'] == 39
+    assert 'linkage' in stats.timings
+    assert 'cumulative' in stats.profile and stats.peak_memory > 0
+
+    # nested collections roll up into the outer one
+    with instrument.collect() as outer:
+        io.read_active_sites("data")
+        cluster.cluster_hierarchically(active_sites[:10], 2, return_stats=True)
+    assert outer.counts['files_parsed'] == len(active_sites)
+    assert outer.counts['merges'] == 9
+
+    path = os.path.join(str(tmpdir), "stats.json")
+    cli.main(["cluster", "data", os.path.join(str(tmpdir), "out.txt"), "--stats", path])
+    dumped = json.load(open(path))
+    assert dumped['counts']['sites_read'] == len(active_sites)
+    assert 'parse' in dumped['timings']
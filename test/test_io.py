@@ -1,6 +1,7 @@
 from hw2skeleton import io
 import pytest
 import os
+import shutil
 
 @pytest.mark.parametrize("filename,names,numbers", [
     ("276.pdb", ["HIS", "HIS", "HIS", "HIS", "ASP"], [55, 57, 201, 230, 301]),
@@ -9,10 +10,9 @@ import os
 def test_residues(filename, names, numbers):
     filepath = os.path.join("data", filename)
 
-    activesite = io.read_active_site(filepath)
-
-    assert [residue.type for residue in activesite.residues] == names
-    assert [residue.number for residue in activesite.residues] == numbers
+    for activesite in [io.read_active_site(filepath), io.read_active_site_arrays(filepath)[0]]:
+        assert [residue.type for residue in activesite.residues] == names
+        assert [residue.number for residue in activesite.residues] == numbers
 
 
 @pytest.mark.parametrize("filename,residue_number,atoms,xs,ys,zs", [
@@ -25,9 +25,56 @@ def test_residues(filename, names, numbers):
 def test_atoms(filename, residue_number, atoms, xs, ys, zs):
     filepath = os.path.join("data", filename)
 
-    activesite = io.read_active_site(filepath)
+    for activesite in [io.read_active_site(filepath), io.read_active_site_arrays(filepath)[0]]:
+        residue = activesite.residues[residue_number]
+
+        assert [atom.type for atom in residue.atoms] == atoms
+        assert [atom.coords for atom in residue.atoms] == list(zip(xs, ys, zs))
+
+
+def test_batch_parser_matches_line_parser():
+    filepaths = io.pdb_files("data")
+
+    batch = io.read_active_site_batch(filepaths)
+
+    for filepath, site in zip(filepaths, batch.sites()):
+        expected = io.read_active_site(filepath)
+        assert site.name == expected.name
+        assert [(r.type, r.number) for r in site.residues] == [(r.type, r.number) for r in expected.residues]
+        assert [[(a.type, a.coords) for a in r.atoms] for r in site.residues] == [[(a.type, a.coords) for a in r.atoms] for r in expected.residues]
+
+
+def test_cached_read_active_sites(tmpdir):
+    for filename in ["276.pdb", "4629.pdb", "10701.pdb"]:
+        shutil.copy(os.path.join("data", filename), str(tmpdir))
+    cache = str(tmpdir.join("sites.store"))
+
+    fresh = io.read_active_sites(str(tmpdir))
+    first, parsed = io.compile_cache(str(tmpdir), cache)
+    assert parsed == 3
+
+    # a warm cache parses nothing and gives back the same sites
+    second, parsed = io.compile_cache(str(tmpdir), cache)
+    assert parsed == 0
+    assert sorted(s.name for s in second.sites()) == sorted(s.name for s in fresh)
+    for site in second.sites():
+        match = [s for s in fresh if s.name == site.name][0]
+        assert [r.type for r in site.residues] == [r.type for r in match.residues]
+        assert [a.coords for a in site.residues[0].atoms] == [a.coords for a in match.residues[0].atoms]
+
+    # only added files are parsed, removed files are dropped
+    os.remove(str(tmpdir.join("276.pdb")))
+    shutil.copy(os.path.join("data", "1806.pdb"), str(tmpdir))
+    third, parsed = io.compile_cache(str(tmpdir), cache)
+    assert parsed == 1
+    assert sorted(s.name for s in third.sites()) == ["10701", "1806", "4629"]
+
 
-    residue = activesite.residues[residue_number]
+def test_parallel_and_streaming_reads():
+    serial = io.read_active_sites("data")
+    pooled = io.read_active_sites("data", n_workers=2)
+    assert [s.name for s in pooled] == [s.name for s in serial]
+    assert [[r.type for r in s.residues] for s in pooled] == [[r.type for r in s.residues] for s in serial]
 
-    assert [atom.type for atom in residue.atoms] == atoms
-    assert [atom.coords for atom in residue.atoms] == list(zip(xs, ys, zs))
+    streamed = io.iter_active_sites("data", chunksize=16, n_workers=2, ordered=False)
+    assert sorted(s.name for s in streamed) == sorted(s.name for s in serial)
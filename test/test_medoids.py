@@ -0,0 +1,69 @@
+from hw2skeleton import io
+from hw2skeleton import medoids
+from hw2skeleton import similarity
+import itertools
+import numpy as np
+import pytest
+
+@pytest.fixture(scope="module")
+def sim():
+    return similarity.SimilarityMatrix(io.read_active_sites("data")[:30])
+
+def test_pam_matches_exhaustive_search(sim):
+    D = 1 - sim.matrix
+    best = min(D[:, list(m)].min(axis=1).sum() for m in itertools.combinations(range(30), 2))
+
+    result = medoids.pam(sim, 2)
+
+    assert np.isclose(result.cost, best)
+    assert list(result.labels[result.medoids]) == [0, 1]
+
+def test_alternate_converges(sim):
+    result = medoids.alternate(sim, 3, random_state=0)
+
+    # a fixed point: recomputing centers from the labels changes nothing
+    again = medoids.update_medoids(sim, result.labels, 3)
+    assert np.array_equal(medoids.assign(sim, again)[0], result.labels)
+    assert result.n_iter >= 1
+
+def test_clara_covers_every_point(sim):
+    result = medoids.clara(sim, 3, sample_size=10, random_state=0)
+
+    assert len(result.labels) == 30
+    assert set(result.labels) == {0, 1, 2}
+    assert result.cost >= medoids.pam(sim, 3).cost - 1e-9
+
+    # multiplicities weigh the sampled points once, not the sampling too
+    ones = medoids.clara(sim, 3, sample_size=10, random_state=0, weights=np.ones(len(sim)))
+    assert np.array_equal(ones.medoids, result.medoids)
+
+def test_multi_restart_is_reproducible(sim):
+    serial = medoids.multi_restart(sim, 3, 4, random_state=7, n_workers=1)
+    pooled = medoids.multi_restart(sim, 3, 4, random_state=7, n_workers=2)
+
+    assert [r['cost'] for r in serial.restarts] == [r['cost'] for r in pooled.restarts]
+    assert np.array_equal(serial.best.labels, pooled.best.labels)
+    assert serial.score == max(r['score'] for r in serial.restarts)
+
+    # weights reach the workers too
+    weights = np.arange(1, len(sim) + 1)
+    serial = medoids.multi_restart(sim, 3, 4, random_state=7, n_workers=1, weights=weights)
+    pooled = medoids.multi_restart(sim, 3, 4, random_state=7, n_workers=2, weights=weights)
+    assert [r['cost'] for r in serial.restarts] == [r['cost'] for r in pooled.restarts]
+
+@pytest.mark.parametrize("init", ["random", "++", "build"])
+def test_init_medoids(sim, init):
+    start = medoids.init_medoids(sim, 5, init, random_state=0)
+
+    assert len(set(start)) == 5
+    assert medoids.alternate(sim, 5, random_state=0, init=init).n_iter >= 1
+
+def test_build_starts_from_most_central_point(sim):
+    assert medoids.build(sim, 1)[0] == np.argmax(sim.matrix.sum(axis=0))
+
+def test_pam_seeds_with_build_whatever_the_seed(sim):
+    # the seed only reaches the restarts
+    build = medoids.run(sim, 3, 'pam')
+    assert np.array_equal(medoids.run(sim, 3, 'pam', random_state=5).medoids, build.medoids)
+    restarts = medoids.multi_restart(sim, 3, 4, 'pam', random_state=5)
+    assert len(set(r['cost'] for r in restarts.restarts)) > 1
@@ -0,0 +1,53 @@
+from hw2skeleton import cluster
+from hw2skeleton import io
+from hw2skeleton import medoids
+from hw2skeleton import minhash
+from hw2skeleton import similarity
+import numpy as np
+import pytest
+
+def test_minhash_index():
+    sim = similarity.SimilarityMatrix(io.read_active_sites("data"))
+    features = sim.features
+
+    # signature agreement estimates the Jaccard similarity
+    signatures = minhash.minhash_signatures(features, n_hashes=512)
+    agreement = (signatures[:40, None, :] == signatures[None, :40, :]).mean(axis=2)
+    assert np.abs(agreement - sim.matrix[:40, :40]).mean() < 0.05
+
+    # returned neighbors carry their exact similarity; with generous banding
+    # the best candidate is nearly always a true nearest neighbor
+    index = minhash.MinHashIndex(features, bands=64, rows=2)
+    ids, found = index.query(features[:50], k=3, exclude_self=True)
+    assert np.allclose(found[ids >= 0], sim.matrix[np.arange(50)[:, None].repeat(3, 1), ids][ids >= 0])
+    off_diagonal = sim.matrix[:50] - 2*np.eye(len(sim))[:50]
+    assert np.mean(found[:, 0] == off_diagonal.max(axis=1)) > 0.9
+
+    # approximate assignment agrees with the exact one
+    centers = [0, 10, 20, 30, 40]
+    labels, best = minhash.nearest_centers(features, centers)
+    exact_labels, exact_best = medoids.assign(sim, centers)
+    assert np.mean(np.isclose(best, exact_best)) > 0.9
+    assert list(labels[centers]) == list(range(5))
+
+    graph = minhash.knn_graph(features, k=5)
+    assert graph.shape == (len(sim), len(sim))
+    assert np.all(np.diff(graph.indptr) <= 5)
+    assert graph.diagonal().sum() == 0
+
+def test_approximate_assignment_in_clustering():
+    active_sites = io.read_active_sites("data")
+    sim = similarity.SimilarityMatrix(active_sites)
+
+    np.random.seed(0)
+    exact = cluster.initialize_k_clusters(active_sites, 4, sim)
+    np.random.seed(0)
+    approximate = cluster.initialize_k_clusters(active_sites, 4, sim, approximate=True)
+    assert sorted(map(id, cluster.flatten(approximate))) == sorted(map(id, active_sites))
+    same = sum(len(set(map(id, a)) & set(map(id, b))) for a, b in zip(exact, approximate))
+    assert same > 0.9*len(active_sites)
+
+    updated = cluster.update_clusters(approximate, sim, approximate=True)
+    assert len(updated) == 4 and len(cluster.flatten(updated)) == len(active_sites)
+    with pytest.raises(ValueError):
+        cluster.update_clusters(approximate, metric='geometric', approximate=True)
@@ -0,0 +1,86 @@
+from hw2skeleton import io
+from hw2skeleton import medoids
+from hw2skeleton import model
+from hw2skeleton import similarity
+from hw2skeleton import utils
+import numpy as np
+import os
+
+def test_incremental_model(tmpdir):
+    active_sites = io.read_active_sites("data")
+    old, new = active_sites[:100], active_sites[100:]
+
+    fitted = model.ClusteringModel.fit(old, 4)
+    path = os.path.join(str(tmpdir), "model.npz")
+    fitted.save(path)
+    loaded = model.ClusteringModel.load(path)
+    assert loaded.names == fitted.names
+    assert np.array_equal(loaded.labels, fitted.labels)
+
+    # new sites go to the nearest medoid, as they would in a full assignment
+    sim = similarity.SimilarityMatrix(active_sites)
+    rows = sim.index(active_sites)
+    exact, _ = medoids.assign(sim, loaded.medoids, rows)
+    assert np.array_equal(loaded.assign(new), exact[100:])
+
+    labels = loaded.update(new)
+    assert len(loaded) == len(active_sites)
+    assert np.array_equal(labels, exact[100:]) or loaded.n_refinements > 0
+
+    # re-ingesting a site replaces it, and a strict threshold forces refinement
+    loaded.threshold = -1.0
+    loaded.update(new[:3])
+    assert len(loaded) == len(active_sites)
+    assert loaded.n_refinements >= 1
+    assert list(loaded.labels[loaded.medoids]) == list(range(4))
+
+def test_model_assign_and_replaced_medoids():
+    active_sites = io.read_active_sites("data")
+    fitted = model.ClusteringModel.fit(active_sites[:60], 3, method='alternate', random_state=0)
+    types, width = list(fitted.types), fitted.features.shape[1]
+
+    # assigning sites with residue types the model has not seen leaves it as is
+    fitted.assign(active_sites[60:])
+    assert fitted.types == types and fitted.features.shape[1] == width
+
+    # re-ingesting a medoid under different contents picks a new medoid
+    medoid = fitted.medoids[0]
+    stand_in = utils.ActiveSite(fitted.names[medoid])
+    stand_in.residues.extend(active_sites[99].residues)
+    fitted.update([stand_in])
+    assert list(fitted.labels[fitted.medoids]) == [0, 1, 2]
+    sim = similarity.SimilarityMatrix.from_arrays(fitted.types, fitted.features)
+    exact, _ = medoids.assign(sim, fitted.medoids)
+    assert np.array_equal(fitted.labels, exact)
+
+def test_model_background(tmpdir):
+    active_sites = io.read_active_sites("data")
+    fitted = model.ClusteringModel.fit(active_sites[:60], 3, metric='jaccard_oe', random_state=0)
+    assert fitted.background == similarity.SimilarityMatrix(active_sites[:60], metric='jaccard_oe').background
+
+    # the background follows the sites held, and is the same after a reload
+    fitted.update(active_sites[60:])
+    assert fitted.background == similarity.SimilarityMatrix(active_sites, metric='jaccard_oe').background
+    path = os.path.join(str(tmpdir), "model.npz")
+    fitted.save(path)
+    loaded = model.ClusteringModel.load(path)
+    assert loaded.background == fitted.background
+    assert np.array_equal(loaded.assign(active_sites), fitted.assign(active_sites))
+
+def test_model_refinement_threshold(tmpdir):
+    active_sites = io.read_active_sites("data")
+    fitted = model.ClusteringModel.fit(active_sites[:60], 3, random_state=0)
+
+    # a negative baseline still means "refine once the fit gets worse"
+    fitted.baseline = -abs(fitted.baseline)
+    fitted.threshold = 0.1
+    fitted.best[:] = fitted.baseline
+    fitted.update(active_sites[60:61])
+    assert fitted.n_refinements == 0
+    fitted.baseline, fitted.best[:] = -1.0, -2.0
+    fitted.update(active_sites[61:62])
+    assert fitted.n_refinements == 1
+
+    path = os.path.join(str(tmpdir), "model.npz")
+    fitted.save(path)
+    assert model.ClusteringModel.load(path).n_refinements == 1
@@ -0,0 +1,41 @@
+from hw2skeleton import io
+from hw2skeleton import preliminary
+import numpy as np
+
+def test_cooccurrence():
+    active_sites = io.read_active_sites("data")
+    types, counts = preliminary.residue_counts(active_sites)
+    assert counts.sum() == sum(len(site.residues) for site in active_sites)
+    assert np.isclose(preliminary.residue_frequencies(counts).sum(), 1)
+
+    # the loop the matrix product replaces: i and j both in a site, i twice if i == j
+    observed = preliminary.cooccurrence(counts)
+    for i in range(len(types)):
+        for j in range(len(types)):
+            expected = 0
+            for site in active_sites:
+                residues = [r.type for r in site.residues]
+                if types[i] in residues:
+                    residues.remove(types[i])
+                    expected += types[j] in residues
+            assert observed[i, j] == expected
+
+def test_expected_jaccard():
+    p = np.array([0.5, 0.3, 0.2])
+    # exact for two one-residue sites: chance of drawing the same type
+    mean, std = preliminary.monte_carlo_jaccard(p, [1, 20], n_samples=1000, random_state=0)
+    assert abs(mean[0, 0] - (p**2).sum()) < 0.03
+    assert mean[1, 1] > 0.95 and np.array_equal(mean, mean.T) and np.array_equal(std, std.T)
+
+    analytic = preliminary.expected_jaccard(p, [1, 20], [1, 5, 20])
+    assert analytic.shape == (2, 3)
+    assert abs(analytic[1, 2] - mean[1, 1]) < 0.02
+
+    # no sample is paired with itself on the same-size diagonal (which would
+    # pull small draws up by (1 - mean)/n_samples, 0.03 here)
+    small = [preliminary.monte_carlo_jaccard(p, [1], n_samples=20, random_state=seed)[0][0, 0] for seed in range(40)]
+    assert abs(np.mean(small) - (p**2).sum()) < 0.015
+
+    masks = preliminary.random_bitmasks(p, 3, 1000, random_state=0)
+    assert masks.dtype == np.uint64 and np.all((masks > 0) & (masks < 8))
+    assert np.array_equal(preliminary._popcount(np.array([0, 1, 7, 2**63], dtype=np.uint64)), [0, 1, 3, 1])
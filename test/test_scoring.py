@@ -0,0 +1,44 @@
+from hw2skeleton import cluster
+from hw2skeleton import io
+from hw2skeleton import scoring
+from hw2skeleton import similarity
+import numpy as np
+import pytest
+
+@pytest.fixture(scope="module")
+def sites():
+    return io.read_active_sites("data")[:40]
+
+def brute_force_quality(clusters):
+    # the original per-pair definition
+    all_data = cluster.flatten(clusters)
+    total = 0.0
+    for c in clusters:
+        if len(c) > 1:
+            ins = [cluster.compute_jaccard_similarity(a, b) for i, a in enumerate(c) for b in c[i+1:]]
+            out = [cluster.compute_jaccard_similarity(a, b) for a in c for b in all_data if b not in c]
+            total += np.average(ins)/np.average(out)*len(c)
+    return total/len(all_data)
+
+def test_quality_index_matches_pairwise_definition(sites):
+    np.random.seed(0)
+    for k in [2, 5, 9]:
+        clusters = cluster.cluster_randomly(sites, k)
+        assert np.isclose(cluster.quality_index(clusters), brute_force_quality(clusters), rtol=1e-12)
+
+def test_silhouette_and_davies_bouldin(sites):
+    sim = similarity.SimilarityMatrix(sites)
+    labels = np.arange(40) % 3
+    D = 1 - sim.matrix
+
+    widths = []
+    for i in range(40):
+        own = (labels == labels[i]) & (np.arange(40) != i)
+        a = D[i, own].mean()
+        b = min(D[i, labels == c].mean() for c in range(3) if c != labels[i])
+        widths.append((b - a)/max(a, b))
+    assert np.isclose(scoring.silhouette(sim, labels), np.mean(widths))
+
+    # a clustering where every point is in its own cluster has no scatter
+    assert scoring.davies_bouldin(sim, np.arange(40)) == 0
+    assert scoring.davies_bouldin(sim, labels) > 0
@@ -0,0 +1,170 @@
+from hw2skeleton import blocked
+from hw2skeleton import cluster
+from hw2skeleton import io
+from hw2skeleton import medoids
+from hw2skeleton import preliminary
+from hw2skeleton import similarity
+from hw2skeleton import utils
+import multiprocessing
+import numpy as np
+import pytest
+import os
+
+def test_similarity_matrix():
+
+    pdb_ids = [276, 4629, 10701]
+
+    active_sites = []
+    for id in pdb_ids:
+        filepath = os.path.join("data", "%i.pdb"%id)
+        active_sites.append(io.read_active_site(filepath))
+
+    sim = similarity.SimilarityMatrix(active_sites)
+
+    # every entry matches the pairwise metric exactly
+    for i in range(3):
+        for j in range(3):
+            assert sim.matrix[i, j] == cluster.compute_jaccard_similarity(active_sites[i], active_sites[j])
+
+    # blocks computed from the encoding agree with the full matrix
+    fresh = similarity.SimilarityMatrix(active_sites)
+    assert np.array_equal(fresh.block([2, 0], [1]), sim.matrix[[2, 0]][:, [1]])
+    assert list(sim.index([active_sites[2], active_sites[0]])) == [2, 0]
+
+def test_geometric_similarity():
+    pdb_ids = [276, 4629, 10701]
+    active_sites = [io.read_active_site(os.path.join("data", "%i.pdb"%id)) for id in pdb_ids]
+
+    # the same site rotated and shifted has the same residue geometry
+    moved = io.read_active_site(os.path.join("data", "276.pdb"))
+    rotation = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]])
+    for residue in moved.residues:
+        for atom in residue.atoms:
+            atom.coords = tuple(rotation.dot(atom.coords) + 10)
+
+    sim = similarity.SimilarityMatrix(active_sites + [moved], metric='geometric')
+
+    assert np.allclose(np.diag(sim.matrix), 1)
+    assert np.allclose(sim.matrix, sim.matrix.T)
+    assert np.isclose(sim.matrix[0, 3], 1)
+    assert np.all(sim.matrix[0, 1:3] < 1)
+
+    # and clustering functions take the metric by name
+    assert len(cluster.cluster_hierarchically(active_sites, 2, metric='geometric')) == 2
+
+@pytest.fixture
+def size_metric():
+    # a metric only needs a featurization and a batched kernel
+    size = lambda sites: (None, np.array([[len(site.residues)] for site in sites], dtype=np.float64))
+    closeness = lambda a, b, dtype: (1/(1 + np.abs(a - b.T))).astype(dtype)
+    yield similarity.register_metric('size', size, closeness)
+    del similarity.METRICS['size']
+
+def test_metric_registry_and_cache(size_metric):
+    active_sites = io.read_active_sites("data")[:20]
+
+    clusters = cluster.cluster_by_partitioning(active_sites, 3, random_state=0, metric='size')
+    assert cluster.quality_index(clusters, metric='size') > 0
+
+    cache = similarity.SimilarityCache()
+    first = similarity.SimilarityMatrix(active_sites, cache=cache)
+    assert np.array_equal(first.matrix, similarity.SimilarityMatrix(active_sites).matrix)
+    hits = cache.hits
+    second = similarity.SimilarityMatrix(active_sites[::-1][:10] + active_sites[:10], cache=cache)
+    assert cache.hits - hits == 20
+    assert second.matrix is not first.matrix
+    order = list(range(19, 9, -1)) + list(range(10))
+    assert np.array_equal(second.matrix, first.matrix[np.ix_(order, order)])
+    assert similarity.SimilarityMatrix(active_sites, cache=cache).matrix is first.matrix
+
+    # least recently used entries go first once over budget
+    small = similarity.SimilarityCache(max_bytes=3*(8 + similarity._ENTRY_OVERHEAD))
+    for i in range(4):
+        small.put(i, np.zeros(1))
+    assert small.get(0) is None and small.get(3) is not None
+    assert small.nbytes <= small.max_bytes
+
+def test_cache_keys_on_sites_and_content():
+    def site(name, residue_type):
+        s = utils.ActiveSite(name)
+        s.residues.append(utils.Residue(residue_type, 1))
+        return s
+
+    cache = similarity.SimilarityCache()
+    same = similarity.SimilarityMatrix([site("a", "ALA"), site("b", "ALA")], cache=cache).matrix
+    # same names, different sites: nothing stale comes back
+    other = similarity.SimilarityMatrix([site("a", "ALA"), site("b", "GLY")], cache=cache).matrix
+    assert np.array_equal(same, np.ones((2, 2)))
+    assert np.array_equal(other, np.eye(2))
+
+def test_columns_come_from_the_sites_given():
+    active_sites = io.read_active_sites("data")
+    # no vocabulary carried over from earlier encodings
+    similarity.SimilarityMatrix(active_sites)
+    few = similarity.SimilarityMatrix(active_sites[:5])
+    assert few.types == sorted(set(r.type for site in active_sites[:5] for r in site.residues))
+
+    # rows cached from encodings with other columns line up by name
+    for metric in ('jaccard', 'jaccard_oe'):
+        cache = similarity.SimilarityCache()
+        similarity.SimilarityMatrix(active_sites[:5], metric=metric, cache=cache)
+        similarity.SimilarityMatrix(active_sites[40:50], metric=metric, cache=cache)
+        cached = similarity.SimilarityMatrix(active_sites, metric=metric, cache=cache)
+        fresh = similarity.SimilarityMatrix(active_sites, metric=metric)
+        assert sorted(cached.types) == sorted(fresh.types)
+        assert np.allclose(cached.matrix, fresh.matrix)
+
+def test_size_corrected_jaccard():
+    active_sites = io.read_active_sites("data")
+    raw = similarity.SimilarityMatrix(active_sites).matrix
+    sizes = np.array([len(site.residues) for site in active_sites])
+
+    # measured against the residue frequencies of the matrix's own sites
+    part = similarity.SimilarityMatrix(active_sites[:20], metric='jaccard_oe')
+    oe = similarity.SimilarityMatrix(active_sites, metric='jaccard_oe')
+    background = oe.background
+    types, counts = preliminary.residue_counts(active_sites)
+    assert np.allclose(background.frequencies, preliminary.residue_frequencies(counts))
+    assert part.background != background
+    assert np.allclose(part.matrix, similarity.SimilarityMatrix(active_sites[:20], metric='jaccard_oe').matrix)
+    assert np.allclose(oe.matrix, raw/background.mean(sizes, sizes))
+    expected = background.mean([3, 12], [3, 12])
+    assert expected[0, 0] < expected[1, 1]     # bigger random sites overlap more
+
+    z = similarity.SimilarityMatrix(active_sites, metric='jaccard_z')
+    mean, std = background.spread(sizes, sizes)
+    assert np.allclose(z.matrix, (raw - mean)/std)
+    # blocks agree with the full matrix, even after the tables have grown
+    rows = np.arange(0, 136, 7)
+    assert np.allclose(similarity.SimilarityMatrix(active_sites, metric='jaccard_z').block(rows, rows), z.matrix[np.ix_(rows, rows)])
+    background.mean([200], [200])
+    assert np.allclose(similarity.SimilarityMatrix(active_sites, metric='jaccard_oe').matrix, oe.matrix)
+    small = similarity.ExpectedJaccard(background.frequencies, n_samples=20)
+    before = small.spread([1, 5, 16], [2, 16])
+    small.spread([40], [40])
+    assert np.array_equal(small.spread([1, 5, 16], [2, 16]), before)
+
+def test_size_corrected_jaccard_in_spawned_workers():
+    # workers start from a fresh interpreter and get the background passed in
+    active_sites = io.read_active_sites("data")[:60]
+    method = multiprocessing.get_start_method()
+    multiprocessing.set_start_method('spawn', force=True)
+    try:
+        dense = similarity.SimilarityMatrix(active_sites, metric='jaccard_z')
+        tiled = blocked.BlockedSimilarityMatrix(active_sites, metric='jaccard_z', tile_size=16, n_workers=2)
+        assert np.allclose(tiled.matrix, dense.matrix, atol=1e-4)
+        serial = medoids.multi_restart(dense, 3, 4, 'clara', random_state=0)
+        pooled = medoids.multi_restart(dense, 3, 4, 'clara', random_state=0, n_workers=2)
+        assert [r['cost'] for r in serial.restarts] == [r['cost'] for r in pooled.restarts]
+    finally:
+        multiprocessing.set_start_method(method, force=True)
+
+def test_size_corrected_jaccard_with_empty_site():
+    active_sites = io.read_active_sites("data")[:10] + [utils.ActiveSite("empty")]
+    for metric in ('jaccard_oe', 'jaccard_z'):
+        S = similarity.SimilarityMatrix(active_sites, metric=metric).matrix
+        assert np.all(np.isfinite(S))
+        assert np.all(S[-1] == 0) and np.all(S[:, -1] == 0)
+    background = similarity.SimilarityMatrix(active_sites, metric='jaccard_z').background
+    assert np.array_equal(background.mean([0, 3], [0]), [[1.0], [0.0]])
+    assert np.array_equal(background.spread([0], [0, 3])[1], [[0.0, 0.0]])
@@ -0,0 +1,33 @@
+from hw2skeleton import io
+from hw2skeleton import streaming
+import numpy as np
+import os
+
+def test_streaming_kmedoids(tmpdir):
+    active_sites = io.read_active_sites("data")
+
+    model = streaming.fit_stream(io.iter_active_sites("data"), 3, batch_size=20, reservoir_size=16, random_state=0)
+    assert model.n_seen == len(active_sites)
+    assert model.counts.sum() == len(active_sites)
+    assert np.all(model.filled <= 16) and model.reservoirs.shape[:2] == (3, 16)
+    labels = model.predict(active_sites)
+    assert set(labels) <= {0, 1, 2}
+    names = [site.name for site in active_sites]
+    assert all(name in names for name in model.medoid_names)
+
+    # stopping at a checkpoint and resuming gives the same model
+    path = os.path.join(str(tmpdir), "stream.npz")
+    half = streaming.fit_stream(iter(active_sites[:80]), 3, batch_size=20, reservoir_size=16, random_state=0, checkpoint=path, checkpoint_every=2)
+    resumed = streaming.MiniBatchKMedoids.load_checkpoint(path)
+    assert resumed.n_seen == 80
+    resumed = streaming.fit_stream(iter(active_sites[80:]), 3, batch_size=20, model=resumed)
+    assert resumed.medoid_names == model.medoid_names
+    assert np.array_equal(resumed.predict(active_sites), labels)
+
+def test_streaming_background_survives_checkpoint(tmpdir):
+    active_sites = io.read_active_sites("data")
+    path = os.path.join(str(tmpdir), "stream.npz")
+    model = streaming.fit_stream(iter(active_sites[:60]), 3, metric='jaccard_oe', batch_size=20, random_state=0, checkpoint=path)
+    resumed = streaming.MiniBatchKMedoids.load_checkpoint(path)
+    assert resumed.background == model.background
+    assert np.array_equal(resumed.predict(active_sites), model.predict(active_sites))
@@ -0,0 +1,53 @@
+from hw2skeleton import cluster
+from hw2skeleton import io
+from hw2skeleton import sweep
+from hw2skeleton.similarity import SimilarityMatrix
+import numpy as np
+
+def test_sweep():
+    active_sites = io.read_active_sites("data")
+    similarity = SimilarityMatrix(active_sites)
+
+    # seeded per job, so the worker count does not change the results
+    serial = sweep.run_sweep(similarity, ['partition', 'random', 'hierarchical'], range(2, 7), 2, random_state=0)
+    parallel = sweep.run_sweep(similarity, ['partition', 'random', 'hierarchical'], range(2, 7), 2, random_state=0, n_workers=2)
+    assert serial.results == parallel.results
+    assert len(serial.results) == 3*2*5
+    assert [(r.repetition, r.k) for r in serial.results[:6]] == [(0, 2), (0, 3), (0, 4), (0, 5), (0, 6), (1, 2)]
+
+    summary = serial.summary['partition'][4]
+    q = [r.quality for r in serial.results if r.method == 'partition' and r.k == 4]
+    assert summary.n == 2 and np.isclose(summary.mean, np.mean(q)) and summary.min == min(q)
+    assert serial.summary['hierarchical'][3].std == 0
+    assert set(serial.elbow) == {'partition', 'random', 'hierarchical'}
+
+    # the engine matches the clustering functions it stands in for
+    hierarchical = [r.quality for r in serial.results if r.method == "hierarchical"][:5]
+    expected = [cluster.quality_index(cluster.cluster_hierarchically(active_sites, k, similarity), similarity) for k in range(2, 7)]
+    assert np.allclose(hierarchical, expected)
+
+    # with the caller's algorithm, linkage, restarts and dedupe
+    options = sweep.run_sweep(similarity, ['partition', 'hierarchical'], range(2, 5), random_state=0, algorithm='pam', linkage='single')
+    expected = [cluster.quality_index(cluster.cluster_by_partitioning(active_sites, k, similarity, method='pam'), similarity) for k in range(2, 5)]
+    assert np.allclose([r.quality for r in options.results if r.method == 'partition'], expected)
+    expected = [cluster.quality_index(cluster.cluster_hierarchically(active_sites, k, similarity, method='single'), similarity) for k in range(2, 5)]
+    assert np.allclose([r.quality for r in options.results if r.method == 'hierarchical'], expected)
+    serial = sweep.run_sweep(similarity, ['partition'], range(2, 5), random_state=0, n_restarts=3, dedupe=True)
+    parallel = sweep.run_sweep(similarity, ['partition'], range(2, 5), random_state=0, n_workers=2, n_restarts=3, dedupe=True)
+    assert serial.results == parallel.results
+
+def test_cluster_number():
+    active_sites = io.read_active_sites("data")
+    order = [site.name for site in active_sites]
+    k, quality = cluster.test_cluster_number(cluster.cluster_by_partitioning, active_sites, 1, random_state=0)
+    assert k == list(range(2, 20)) and len(quality) == 18
+    assert [site.name for site in active_sites] == order
+    assert cluster.test_cluster_number(cluster.cluster_by_partitioning, active_sites, 1, random_state=0) == (k, quality)
+    k, single = cluster.test_cluster_number(cluster.cluster_hierarchically, active_sites, 1, method='single')
+    assert np.isclose(single[0], cluster.quality_index(cluster.cluster_hierarchically(active_sites, 2, method='single')))
+
+def test_elbow():
+    ks = np.arange(1, 11)
+    assert sweep.elbow(ks, np.minimum(ks, 4)) == 4
+    assert sweep.elbow(ks, -np.minimum(ks, 7)) == 7
+    assert sweep.elbow(ks, np.ones(10)) == 1
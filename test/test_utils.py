@@ -0,0 +1,45 @@
+from hw2skeleton import io
+from hw2skeleton import utils
+import os
+import pytest
+
+def test_store_views_match_parsed_sites():
+    parsed = [io.read_active_site(os.path.join("data", "%i.pdb" % id)) for id in [276, 4629, 10701]]
+
+    store = utils.ActiveSiteStore.from_sites(parsed)
+    views = store.sites()
+
+    assert len(store) == 3
+    for view, site in zip(views, parsed):
+        assert view.name == site.name
+        assert view.store is store
+        assert [r.type for r in view.residues] == [r.type for r in site.residues]
+        assert [r.number for r in view.residues] == [r.number for r in site.residues]
+        for r_view, r_site in zip(view.residues, site.residues):
+            assert [a.type for a in r_view.atoms] == [a.type for a in r_site.atoms]
+            assert [a.coords for a in r_view.atoms] == [a.coords for a in r_site.atoms]
+
+def test_store_residue_type_codes():
+    parsed = [io.read_active_site(os.path.join("data", "%i.pdb" % id)) for id in [276, 4629]]
+    store = utils.ActiveSiteStore.from_sites(parsed)
+
+    owner, codes = store.residue_type_codes([1, 0])
+
+    assert list(owner) == [0]*9 + [1]*5
+    assert [store.residue_types[c] for c in codes] == [r.type for r in parsed[1].residues + parsed[0].residues]
+
+def test_store_views_are_stable():
+    parsed = [io.read_active_site(os.path.join("data", "%i.pdb" % id)) for id in [276, 4629]]
+    store = utils.ActiveSiteStore.from_sites(parsed)
+
+    # views of one position are interchangeable as keys
+    assert store[0] == store.sites()[0] and hash(store[0]) == hash(store.sites()[0])
+    assert store[0] != store[1] and {store[1]: 1}[store[-1]] == 1
+    assert parsed[0] != utils.ActiveSite(parsed[0].name)
+
+    # residues and atoms are built once and cannot be changed
+    site = store[0]
+    assert site.residues is site.residues
+    assert site.residues[0].atoms is site.residues[0].atoms
+    with pytest.raises(AttributeError):
+        site.residues.append(parsed[1].residues[0])